@@ -13,6 +13,8 @@ elif [ $start_mode = "worker" ]; then
     nohup celery -A bisheng.worker.main worker -l info -c 20 -P threads -Q knowledge_celery -n knowledge@%h &
     # 工作流执行worker
     nohup celery -A bisheng.worker.main worker -l info -c 100 -P threads -Q workflow_celery -n workflow@%h &
+    # 会话溯源等答案返回后的异步处理worker
+    nohup celery -A bisheng.worker.main worker -l info -c 20 -P threads -Q chat_celery -n chat@%h &
 
     python bisheng/linsight/worker.py --worker_num 4 --max_concurrency 5
 else
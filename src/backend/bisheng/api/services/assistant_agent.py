@@ -509,30 +509,8 @@ class AssistantAgent(AssistantUtils):
             logger.error(f'record assistant history error: {str(e)}')
 
     async def trim_messages(self, messages: List[Any]) -> List[Any]:
-        # 获取encoding
-        enc = self.cl100k_base()
-
-        def get_finally_message(new_messages: List[Any]) -> List[Any]:
-            # 修剪到只有一条记录则不再处理
-            if len(new_messages) == 1:
-                return new_messages
-            total_count = 0
-            for one in new_messages:
-                if isinstance(one, HumanMessage):
-                    total_count += len(enc.encode(one.content))
-                elif isinstance(one, AIMessage):
-                    total_count += len(enc.encode(one.content))
-                    if 'tool_calls' in one.additional_kwargs:
-                        total_count += len(
-                            enc.encode(json.dumps(one.additional_kwargs['tool_calls'], ensure_ascii=False))
-                        )
-                else:
-                    total_count += len(enc.encode(str(one.content)))
-            if total_count > self.assistant.max_token:
-                return get_finally_message(new_messages[1:])
-            return new_messages
-
-        return get_finally_message(messages)
+        # 从最新的消息往前保留不超过max_token的消息，至少保留一条
+        return self.cl100k_token_counter().trim_messages(messages, self.assistant.max_token)
 
     async def run(self, query: str, chat_history: List = None, callback: Callbacks = None) -> List[BaseMessage]:
         """
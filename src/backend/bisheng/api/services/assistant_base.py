@@ -1,14 +1,19 @@
 import os
+from functools import lru_cache
 
 from tiktoken.load import load_tiktoken_bpe
 from tiktoken.core import Encoding as TikTokenEncoding
 
+from bisheng_langchain.utils.token_budget import TokenCounter
+
 
 class AssistantUtils:
     # 忽略助手配置已从系统配置中移除，暂不需要此类的方法
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def cl100k_base() -> TikTokenEncoding:
+        """ 解析bpe文件较慢，进程内只加载一次 """
         ENDOFTEXT = "<|endoftext|>"
         FIM_PREFIX = "<|fim_prefix|>"
         FIM_MIDDLE = "<|fim_middle|>"
@@ -35,3 +40,8 @@ class AssistantUtils:
             "mergeable_ranks": mergeable_ranks,
             "special_tokens": special_tokens,
         })
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def cl100k_token_counter() -> TokenCounter:
+        return TokenCounter('cl100k_base', AssistantUtils.cl100k_base().encode)
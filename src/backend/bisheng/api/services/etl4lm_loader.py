@@ -3,7 +3,9 @@
 import base64
 import logging
 import os
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 from uuid import uuid4
 
 import cv2
@@ -170,10 +172,21 @@ class Etl4lmLoader(BasePDFLoader):
             n: int = None,
             verbose: bool = False,
             kwargs: dict = {},
+            shard_pages: int = 0,
+            shard_concurrency: int = 4,
+            shard_retries: int = 2,
     ) -> None:
-        """Initialize with a file path."""
+        """Initialize with a file path.
+
+        shard_pages: pdf页数超过该值时按页拆分为多个文件并发解析，0表示不拆分
+        shard_concurrency: 同时发送的分片请求数
+        shard_retries: 单个分片请求失败后的重试次数
+        """
         self.unstructured_api_url = unstructured_api_url
         self.unstructured_api_key = unstructured_api_key
+        self.shard_pages = shard_pages
+        self.shard_concurrency = max(shard_concurrency, 1)
+        self.shard_retries = max(shard_retries, 0)
         self.force_ocr = force_ocr
         self.enable_formular = enable_formular
         self.filter_page_header_footer = filter_page_header_footer
@@ -188,14 +201,10 @@ class Etl4lmLoader(BasePDFLoader):
         self.knowledge_id = knowledge_id
         super().__init__(file_path)
 
-    def load(self) -> List[Document]:
-        """Load given path as pages."""
-        b64_data = base64.b64encode(open(self.file_path, "rb").read()).decode()
-        parameters = {"start": self.start, "n": self.n}
-        parameters.update(self.extra_kwargs)
+    def _request_partition(self, file_name: str, b64_data: str, parameters: dict) -> dict:
         # TODO: add filter_page_header_footer into payload when elt4llm is ready.
         payload = dict(
-            filename=os.path.basename(self.file_name),
+            filename=file_name,
             b64_data=[b64_data],
             mode="partition",
             force_ocr=self.force_ocr,
@@ -228,6 +237,96 @@ class Etl4lmLoader(BasePDFLoader):
             raise Exception(
                 f"file partition error {os.path.basename(self.file_name)} error resp={resp}"
             )
+        return resp
+
+    def _split_pdf(self) -> List[Tuple[int, str]]:
+        """ 按页拆分pdf，返回 [(起始页, 分片pdf的base64)]，不需要拆分时返回空列表 """
+        if not self.shard_pages or self.start or self.n:
+            return []
+        if not self.file_name.lower().endswith(".pdf"):
+            return []
+        from bisheng.api.services.md_from_pdf import pymu_lock
+
+        shards = []
+        with pymu_lock:
+            doc = fitz.open(self.file_path)
+            try:
+                page_count = len(doc)
+                if page_count <= self.shard_pages:
+                    return []
+                for start in range(0, page_count, self.shard_pages):
+                    shard_doc = fitz.open()
+                    try:
+                        shard_doc.insert_pdf(doc, from_page=start, to_page=min(start + self.shard_pages, page_count) - 1)
+                        shards.append((start, base64.b64encode(shard_doc.tobytes()).decode()))
+                    finally:
+                        shard_doc.close()
+            finally:
+                doc.close()
+        return shards
+
+    def _request_shard(self, shard_index: int, start: int, b64_data: str) -> dict:
+        """
+        解析一个分片，失败后重试，返回结果里的页码换算为整个文件的页码
+        element_id只在一次解析请求内唯一，加上分片序号作为前缀，避免不同分片的图片裁剪文件名互相覆盖
+        """
+        parameters = {"start": 0, "n": None}
+        parameters.update(self.extra_kwargs)
+        for attempt in range(self.shard_retries + 1):
+            try:
+                resp = self._request_partition(os.path.basename(self.file_name), b64_data, parameters)
+                break
+            except Exception as e:
+                if attempt >= self.shard_retries:
+                    raise e
+                logger.warning(f"file partition shard {shard_index} of {self.file_name} failed, retry: {e}")
+                time.sleep(2 ** attempt)
+        for part in resp.get("partitions") or []:
+            metadata = part.get("metadata", {})
+            extra_data = metadata.get("extra_data", {})
+            if extra_data.get("pages"):
+                extra_data["pages"] = [page + start for page in extra_data["pages"]]
+            if part.get("element_id"):
+                part["element_id"] = f"{shard_index}_{part['element_id']}"
+            if metadata.get("parent_id"):
+                metadata["parent_id"] = f"{shard_index}_{metadata['parent_id']}"
+        return resp
+
+    def _request_shards(self, shards: List[Tuple[int, str]]) -> Dict:
+        """ 并发解析所有分片，按页码顺序合并为和整个文件解析相同格式的结果 """
+        logger.info(f"file partition {self.file_name} in {len(shards)} shards")
+        with ThreadPoolExecutor(max_workers=min(self.shard_concurrency, len(shards))) as executor:
+            futures = [executor.submit(self._request_shard, index, start, b64_data)
+                       for index, (start, b64_data) in enumerate(shards)]
+            results = [future.result() for future in futures]
+
+        merged = {
+            "status_code": 200,
+            "partitions": [part for resp in results for part in resp.get("partitions") or []],
+            "text": "\n".join(resp["text"] for resp in results if resp.get("text")),
+        }
+        # 每个分片都返回了处理后的pdf时，拼接为整个文件
+        if all(resp.get("b64_pdf") for resp in results):
+            merged_doc = fitz.open()
+            try:
+                for resp in results:
+                    with fitz.open(stream=base64.b64decode(resp["b64_pdf"]), filetype="pdf") as shard_doc:
+                        merged_doc.insert_pdf(shard_doc)
+                merged["b64_pdf"] = base64.b64encode(merged_doc.tobytes()).decode()
+            finally:
+                merged_doc.close()
+        return merged
+
+    def load(self) -> List[Document]:
+        """Load given path as pages."""
+        shards = self._split_pdf()
+        if shards:
+            resp = self._request_shards(shards)
+        else:
+            b64_data = base64.b64encode(open(self.file_path, "rb").read()).decode()
+            parameters = {"start": self.start, "n": self.n}
+            parameters.update(self.extra_kwargs)
+            resp = self._request_partition(os.path.basename(self.file_name), b64_data, parameters)
         partitions = resp["partitions"]
         if partitions:
             logger.info(f"content_from_partitions")
@@ -248,7 +248,7 @@ def execute_workflow_get_answer(workflow_info: FlowVersion, evaluation: Evaluati
     chat_id = ""
     user_id = str(evaluation.user_id)
     workflow = RedisCallback(unique_id, workflow_id, chat_id, user_id)
-    workflow.set_workflow_data(workflow_info.data)
+    workflow.set_workflow_data(workflow_info.data, version_id=workflow_info.id)
     workflow.set_workflow_status(WorkflowStatus.WAITING.value)
     execute_workflow.delay(unique_id, workflow_id, chat_id, user_id)
 
@@ -119,16 +119,17 @@ class KnowledgeService(KnowledgeUtils):
         db_user_ids = {one.user_id for one in knowledge_list}
         db_user_info = UserDao.get_user_by_ids(list(db_user_ids))
         db_user_dict = {one.user_id: one.user_name for one in db_user_info}
+        copiable_list = login_user.access_check_many(
+            [(one.user_id, str(one.id)) for one in knowledge_list], AccessType.KNOWLEDGE_WRITE
+        )
         res = []
 
-        for one in knowledge_list:
+        for one, copiable in zip(knowledge_list, copiable_list):
             res.append(
                 KnowledgeRead(
                     **one.model_dump(),
                     user_name=db_user_dict.get(one.user_id, one.user_id),
-                    copiable=login_user.access_check(
-                        one.user_id, str(one.id), AccessType.KNOWLEDGE_WRITE
-                    ),
+                    copiable=copiable,
                 )
             )
         return res
@@ -140,13 +141,11 @@ class KnowledgeService(KnowledgeUtils):
         db_knowledge = KnowledgeDao.get_list_by_ids(knowledge_id)
         filter_knowledge = db_knowledge
         if not login_user.is_admin():
-            filter_knowledge = []
-            for one in db_knowledge:
-                # 判断用户是否有权限
-                if login_user.access_check(
-                        one.user_id, str(one.id), AccessType.KNOWLEDGE
-                ):
-                    filter_knowledge.append(one)
+            # 判断用户是否有权限
+            access_list = login_user.access_check_many(
+                [(one.user_id, str(one.id)) for one in db_knowledge], AccessType.KNOWLEDGE
+            )
+            filter_knowledge = [one for one, access in zip(db_knowledge, access_list) if access]
         if not filter_knowledge:
             return []
 
@@ -841,6 +840,8 @@ class KnowledgeService(KnowledgeUtils):
                 timeout_files.append(one.id)
                 continue
             finally_res[index].title = file_title_map.get(str(one.id), "")
+            if one.status == KnowledgeFileStatus.PROCESSING.value:
+                finally_res[index].progress = KnowledgeUtils.get_file_progress(one.id)
         if timeout_files:
             KnowledgeFileDao.update_file_status(timeout_files, KnowledgeFileStatus.FAILED, '文件处理时间超过24小时')
 
@@ -1,7 +1,12 @@
+import contextvars
+import hashlib
 import json
 import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Any, Dict, List, Optional, BinaryIO, Union
 
 import requests
@@ -72,6 +77,32 @@ class KnowledgeUtils:
     # 用来区分chunk和自动生产的总结内容  格式如：文件名\n文档总结\n--------\n chunk内容
     chunk_split = "\n----------\n"
 
+    # 文件入库时每批写入向量库和es的chunk数
+    insert_batch_size = 64
+
+    # 文档总结标题的缓存过期时间
+    title_cache_expire = 86400 * 7
+
+    @classmethod
+    def get_file_progress_key(cls, file_id: int) -> str:
+        return f"knowledge_file_progress:{file_id}"
+
+    @classmethod
+    def set_file_progress(cls, file_id: int, finished: int, total: int):
+        """记录文件入库的进度"""
+        redis_client.set(cls.get_file_progress_key(file_id), {"finished": finished, "total": total},
+                         expiration=86400)
+
+    @classmethod
+    def get_title_cache_key(cls, model_id: int, abstract_prompt: Optional[str], text: str) -> str:
+        text_hash = hashlib.sha256(f"{abstract_prompt or ''}\n{text}".encode("utf-8")).hexdigest()
+        return f"knowledge_title:{model_id}:{text_hash}"
+
+    @classmethod
+    def get_file_progress(cls, file_id: int) -> Optional[dict]:
+        """获取文件入库的进度 {"finished": 已入库的chunk数, "total": 总chunk数}"""
+        return redis_client.get(cls.get_file_progress_key(file_id))
+
     @classmethod
     def get_preview_cache_key(cls, knowledge_id: int, file_path: str, md5_value=None) -> str:
         if not md5_value:
@@ -369,6 +400,163 @@ def decide_knowledge_llm() -> Any:
     )
 
 
+# 每个总结模型同时进行的标题提取请求数
+_extract_title_semaphores: Dict[int, threading.BoundedSemaphore] = {}
+_extract_title_lock = threading.Lock()
+
+
+def get_extract_title_conf() -> dict:
+    """ 文档总结标题的配置 {"concurrency": 单个模型的并发数, "defer": 是否在文件入库后再异步提取} """
+    return settings.get_knowledge().get("extract_title", None) or {}
+
+
+def _get_extract_title_semaphore(model_id: int) -> threading.BoundedSemaphore:
+    with _extract_title_lock:
+        if model_id not in _extract_title_semaphores:
+            concurrency = max(1, int(get_extract_title_conf().get("concurrency", 4)))
+            _extract_title_semaphores[model_id] = threading.BoundedSemaphore(concurrency)
+        return _extract_title_semaphores[model_id]
+
+
+def extract_documents_title(llm, texts: List[str], abstract_prompt: str = None, model_id: int = 0,
+                            max_length: int = 7000) -> List[str]:
+    """
+    并发提取多个文档的总结标题，结果按文本的hash缓存到redis，重复解析和预览时不再请求模型
+    同一个模型的并发请求数受信号量限制，多个任务同时入库时也不会压垮模型服务
+    """
+    titles = [""] * len(texts)
+    cache_keys = [KnowledgeUtils.get_title_cache_key(model_id, abstract_prompt, text[:max_length]) for text in texts]
+    todo = []
+    for index, key in enumerate(cache_keys):
+        cache_title = redis_client.get(key)
+        if cache_title is not None:
+            titles[index] = cache_title
+        else:
+            todo.append(index)
+    if not todo:
+        return titles
+
+    semaphore = _get_extract_title_semaphore(model_id)
+
+    def extract_one(index: int) -> str:
+        with semaphore:
+            title = extract_title(llm=llm, text=texts[index], max_length=max_length, abstract_prompt=abstract_prompt)
+        # remove <think>.*</think> tag content
+        title = parse_document_title(title)
+        redis_client.set(cache_keys[index], title, expiration=KnowledgeUtils.title_cache_expire)
+        return title
+
+    if len(todo) == 1:
+        titles[todo[0]] = extract_one(todo[0])
+        return titles
+    concurrency = max(1, int(get_extract_title_conf().get("concurrency", 4)))
+    with ThreadPoolExecutor(max_workers=min(len(todo), concurrency)) as executor:
+        futures = {index: executor.submit(contextvars.copy_context().run, extract_one, index) for index in todo}
+        for index, future in futures.items():
+            titles[index] = future.result()
+    return titles
+
+
+def update_file_title(db_knowledge: Knowledge, db_file: KnowledgeFile):
+    """
+    文件入库时延迟提取总结标题的后续处理：用已入库的分块内容提取标题，再更新milvus和es中的分块
+    分块的向量保持不变，不重新向量化，只更新分块文本中的标题和title字段
+    milvus先写入新数据再删除旧数据，es按文档id分批原地更新，过程中分块始终可以被检索到
+    """
+    from elasticsearch.helpers import bulk, scan
+
+    llm = decide_knowledge_llm()
+    if not llm:
+        return
+    knowledge_llm = LLMService.get_knowledge_llm()
+    embeddings = FakeEmbedding()
+    vector_client = decide_vectorstores(db_knowledge.collection_name, "Milvus", embeddings)
+    index_name = db_knowledge.index_name or db_knowledge.collection_name
+    es_client = decide_vectorstores(index_name, "ElasticKeywordsSearch", embeddings)
+
+    # 带上向量一起查询，重新写入时直接使用
+    fields = [one.name for one in vector_client.col.schema.fields if one.name != "pk"]
+    chunks = vector_client.col.query(
+        expr=f"file_id == {db_file.id}", output_fields=fields + ["pk"], timeout=10
+    )
+    if not chunks:
+        logger.warning(f"update_file_title no chunks file={db_file.id}")
+        return
+    chunks.sort(key=lambda x: x["chunk_index"])
+    raw_texts = [KnowledgeUtils.split_chunk_metadata(one["text"]) for one in chunks]
+    title = extract_documents_title(llm, ["".join(raw_texts)], knowledge_llm.abstract_prompt,
+                                     knowledge_llm.extract_title_model_id)[0]
+    if not title:
+        return
+
+    pks = []
+    es_texts = {}
+    for raw_text, one in zip(raw_texts, chunks):
+        pks.append(one.pop("pk"))
+        one["title"] = title
+        one["text"] = KnowledgeUtils.aggregate_chunk_metadata(raw_text, one)
+        es_texts[one["chunk_index"]] = one["text"]
+
+    logger.info(f"update_file_title_milvus file={db_file.id} size={len(chunks)}")
+    for start in range(0, len(chunks), KnowledgeUtils.insert_batch_size):
+        batch = chunks[start:start + KnowledgeUtils.insert_batch_size]
+        vector_client.col.insert([[one[x] for one in batch] for x in fields], timeout=100)
+    vector_client.col.delete(f"pk in {pks}", timeout=10)
+
+    logger.info(f"update_file_title_es file={db_file.id}")
+
+    def es_actions():
+        hits = scan(es_client.client, index=index_name, _source=["metadata.chunk_index"],
+                    query={"query": {"match": {"metadata.file_id": db_file.id}}})
+        for hit in hits:
+            text = es_texts.get(hit["_source"]["metadata"]["chunk_index"])
+            if text is None:
+                continue
+            yield {"_op_type": "update", "_index": index_name, "_id": hit["_id"],
+                   "doc": {"text": text, "metadata": {"title": title}}}
+
+    bulk(es_client.client, es_actions(), chunk_size=KnowledgeUtils.insert_batch_size)
+    logger.info(f"update_file_title_over file={db_file.id}")
+
+
+class FileProcessLimiter:
+    """
+    单个入库任务内多个文件并发处理时，各阶段的并发限制
+    解析阶段为CPU密集型，向量化和写入阶段为IO密集型，分别限制同时执行的文件数
+    向量化阶段按批次获取许可，大文件不会长时间占用，其他文件的批次可以穿插执行
+    """
+
+    def __init__(self, file_concurrency: int = 1, parse_concurrency: int = 1, embedding_concurrency: int = 1):
+        self.file_concurrency = max(1, file_concurrency)
+        self.parse_concurrency = max(1, min(parse_concurrency, self.file_concurrency))
+        self.embedding_concurrency = max(1, min(embedding_concurrency, self.file_concurrency))
+        self._parse_semaphore = threading.BoundedSemaphore(self.parse_concurrency)
+        self._embedding_semaphore = threading.BoundedSemaphore(self.embedding_concurrency)
+
+    @classmethod
+    def from_config(cls) -> "FileProcessLimiter":
+        conf = settings.get_knowledge().get("file_process", None) or {}
+        return cls(
+            file_concurrency=int(conf.get("file_concurrency", 1)),
+            parse_concurrency=int(conf.get("parse_concurrency", 1)),
+            embedding_concurrency=int(conf.get("embedding_concurrency", 1)),
+        )
+
+    @contextmanager
+    def parse(self):
+        with self._parse_semaphore:
+            yield
+
+    @contextmanager
+    def embedding(self):
+        with self._embedding_semaphore:
+            yield
+
+    def __repr__(self):
+        return (f"file={self.file_concurrency} parse={self.parse_concurrency} "
+                f"embedding={self.embedding_concurrency}")
+
+
 def addEmbedding(
         collection_name: str,
         index_name: str,
@@ -398,7 +586,10 @@ def addEmbedding(
     logger.info("start init ElasticKeywordsSearch")
     es_client = decide_vectorstores(index_name, "ElasticKeywordsSearch", embeddings)
 
-    for index, db_file in enumerate(knowledge_files):
+    limiter = FileProcessLimiter.from_config()
+    logger.info(f"process files concurrency: {limiter}")
+
+    def process_one_file(index: int, db_file: KnowledgeFile):
         # 尝试从缓存中获取文件的分块
         preview_cache_key = None
         if preview_cache_keys:
@@ -427,6 +618,7 @@ def addEmbedding(
                 enable_formula=enable_formula,
                 force_ocr=force_ocr,
                 filter_page_header_footer=filter_page_header_footer,
+                limiter=limiter,
             )
             db_file.status = KnowledgeFileStatus.SUCCESS.value
         except Exception as e:
@@ -447,7 +639,25 @@ def addEmbedding(
                     "file_id": db_file.id,
                     "error_msg": db_file.remark,
                 }
-                requests.post(url=callback, json=inp, timeout=3)
+                try:
+                    requests.post(url=callback, json=inp, timeout=3)
+                except Exception as e:
+                    logger.warning(f"process_file_callback_fail file_id={db_file.id} error={e}")
+
+    if limiter.file_concurrency <= 1 or len(knowledge_files) <= 1:
+        for index, db_file in enumerate(knowledge_files):
+            process_one_file(index, db_file)
+        return
+
+    # 多个文件并发处理，每个文件的状态更新和回调互不影响
+    with ThreadPoolExecutor(max_workers=limiter.file_concurrency) as executor:
+        futures = [
+            # 复制上下文，保证子线程日志中的trace_id一致
+            executor.submit(contextvars.copy_context().run, process_one_file, index, db_file)
+            for index, db_file in enumerate(knowledge_files)
+        ]
+        for future in futures:
+            future.result()
 
 
 def add_file_embedding(
@@ -466,7 +676,9 @@ def add_file_embedding(
         enable_formula: int = 1,
         force_ocr: int = 0,
         filter_page_header_footer: int = 0,
+        limiter: FileProcessLimiter = None,
 ):
+    limiter = limiter or FileProcessLimiter()
     # download original file
     logger.info(
         f"start download original file={db_file.id} file_name={db_file.file_name}"
@@ -480,6 +692,9 @@ def add_file_embedding(
     if not es_client:
         raise ValueError("es not found, please check your es config")
 
+    # 延迟提取总结标题：分块先入库可被检索，标题由异步任务提取后再更新
+    defer_title = bool(get_extract_title_conf().get("defer", False))
+
     # Convert split_rule string to dict if needed
     excel_rule = ExcelRule()
     if db_file.split_rule and isinstance(db_file.split_rule, str):
@@ -487,20 +702,22 @@ def add_file_embedding(
         if "excel_rule" in split_rule:
             excel_rule = ExcelRule(**split_rule["excel_rule"])
     # # extract text from file
-    texts, metadatas, parse_type, partitions = read_chunk_text(
-        filepath,
-        db_file.file_name,
-        separator,
-        separator_rule,
-        chunk_size,
-        chunk_overlap,
-        knowledge_id=knowledge_id,
-        retain_images=retain_images,
-        enable_formula=enable_formula,
-        force_ocr=force_ocr,
-        filter_page_header_footer=filter_page_header_footer,
-        excel_rule=excel_rule,
-    )
+    with limiter.parse():
+        texts, metadatas, parse_type, partitions = read_chunk_text(
+            filepath,
+            db_file.file_name,
+            separator,
+            separator_rule,
+            chunk_size,
+            chunk_overlap,
+            knowledge_id=knowledge_id,
+            retain_images=retain_images,
+            enable_formula=enable_formula,
+            force_ocr=force_ocr,
+            filter_page_header_footer=filter_page_header_footer,
+            excel_rule=excel_rule,
+            no_summary=defer_title,
+        )
     if len(texts) == 0:
         raise ValueError("文件解析为空")
     # 缓存中有数据则用缓存中的数据去入库，因为是用户在界面编辑过的
@@ -514,6 +731,8 @@ def add_file_embedding(
             for key, val in all_chunk_info.items():
                 texts.append(val["text"])
                 metadatas.append(val["metadata"])
+            # 预览时已经提取过标题
+            defer_title = False
     for index, one in enumerate(texts):
         if len(one) > 10000:
             raise ValueError(
@@ -548,19 +767,17 @@ def add_file_embedding(
             }
         )
 
-    logger.info(f"add_vectordb file={db_file.id} file_name={db_file.file_name}")
-    # 存入milvus
-    vector_client.add_texts(texts=texts, metadatas=metadatas)
-
-    logger.info(f"add_es file={db_file.id} file_name={db_file.file_name}")
-    # 存入es
-    es_client.add_texts(texts=texts, metadatas=metadatas)
+    add_text_into_vector_by_batch(vector_client, es_client, db_file, texts, metadatas, limiter=limiter)
 
     logger.info(f"add_complete file={db_file.id} file_name={db_file.file_name}")
 
     if preview_cache_key:
         KnowledgeUtils.delete_preview_cache(preview_cache_key)
 
+    if defer_title:
+        from bisheng.worker.knowledge.file_worker import extract_file_title_celery
+        extract_file_title_celery.delay(db_file.id)
+
     if db_file.file_name.endswith((".doc", ".ppt", ".pptx")):
         tmp_preview_file = KnowledgeUtils.get_tmp_preview_file_object_name(filepath)
 
@@ -598,6 +815,39 @@ def add_text_into_vector(
     es_client.add_texts(texts=texts, metadatas=metadatas)
 
 
+def add_text_into_vector_by_batch(
+        vector_client,
+        es_client,
+        db_file: KnowledgeFile,
+        texts: List[str],
+        metadatas: List[dict],
+        batch_size: int = KnowledgeUtils.insert_batch_size,
+        limiter: FileProcessLimiter = None,
+):
+    """分批写入milvus和es，es的写入和milvus的embedding并行执行，并记录入库进度"""
+    limiter = limiter or FileProcessLimiter()
+    total = len(texts)
+    logger.info(f"add_vectordb_and_es file={db_file.id} file_name={db_file.file_name} total={total}")
+    KnowledgeUtils.set_file_progress(db_file.id, 0, total)
+    with ThreadPoolExecutor(max_workers=1) as es_executor:
+        es_futures = []
+        for start in range(0, total, batch_size):
+            batch_texts = texts[start:start + batch_size]
+            batch_metadatas = metadatas[start:start + batch_size]
+            # es不需要embedding，和milvus的embedding同时进行
+            es_futures.append(es_executor.submit(es_client.add_texts, texts=batch_texts, metadatas=batch_metadatas))
+            with limiter.embedding():
+                vector_client.add_texts(texts=batch_texts, metadatas=batch_metadatas)
+            KnowledgeUtils.set_file_progress(db_file.id, min(start + batch_size, total), total)
+            # es写入失败时尽快结束
+            for future in es_futures:
+                if future.done():
+                    future.result()
+        for future in es_futures:
+            future.result()
+    logger.info(f"add_vectordb_and_es_over file={db_file.id} file_name={db_file.file_name}")
+
+
 def parse_partitions(partitions: List[Any]) -> Dict:
     """解析生成bbox和文本的对应关系"""
     if not partitions:
@@ -690,6 +940,7 @@ def read_chunk_text(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         is_separator_regex=True,
+        share_metadata=True,
     )
     # 加载文档内容
     logger.info(f"start_file_loader file_name={file_name}")
@@ -782,6 +1033,9 @@ def read_chunk_text(
                 timeout=etl4lm_settings.get("timeout", 60),
                 filter_page_header_footer=bool(filter_page_header_footer),
                 knowledge_id=knowledge_id,
+                shard_pages=int(etl4lm_settings.get("shard_pages", 20)),
+                shard_concurrency=int(etl4lm_settings.get("shard_concurrency", 4)),
+                shard_retries=int(etl4lm_settings.get("shard_retries", 2)),
             )
             documents = loader.load()
             parse_type = ParseType.ETL4LM.value
@@ -816,15 +1070,15 @@ def read_chunk_text(
     logger.info(f"start_extract_title file_name={file_name}")
     if llm:
         t = time.time()
-        for one in documents:
-            # 配置了相关llm的话，就对文档做总结
-            title = extract_title(
-                llm=llm,
-                text=one.page_content,
-                abstract_prompt=knowledge_llm.abstract_prompt,
-            )
-            # remove <think>.*</think> tag content
-            one.metadata["title"] = parse_document_title(title)
+        # 配置了相关llm的话，就对文档做总结
+        titles = extract_documents_title(
+            llm,
+            [one.page_content for one in documents],
+            abstract_prompt=knowledge_llm.abstract_prompt,
+            model_id=knowledge_llm.extract_title_model_id,
+        )
+        for one, title in zip(documents, titles):
+            one.metadata["title"] = title
         logger.info("file_extract_title=success timecost={}", time.time() - t)
 
     if file_extension_name in ["xls", "xlsx", "csv"]:
@@ -1,9 +1,34 @@
+import atexit
+import glob
+import json
 import os
+import queue
 import shutil  # For checking if the executable is in PATH
+import signal
+import socket
 import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
 
 from loguru import logger
 
+# 常驻实例启动后等待可以连接的时间
+INSTANCE_START_TIMEOUT = 60
+# 常驻实例的转换进程，使用可以导入uno的python运行
+LIBREOFFICE_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'libreoffice_worker.py')
+# 实例的用户配置目录前缀，后面是进程号和实例序号
+PROFILE_DIR_PREFIX = "bisheng_libreoffice_"
+# 转换的目标格式对应的导出过滤器
+EXPORT_FILTERS = {
+    "docx": "MS Word 2007 XML",
+    "pdf": "impress_pdf_Export",
+}
+
 
 def get_libreoffice_path():
     """
@@ -32,6 +57,319 @@ def get_libreoffice_path():
     return None
 
 
+class LibreOfficeConvertError(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def get_office_python(soffice_path: str) -> Optional[str]:
+    """
+    查找可以导入uno的python，用来运行常驻实例的转换进程：优先使用LibreOffice自带的python，
+    其次是安装了python3-uno的系统python，最后是当前的python。都不能导入uno时返回None
+    """
+    program_dir = os.path.dirname(os.path.realpath(shutil.which(soffice_path) or soffice_path))
+    candidates = [os.path.join(program_dir, "python.exe" if os.name == "nt" else "python"),
+                  shutil.which("python3"), sys.executable]
+    for one in candidates:
+        if not one or not os.path.exists(one):
+            continue
+        try:
+            subprocess.run([one, "-c", "import uno"], check=True, env=_office_python_env(), timeout=30,
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            logger.info(f"libreoffice resident instances use python: {one}")
+            return one
+        except (OSError, subprocess.SubprocessError):
+            continue
+    logger.warning("no python can import uno, libreoffice conversions start a soffice process per file")
+    return None
+
+
+def _office_python_env() -> dict:
+    """ 当前虚拟环境的python路径配置会干扰LibreOffice自带的python """
+    env = dict(os.environ)
+    env.pop("PYTHONHOME", None)
+    env.pop("PYTHONPATH", None)
+    return env
+
+
+def _get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _remove_stale_profiles():
+    """ 删除已经退出的进程遗留的配置目录（进程被强制结束时来不及清理） """
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), f"{PROFILE_DIR_PREFIX}*_*")):
+        try:
+            pid = int(os.path.basename(path)[len(PROFILE_DIR_PREFIX):].split("_")[0])
+        except ValueError:
+            continue
+        if pid == os.getpid():
+            continue
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def _kill_process(process: subprocess.Popen):
+    if process.poll() is None:
+        try:
+            # soffice会再启动soffice.bin，需要结束整个进程组
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        pass
+
+
+def _convert_by_command(soffice_path: str, input_path: str, output_dir: str, convert_to: str, timeout: float):
+    """ 没有常驻实例时，每次转换启动一个soffice进程 """
+    command = [soffice_path, "--headless", "--convert-to", convert_to, "--outdir", output_dir, input_path]
+    logger.debug(f"Executing command: {' '.join(command)}")
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                               start_new_session=True)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process(process)
+        raise LibreOfficeConvertError(f"libreoffice conversion timed out after {timeout}s")
+    logger.debug(f"LibreOffice STDOUT: {stdout}")
+    if stderr:
+        # LibreOffice sometimes logger.debugs info to stderr even on success
+        logger.debug(f"LibreOffice STDERR: {stderr}")
+    if process.returncode != 0:
+        raise LibreOfficeConvertError(f"libreoffice exit code {process.returncode}: {stderr}")
+
+
+class LibreOfficeInstance:
+    """
+    一个常驻的LibreOffice转换实例：使用独立用户配置目录的soffice进程监听本地端口，
+    由LibreOffice自带的python运行libreoffice_worker.py，通过uno接口转换，请求和结果通过管道按行传递
+    """
+
+    def __init__(self, soffice_path: str, office_python: str, index: int):
+        self.soffice_path = soffice_path
+        self.office_python = office_python
+        self.profile_dir = os.path.join(tempfile.gettempdir(), f"{PROFILE_DIR_PREFIX}{os.getpid()}_{index}")
+        self.conversions = 0
+        self.process: Optional[subprocess.Popen] = None
+        self.worker: Optional[subprocess.Popen] = None
+        self._command = None
+        self._result = None
+
+    def start(self):
+        self.conversions = 0
+        port = _get_free_port()
+        self.process = subprocess.Popen(
+            [self.soffice_path, f"-env:UserInstallation={Path(self.profile_dir).as_uri()}", "--headless",
+             "--invisible", "--nologo", "--norestore", "--nodefault", "--nolockcheck",
+             f"--accept=socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True)
+        command_read, command_write = os.pipe()
+        result_read, result_write = os.pipe()
+        try:
+            self.worker = subprocess.Popen([self.office_python, LIBREOFFICE_WORKER_SCRIPT, str(command_read),
+                                            str(result_write), str(port), str(INSTANCE_START_TIMEOUT)],
+                                           pass_fds=(command_read, result_write),
+                                           stdin=subprocess.DEVNULL,
+                                           env=_office_python_env(),
+                                           start_new_session=True)
+        finally:
+            os.close(command_read)
+            os.close(result_write)
+        self._command = os.fdopen(command_write, 'w', encoding='utf-8')
+        self._result = os.fdopen(result_read, 'r', encoding='utf-8')
+        try:
+            self._request(None, INSTANCE_START_TIMEOUT + 10)
+        except LibreOfficeConvertError as e:
+            self.stop()
+            raise LibreOfficeConvertError(f"start libreoffice instance failed: {e}")
+        logger.debug(f"libreoffice instance started pid={self.process.pid} port={port}")
+
+    def _request(self, command: Optional[dict], timeout: float) -> dict:
+        """ 发送一个请求并等待结果，command为None时只读取结果；超时后结束soffice和转换进程 """
+        timed_out = threading.Event()
+
+        def on_timeout():
+            timed_out.set()
+            self._kill_processes()
+
+        timer = threading.Timer(timeout, on_timeout)
+        timer.start()
+        try:
+            if command is not None:
+                self._command.write(json.dumps(command, ensure_ascii=False) + '\n')
+                self._command.flush()
+            line = self._result.readline()
+        except (OSError, ValueError) as e:
+            line = ''
+            logger.debug(f"libreoffice worker pipe error: {e}")
+        finally:
+            timer.cancel()
+        if timed_out.is_set():
+            raise LibreOfficeConvertError(f"libreoffice conversion timed out after {timeout}s")
+        if not line:
+            raise LibreOfficeConvertError(f"libreoffice worker exited unexpectedly, code={self.worker.poll()}")
+        response = json.loads(line)
+        if 'error' in response:
+            raise LibreOfficeConvertError(response['error'])
+        return response
+
+    def _kill_processes(self):
+        for one in (self.worker, self.process):
+            if one is not None:
+                _kill_process(one)
+
+    def stop(self):
+        self._kill_processes()
+        self.worker = None
+        self.process = None
+        for one in (self._command, self._result):
+            if one is not None:
+                try:
+                    one.close()
+                except OSError:
+                    pass
+        self._command = None
+        self._result = None
+
+    def restart(self):
+        """ 结束进程并清理配置目录，下次使用全新的配置 """
+        self.close()
+        self.start()
+
+    def close(self):
+        """ 结束进程并删除配置目录 """
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def is_healthy(self) -> bool:
+        if self.process is None or self.worker is None:
+            return False
+        if self.process.poll() is not None or self.worker.poll() is not None:
+            return False
+        try:
+            self._request({'ping': True}, 10)
+            return True
+        except LibreOfficeConvertError:
+            return False
+
+    def convert(self, input_path: str, output_dir: str, convert_to: str, timeout: float):
+        self.conversions += 1
+        input_path = os.path.abspath(input_path)
+        output_path = os.path.join(os.path.abspath(output_dir), f"{Path(input_path).stem}.{convert_to}")
+        self._request({'input_path': input_path, 'output_path': output_path, 'filter': EXPORT_FILTERS[convert_to]},
+                      timeout)
+
+
+class LibreOfficePool:
+    """
+    常驻的LibreOffice转换实例池，转换任务放入队列，每个实例由一个线程从队列取任务执行
+    每次转换前检查实例是否可用，不可用或者转换次数达到上限后重启实例
+    """
+
+    def __init__(self, soffice_path: str, office_python: str, instances: int = 2, max_conversions: int = 100):
+        self.soffice_path = soffice_path
+        self.office_python = office_python
+        self.instances = max(instances, 1)
+        self.max_conversions = max_conversions
+        self._jobs: queue.Queue = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        _remove_stale_profiles()
+        self._instances = [LibreOfficeInstance(soffice_path, office_python, index) for index in range(self.instances)]
+        for index, instance in enumerate(self._instances):
+            thread = threading.Thread(target=self._work, args=(instance,), name=f"libreoffice-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        # 转换线程是守护线程，进程退出时不会执行到清理逻辑
+        atexit.register(self._cleanup)
+
+    def _work(self, instance: LibreOfficeInstance):
+        try:
+            instance.start()
+        except Exception as e:
+            logger.warning(f"libreoffice instance start error: {e}")
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                instance.close()
+                return
+            future, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if not instance.is_healthy() or instance.conversions >= self.max_conversions:
+                    instance.restart()
+                instance.convert(*args)
+            except BaseException as e:
+                future.set_exception(e)
+                # 超时或者异常后实例状态未知，下次使用前重启
+                instance.stop()
+            else:
+                future.set_result(None)
+
+    def convert(self, input_path: str, output_dir: str, convert_to: str, timeout: float):
+        """ 阻塞直到转换完成，失败抛出LibreOfficeConvertError """
+        future = Future()
+        self._jobs.put((future, (input_path, output_dir, convert_to, timeout)))
+        future.result()
+
+    def close(self):
+        """ 排队中的任务执行完后结束所有实例并删除配置目录 """
+        atexit.unregister(self._cleanup)
+        for _ in self._threads:
+            self._jobs.put(None)
+
+    def _cleanup(self):
+        for instance in self._instances:
+            instance.close()
+
+
+_libreoffice_pool: Optional[LibreOfficePool] = None
+_libreoffice_pool_lock = threading.Lock()
+
+
+def get_libreoffice_conf() -> dict:
+    """ LibreOffice转换的配置 {"instances": 常驻实例数, "max_conversions": 实例转换多少次后重启} """
+    from bisheng.settings import settings
+    return settings.get_knowledge().get("libreoffice", None) or {}
+
+
+def get_libreoffice_pool(soffice_path: str) -> Optional[LibreOfficePool]:
+    """ 进程内共享的转换实例池，配置变化后重新创建；没有可以导入uno的python时返回None """
+    global _libreoffice_pool
+    office_python = get_office_python(soffice_path)
+    if office_python is None:
+        return None
+    conf = get_libreoffice_conf()
+    instances = int(conf.get("instances", 2))
+    max_conversions = int(conf.get("max_conversions", 100))
+    with _libreoffice_pool_lock:
+        pool = _libreoffice_pool
+        if pool is None or (pool.soffice_path, pool.instances, pool.max_conversions) != (
+                soffice_path, max(instances, 1), max_conversions):
+            if pool is not None:
+                pool.close()
+            _libreoffice_pool = LibreOfficePool(soffice_path, office_python, instances, max_conversions)
+        return _libreoffice_pool
+
+
+def libreoffice_convert(soffice_path: str, input_path: str, output_dir: str, convert_to: str, timeout: float):
+    """ 优先使用常驻实例转换，不能使用常驻实例时每次启动soffice进程，不限制并发 """
+    pool = get_libreoffice_pool(soffice_path)
+    if pool is None:
+        _convert_by_command(soffice_path, input_path, output_dir, convert_to, timeout)
+    else:
+        pool.convert(input_path, output_dir, convert_to, timeout)
+
+
 def convert_doc_to_docx(input_doc_path, output_dir=None):
     """
     Converts a .doc file to .docx using LibreOffice/soffice command line.
@@ -85,27 +423,8 @@ def convert_doc_to_docx(input_doc_path, output_dir=None):
     file_name_no_ext = os.path.splitext(base_name)[0]
     output_docx_path = os.path.join(output_dir, f"{file_name_no_ext}.docx")
 
-    command = [
-        soffice_path,
-        "--headless",  # Run in headless mode (no GUI)
-        "--convert-to",
-        "docx",  # Specify the output format
-        "--outdir",
-        output_dir,  # Specify the output directory
-        input_doc_path,  # The input file
-    ]
-
-    logger.debug(f"Executing command: {' '.join(command)}")
-
     try:
-        process = subprocess.run(
-            command, check=True, capture_output=True, text=True, timeout=120
-        )  # 120 seconds timeout
-        logger.debug(f"LibreOffice STDOUT: {process.stdout}")
-        if (
-                process.stderr
-        ):  # LibreOffice sometimes logger.debugs info to stderr even on success
-            logger.debug(f"LibreOffice STDERR: {process.stderr}")
+        libreoffice_convert(soffice_path, input_doc_path, output_dir, "docx", timeout=120)
 
         # Check if the file was actually created
         # LibreOffice creates the file with the correct name in the output_dir
@@ -137,15 +456,8 @@ def convert_doc_to_docx(input_doc_path, output_dir=None):
             "Ensure LibreOffice is installed and the command is in your PATH or provide the full path."
         )
         return None
-    except subprocess.CalledProcessError as e:
-        logger.debug(f"Error during LibreOffice conversion for '{input_doc_path}':")
-        logger.debug(f"Command: {' '.join(e.cmd)}")
-        logger.debug(f"Return code: {e.returncode}")
-        logger.debug(f"STDOUT: {e.stdout}")
-        logger.debug(f"STDERR: {e.stderr}")
-        return None
-    except subprocess.TimeoutExpired:
-        logger.debug(f"Error: LibreOffice conversion for '{input_doc_path}' timed out.")
+    except LibreOfficeConvertError as e:
+        logger.debug(f"Error during LibreOffice conversion for '{input_doc_path}': {e}")
         return None
     except Exception as e:
         logger.debug(
@@ -192,30 +504,9 @@ def convert_ppt_to_pdf(input_path, output_dir=None):
     pdf_name = os.path.splitext(base_name)[0] + ".pdf"
     expected_pdf_path = os.path.join(output_dir, pdf_name)
 
-    command = [
-        soffice_path,
-        "--headless",
-        "--convert-to",
-        "pdf",
-        "--outdir",
-        output_dir,
-        input_path,
-    ]
-
     try:
         logger.debug(f"Converting {input_path} to PDF using {soffice_path}...")
-        # LibreOffice can sometimes be slow to start up and convert.
-        # It may also not provide much stdout/stderr unless there's a significant error.
-        process = subprocess.run(
-            command, capture_output=True, text=True, check=True, timeout=180
-        )  # 180 seconds timeout
-
-        if process.stdout:
-            logger.debug(f"soffice stdout: {process.stdout}")  # Often empty on success
-        if process.stderr:
-            logger.debug(
-                f"soffice stderr: {process.stderr}"
-            )  # Check for any warnings/errors
+        libreoffice_convert(soffice_path, input_path, output_dir, "pdf", timeout=180)
 
         if os.path.exists(expected_pdf_path):
             logger.debug(f"Successfully converted {input_path} to {expected_pdf_path}")
@@ -236,25 +527,13 @@ def convert_ppt_to_pdf(input_path, output_dir=None):
             f"Error: {soffice_path} command not found. Please install LibreOffice and ensure it's in your PATH."
         )
         return False
-    except subprocess.CalledProcessError as e:
+    except LibreOfficeConvertError as e:
         logger.debug(f"Error during soffice conversion for {input_path}: {e}")
-        logger.debug(f"Exit code: {e.returncode}")
-        logger.debug(f"Stdout: {e.stdout}")
-        logger.debug(f"Stderr: {e.stderr}")
         # LibreOffice might return a non-zero exit code even for some warnings.
         # Check if the file was created anyway.
         if os.path.exists(expected_pdf_path):
             logger.debug(
-                f"Warning: soffice returned an error code, but PDF was created at {expected_pdf_path}"
-            )
-            return expected_pdf_path
-        return False
-    except subprocess.TimeoutExpired:
-        logger.debug(f"Error: soffice conversion for {input_path} timed out.")
-        # Check if the file was partially created or created despite timeout
-        if os.path.exists(expected_pdf_path):
-            logger.debug(
-                f"Warning: soffice timed out, but PDF might have been created at {expected_pdf_path}"
+                f"Warning: soffice returned an error, but PDF was created at {expected_pdf_path}"
             )
             return expected_pdf_path
         return False
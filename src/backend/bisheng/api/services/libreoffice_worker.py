@@ -0,0 +1,79 @@
+"""
+LibreOffice常驻实例的转换进程，由libreoffice_converter.py使用LibreOffice自带的（或者可以导入uno的）python启动：
+    python libreoffice_worker.py <command_fd> <result_fd> <port> <connect_timeout>
+连接上监听port的soffice后向result_fd写入一行 {"ready": true}，之后按行读取json格式的请求
+{"input_path", "output_path", "filter"}，结果 {} 或者 {"error"} 按行写入result_fd；请求 {"ping": true} 检查soffice是否可用。
+只依赖LibreOffice自带的python模块，不导入bisheng包
+"""
+import json
+import os
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+
+
+def props(**kwargs) -> tuple:
+    return tuple(PropertyValue(Name=key, Value=value) for key, value in kwargs.items())
+
+
+def connect(port: int, timeout: float):
+    """ soffice启动后需要一段时间才开始监听端口，超时前一直重试 """
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver",
+                                                                      local_context)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            context = resolver.resolve(f"uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext")
+            return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def convert(desktop, input_path: str, output_path: str, filter_name: str):
+    document = desktop.loadComponentFromURL(uno.systemPathToFileUrl(input_path), "_blank", 0,
+                                            props(Hidden=True, ReadOnly=True))
+    if document is None:
+        raise IOError(f"libreoffice can not open {input_path}")
+    try:
+        document.storeToURL(uno.systemPathToFileUrl(output_path), props(FilterName=filter_name, Overwrite=True))
+    finally:
+        document.close(True)
+
+
+def main():
+    command_file = os.fdopen(int(sys.argv[1]), 'r', encoding='utf-8')
+    result_file = os.fdopen(int(sys.argv[2]), 'w', encoding='utf-8')
+
+    def write(response: dict):
+        result_file.write(json.dumps(response, ensure_ascii=False) + '\n')
+        result_file.flush()
+
+    try:
+        desktop = connect(int(sys.argv[3]), float(sys.argv[4]))
+    except Exception as e:
+        write({'error': f'connect soffice failed: {type(e).__name__}: {e}'})
+        return
+    write({'ready': True})
+
+    for line in command_file:
+        if not line.strip():
+            continue
+        command = json.loads(line)
+        try:
+            if command.get('ping'):
+                desktop.getComponents()
+            else:
+                convert(desktop, command['input_path'], command['output_path'], command['filter'])
+            response = {}
+        except Exception as e:
+            response = {'error': f'{type(e).__name__}: {e}'}
+        write(response)
+
+
+if __name__ == '__main__':
+    main()
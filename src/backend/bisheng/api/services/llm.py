@@ -15,6 +15,7 @@ from bisheng.database.models.config import ConfigDao, ConfigKeyEnum, Config
 from bisheng.database.models.llm_server import LLMDao, LLMServer, LLMModel, LLMModelType
 from bisheng.interface.importing import import_by_type
 from bisheng.interface.initialize.loading import instantiate_llm, instantiate_embedding
+from bisheng.interface.model_registry import model_registry
 from bisheng.utils.embedding import decide_embeddings
 from bisheng.database.models.knowledge import KnowledgeDao, KnowledgeTypeEnum
 from bisheng.database.models.knowledge import KnowledgeState
@@ -96,11 +97,13 @@ class LLMService:
         # 说明模型全部添加失败了
         if len(success_models) == 0 and failed_msg:
             LLMDao.delete_server_by_id(ret.id)
+            model_registry.invalidate()
             raise ServerAddAllError.http_exception(failed_msg)
         elif len(success_models) > 0 and failed_msg:
             # 部分模型添加成功了, 删除失败的模型信息
             ret.models = success_models
             LLMDao.delete_model_by_ids(model_ids=[one.id for one in failed_models])
+            model_registry.invalidate()
             cls.add_llm_server_hook(request, login_user, ret)
             raise ServerAddError.http_exception(f"<{success_msg.rstrip(',')}>添加成功，{failed_msg}")
 
@@ -111,6 +114,7 @@ class LLMService:
     def delete_llm_server(cls, request: Request, login_user: UserPayload, server_id: int) -> bool:
         """ 删除一个服务提供方 """
         LLMDao.delete_server_by_id(server_id)
+        model_registry.invalidate()
         return True
 
     @classmethod
@@ -140,8 +144,11 @@ class LLMService:
                 bisheng_embed = cls.get_bisheng_embedding(model_id=model.id, ignore_online=True, cache=False)
                 bisheng_embed.embed_query('hello')
         except Exception as e:
-            LLMDao.update_model_status(model.id, 1, str(e))
+            model_registry.report_status(model.id, 1, str(e))
             logger.exception(f'test model status: {model.id} {model.model_name}')
+        finally:
+            # 管理页面需要马上看到测试结果，不等待后台批量写入
+            model_registry.flush_status()
 
     @classmethod
     def set_default_model(cls, request: Request, login_user: UserPayload, model: LLMModel):
@@ -225,6 +232,7 @@ class LLMService:
         exist_server.config = server.config
 
         db_server = LLMDao.update_server_with_models(exist_server, list(model_dict.values()))
+        model_registry.invalidate()
         new_server_info = cls.get_one_llm(request, login_user, db_server.id)
 
         # 判断是否需要重新判断模型状态
@@ -244,6 +252,7 @@ class LLMService:
             raise NotFoundError.http_exception()
         exist_model.online = online
         LLMDao.update_model_online(exist_model.id, online)
+        model_registry.invalidate()
         return LLMModelInfo(**exist_model.dict())
 
     @classmethod
@@ -1,11 +1,17 @@
-import math
+import itertools
 import os
-from typing import List
+from typing import Iterator, List, Optional
 from uuid import uuid4
+from xml.etree.ElementTree import iterparse
 
 import openpyxl
 import pandas as pd
 from loguru import logger
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.xml.constants import SHEET_MAIN_NS
+
+# 连续超过50行空行停止读取内容
+MAX_EMPTY_ROWS = 50
 
 
 def xls_to_xlsx(xls_path):
@@ -56,48 +62,70 @@ def remove_characters(s, chars_to_remove=["\n", "\r"]):
     return s.strip()
 
 
-def unmerge_and_read_sheet(sheet_obj):
+def read_merged_ranges(sheet_obj) -> List[CellRange]:
     """
-    读取 openpyxl 工作表对象，通过将合并区域左上角的值填充到该区域的所有单元格中来取消合并单元格，
-    并以列表的列表形式返回数据。
+    只读模式的工作表不解析合并单元格，单独流式解析工作表xml里的mergeCells，单元格数据边解析边丢弃
     """
-    if sheet_obj.max_row == 0 or sheet_obj.max_column == 0:
-        return []
-    max_row = sheet_obj.max_row
-    max_column = sheet_obj.max_column
-    data_grid = [
-        [None for _ in range(max_column)] for _ in range(max_row)
-    ]
-
-    # 连续50行空行停止读取内容
-    empty_row_num = 0
-    max_empty_rows = 50
-    empty_row_end = 0
-    for r_idx, row in enumerate(sheet_obj.iter_rows()):
-        if empty_row_num > max_empty_rows:
-            break
-        row_empty = True
-        for c_idx, cell in enumerate(row):
-            data_grid[r_idx][c_idx] = cell.value
-            if cell.value:
-                row_empty = False
-        if row_empty:
-            empty_row_num += 1
-            empty_row_end = r_idx
-        else:
-            empty_row_num = 0
-            empty_row_end = 0
+    merge_tag = f"{{{SHEET_MAIN_NS}}}mergeCell"
+    row_tag = f"{{{SHEET_MAIN_NS}}}row"
+    sheet_data_tag = f"{{{SHEET_MAIN_NS}}}sheetData"
+    ranges = []
+    sheet_data = None
+    with sheet_obj._get_source() as src:
+        for event, element in iterparse(src, events=("start", "end")):
+            if event == "start":
+                if element.tag == sheet_data_tag:
+                    sheet_data = element
+            elif element.tag == merge_tag:
+                ranges.append(CellRange(element.get("ref")))
+            elif element.tag == row_tag and sheet_data is not None:
+                sheet_data.clear()
+    return ranges
+
+
+def iter_unmerged_rows(sheet_obj, num_columns: int) -> Iterator[list]:
+    """
+    逐行读取只读模式的 openpyxl 工作表，将合并区域左上角的值填充到该区域的所有单元格中。
+    连续超过50行空行时停止读取，末尾的空行不返回，内存占用和工作表声明的行列数无关。
+    """
+    merged_ranges = sorted(read_merged_ranges(sheet_obj), key=lambda one: one.min_row)
+    next_range = 0
+    # 覆盖当前行的合并区域 [(range, 左上角的值)]
+    active_ranges = []
+    # 连续的空行先暂存，后面还有内容时才返回
+    empty_rows = []
+    for r_idx, values in enumerate(sheet_obj.iter_rows(max_col=num_columns, values_only=True), start=1):
+        row = list(values)
+        if len(row) < num_columns:
+            row.extend([None] * (num_columns - len(row)))
+
+        active_ranges = [one for one in active_ranges if one[0].max_row >= r_idx]
+        while next_range < len(merged_ranges) and merged_ranges[next_range].min_row <= r_idx:
+            merged_range = merged_ranges[next_range]
+            next_range += 1
+            if merged_range.min_row == r_idx and merged_range.min_col <= num_columns:
+                active_ranges.append((merged_range, row[merged_range.min_col - 1]))
+        for merged_range, value in active_ranges:
+            for c_idx in range(merged_range.min_col - 1, min(merged_range.max_col, num_columns)):
+                row[c_idx] = value
+
+        if not any(row):
+            empty_rows.append(row)
+            if len(empty_rows) > MAX_EMPTY_ROWS:
+                return
+            continue
+        yield from empty_rows
+        empty_rows = []
+        yield row
+
 
-    merged_cell_ranges = list(sheet_obj.merged_cells.ranges)
-    for merged_range in merged_cell_ranges:
-        min_col, min_row, max_col, max_row = merged_range.bounds
-        top_left_cell_value = sheet_obj.cell(row=min_row, column=min_col).value
-        for r in range(min_row, max_row + 1):
-            for c in range(min_col, max_col + 1):
-                data_grid[r - 1][c - 1] = top_left_cell_value
-    if empty_row_end and empty_row_end - max_empty_rows > 0:
-        data_grid = data_grid[:empty_row_end - max_empty_rows]
-    return data_grid
+def get_sheet_columns(sheet_obj) -> Optional[int]:
+    """ 工作表的列数，xml里没有记录范围时需要完整读取一遍计算 """
+    if sheet_obj.max_column is None:
+        sheet_obj.calculate_dimension(force=True)
+    if not sheet_obj.max_row or not sheet_obj.max_column:
+        return None
+    return sheet_obj.max_column
 
 
 def generate_markdown_table_string(
@@ -153,6 +181,89 @@ def generate_markdown_table_string(
     return "\n".join(md_lines)
 
 
+class MarkdownTableWriter:
+    """
+    逐行接收表格数据，每凑够 rows_per_markdown 行数据就生成一个Markdown文件，只保留当前分片的数据。
+    - append_header=True: 按 num_header_rows 分离表头和数据，每个文件都带上表头。
+    - append_header=False: 全部内容视为数据，每个文件的第一行作为表头，忽略 num_header_rows。
+    """
+
+    def __init__(self, sheet_index: str, num_columns: int, num_header_rows, rows_per_markdown, output_dir,
+                 append_header=True):
+        self.sheet_index = str(sheet_index)
+        self.num_columns = num_columns
+        self.rows_per_markdown = rows_per_markdown
+        self.output_dir = output_dir
+        self.append_header = append_header
+        # 确保索引合法，表头超出总行数的情况在结束时处理
+        self.header_start = max(num_header_rows[0], 0)
+        self.header_end = max(num_header_rows[1], self.header_start)
+        self.header_rows: List[list] = []
+        self.data_rows: List[list] = []
+        self.total_rows = 0
+        self.file_index = 0
+
+    @property
+    def header_ready(self) -> bool:
+        """ 表头的行都已经读到，才能开始生成文件 """
+        return not self.append_header or self.total_rows > self.header_end
+
+    def add_row(self, row: list):
+        if self.append_header and self.header_start <= self.total_rows <= self.header_end:
+            self.header_rows.append(row)
+        else:
+            self.data_rows.append(row)
+        self.total_rows += 1
+        if self.rows_per_markdown > 0 and self.header_ready:
+            while len(self.data_rows) >= self.rows_per_markdown:
+                self._write_chunk(self.data_rows[:self.rows_per_markdown])
+                self.data_rows = self.data_rows[self.rows_per_markdown:]
+
+    def close(self):
+        if self.total_rows == 0 or self.num_columns == 0:
+            return
+        if self.append_header and self.header_start >= self.total_rows:
+            # 表头起始行超出总行数，所有内容都视为数据
+            logger.warning(f"  表头起始行 {self.header_start} 超出总行数 {self.total_rows}，不使用表头。")
+            self.append_header = False
+            self.data_rows = self.data_rows + self.header_rows
+            self.header_rows = []
+
+        if self.file_index == 0 and not self.data_rows:
+            if self.append_header and self.header_rows:
+                self._write_file(generate_markdown_table_string(self.header_rows, [], self.num_columns), 0)
+                logger.debug(f"  已保存仅含表头的文件：'{self.sheet_index}'")
+            return
+        if self.rows_per_markdown > 0:
+            while self.data_rows:
+                self._write_chunk(self.data_rows[:self.rows_per_markdown])
+                self.data_rows = self.data_rows[self.rows_per_markdown:]
+        elif self.data_rows:
+            self._write_chunk(self.data_rows)
+            self.data_rows = []
+
+    def _write_chunk(self, chunk: List[list]):
+        header_rows = self.header_rows
+        data_rows = chunk
+        # 如果不附加真实表头，则将数据的第一行用作“伪表头”以生成分隔符
+        if not self.append_header:
+            header_rows = [chunk[0]]
+            data_rows = chunk[1:]
+        self._write_file(generate_markdown_table_string(header_rows, data_rows, self.num_columns), self.file_index)
+        logger.debug(f"  已保存：'{self.sheet_index}' 第 {self.file_index} 个文件 (含 {len(chunk)} 行原始数据)")
+        self.file_index += 1
+
+    def _write_file(self, markdown_content: str, file_index: int):
+        # Use zfill for proper 2-digit sheet and 3-digit file padding.
+        file_name = f"{self.sheet_index.zfill(2)}{str(file_index).zfill(3)}.md"
+        file_path = os.path.join(self.output_dir, file_name)
+        try:
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(markdown_content)
+        except Exception as e:
+            logger.debug(f"  保存文件 '{file_path}' 时出错: {e}")
+
+
 def process_dataframe_to_markdown_files(
         df,
         sheet_index: str,
@@ -169,95 +280,11 @@ def process_dataframe_to_markdown_files(
         logger.warning(f"  源 '{sheet_index}' 的数据DataFrame为空，跳过Markdown生成。")
         return
 
-    num_columns = df.shape[1]
-    rows = df.shape[0]
-
-    if rows == 0 or num_columns == 0:
-        return
-
-    header_block_df = pd.DataFrame()
-    start_header_idx, end_header_idx = num_header_rows[0], num_header_rows[1]
-    if start_header_idx >= rows:
-        append_header = False
-
-    # --- 核心逻辑修改：根据 append_header 决定如何切分数据 ---
-    if append_header:
-        # 根据用户规则处理表头索引越界问题
-        if start_header_idx >= rows:
-            logger.warning(f"  表头起始行 {start_header_idx} 超出总行数 {rows}。将使用第一行作为表头。")
-            start_header_idx, end_header_idx = 0, 0
-        elif end_header_idx >= rows:
-            logger.warning(f"  表头结束行 {end_header_idx} 超出总行数 {rows}。将截断至最后一行。")
-            end_header_idx = rows - 1
-
-        # 确保索引合法
-        if start_header_idx < 0: start_header_idx = 0
-        if end_header_idx < start_header_idx: end_header_idx = start_header_idx
-
-        try:
-            header_slice = slice(start_header_idx, end_header_idx + 1)
-            header_block_df = df.iloc[header_slice]
-            data_block_df = df.drop(df.index[header_slice]).reset_index(drop=True)
-            header_rows_as_lists = header_block_df.values.tolist()
-        except Exception as e:
-            logger.error(
-                f"  在源 '{sheet_index}' 中根据表头索引 [{start_header_idx}, {end_header_idx}] 切分数据时出错: {e}。跳过。")
-            return
-    else:
-        # 当 append_header 为 False 时，所有内容都视为数据，表头列表为空
-        header_rows_as_lists = []
-        data_block_df = df.reset_index(drop=True)
-
-    # --- 后续分页逻辑 ---
-    if data_block_df.empty:
-        if append_header and not header_block_df.empty:
-            markdown_content = generate_markdown_table_string(
-                header_rows_as_lists, [], num_columns
-            )
-            # BUG FIX: Use zfill for proper padding. This is file '000' for the sheet.
-            file_name = f"{str(sheet_index).zfill(2)}000.md"
-            file_path = os.path.join(output_dir, file_name)
-            try:
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(markdown_content)
-                logger.debug(f"  已保存仅含表头的文件：'{file_path}'")
-            except Exception as e:
-                logger.debug(f"  保存文件 '{file_path}' 时出错: {e}")
-        return
-
-    num_data_rows_total = len(data_block_df)
-    num_files_to_create = math.ceil(num_data_rows_total / rows_per_markdown) if rows_per_markdown > 0 else (
-        1 if num_data_rows_total > 0 else 0)
-
-    for i in range(num_files_to_create):
-        start_idx = i * rows_per_markdown
-        end_idx = min(start_idx + rows_per_markdown, num_data_rows_total)
-        current_data_chunk_as_lists = data_block_df.iloc[start_idx:end_idx].values.tolist()
-
-        final_header_for_chunk = header_rows_as_lists
-        final_data_for_chunk = current_data_chunk_as_lists
-
-        # 如果不附加真实表头，并且当前数据块不为空，则将数据的第一行用作“伪表头”以生成分隔符
-        if not append_header and current_data_chunk_as_lists:
-            final_header_for_chunk = [current_data_chunk_as_lists[0]]
-            final_data_for_chunk = current_data_chunk_as_lists[1:]
-
-        markdown_content = generate_markdown_table_string(
-            final_header_for_chunk, final_data_for_chunk, num_columns
-        )
-
-        # BUG FIX: Use zfill for proper 2-digit sheet and 3-digit file padding.
-        file_name = f"{str(sheet_index).zfill(2)}{str(i).zfill(3)}.md"
-        file_path = os.path.join(output_dir, file_name)
-
-        try:
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(markdown_content)
-            logger.debug(
-                f"  已保存：'{file_path}' (含 {len(current_data_chunk_as_lists)} 行原始数据)"
-            )
-        except Exception as e:
-            logger.debug(f"  保存文件 '{file_path}' 时出错: {e}")
+    writer = MarkdownTableWriter(sheet_index, df.shape[1], num_header_rows, rows_per_markdown, output_dir,
+                                 append_header=append_header)
+    for row in df.values.tolist():
+        writer.add_row(row)
+    writer.close()
 
 
 def is_list_of_lists_empty(data_list):
@@ -277,40 +304,40 @@ def excel_file_to_markdown(
 ):
     logger.debug(f"\n开始处理Excel文件：'{excel_path}'")
     try:
-        workbook = openpyxl.load_workbook(excel_path, data_only=True, read_only=False)
+        workbook = openpyxl.load_workbook(excel_path, data_only=True, read_only=True)
     except Exception as e:
         logger.debug(f"错误：无法加载Excel文件 '{excel_path}'。原因: {e}")
         return
 
-    sheet_index = 0
-    for sheet_name in workbook.sheetnames:
-        logger.debug(f"\n  正在处理Excel工作表：'{sheet_name}'...")
-        sheet_obj = workbook[sheet_name]
-        unmerged_data_list_of_lists = unmerge_and_read_sheet(sheet_obj)
-        logger.debug(f"\n  <read all data>Excel<UNK>'{sheet_name}'...{len(unmerged_data_list_of_lists)}")
-
-        # 使用新的判断函数
-        if is_list_of_lists_empty(unmerged_data_list_of_lists):
-            logger.debug(f"  工作表 '{sheet_name}' 为空或无有效数据，跳过。")
-            continue
-
-        df = pd.DataFrame(unmerged_data_list_of_lists)
-        df.fillna("", inplace=True)
-        if df.empty:
-            logger.debug(f"  工作表 '{sheet_name}' 处理后为空DataFrame，跳过。")
-            continue
-
-        process_dataframe_to_markdown_files(
-            df,
-            str(sheet_index),
-            num_header_rows,
-            rows_per_markdown,
-            output_dir,
-            append_header=append_header,
-        )
-        sheet_index += 1
-
-    if workbook:
+    try:
+        sheet_index = 0
+        for sheet_name in workbook.sheetnames:
+            logger.debug(f"\n  正在处理Excel工作表：'{sheet_name}'...")
+            sheet_obj = workbook[sheet_name]
+            num_columns = get_sheet_columns(sheet_obj)
+            if not num_columns:
+                logger.debug(f"  工作表 '{sheet_name}' 为空，跳过。")
+                continue
+
+            rows = iter_unmerged_rows(sheet_obj, num_columns)
+            # 读到第一行有效数据才能确定工作表不为空，之前的空行暂存
+            leading_rows = []
+            for row in rows:
+                leading_rows.append(row)
+                if not is_list_of_lists_empty([row]):
+                    break
+            else:
+                logger.debug(f"  工作表 '{sheet_name}' 为空或无有效数据，跳过。")
+                continue
+
+            writer = MarkdownTableWriter(str(sheet_index), num_columns, num_header_rows, rows_per_markdown,
+                                         output_dir, append_header=append_header)
+            for row in itertools.chain(leading_rows, rows):
+                writer.add_row(row)
+            writer.close()
+            logger.debug(f"\n  <read all data>Excel '{sheet_name}'...{writer.total_rows}")
+            sheet_index += 1
+    finally:
         workbook.close()
     logger.debug(f"\nExcel文件 '{excel_path}' 处理完成。")
 
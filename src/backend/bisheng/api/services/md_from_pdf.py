@@ -1,24 +1,190 @@
+import json
 import os
+import signal
+import subprocess
+import sys
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
 from uuid import uuid4
 
 import fitz
 from loguru import logger
 
+from bisheng.api.services.pdf_page_worker import convert_page
+
 pymu_lock = threading.Lock()
 
+# 默认的解析进程数和每个解析任务处理的页数
+PDF_WORKERS = 2
+PAGES_PER_TASK = 16
+PDF_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'pdf_page_worker.py')
+
+_pdf_pool: Optional['PdfWorkerPool'] = None
+_pdf_pool_lock = threading.Lock()
+
+
+class PdfPageParseError(Exception):
+    """ 解析进程内转换失败，进程本身仍然可用 """
+
+
+class PdfWorkerProcess:
+    """ 一个常驻的pdf解析子进程，运行pdf_page_worker.py，不导入bisheng包 """
+
+    def __init__(self):
+        command_read, command_write = os.pipe()
+        result_read, result_write = os.pipe()
+        try:
+            self.process = subprocess.Popen([sys.executable, PDF_WORKER_SCRIPT, str(command_read), str(result_write)],
+                                            pass_fds=(command_read, result_write),
+                                            stdin=subprocess.DEVNULL,
+                                            start_new_session=True)
+        finally:
+            os.close(command_read)
+            os.close(result_write)
+        self._command = os.fdopen(command_write, 'w', encoding='utf-8')
+        self._result = os.fdopen(result_read, 'r', encoding='utf-8')
+        self.closed = False
+
+    def is_alive(self) -> bool:
+        return not self.closed and self.process.poll() is None
+
+    def convert(self, pdf_path: str, start: int, end: int, img_dir: str) -> List[str]:
+        self._command.write(json.dumps({'pdf_path': pdf_path, 'start': start, 'end': end, 'img_dir': img_dir},
+                                       ensure_ascii=False) + '\n')
+        self._command.flush()
+        line = self._result.readline()
+        if not line:
+            raise ChildProcessError(f'pdf worker exited unexpectedly, code={self.process.poll()}')
+        response = json.loads(line)
+        if 'error' in response:
+            raise PdfPageParseError(response['error'])
+        return response['pages']
+
+    def kill(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                self.process.kill()
+        self.process.wait()
+        for one in (self._command, self._result):
+            try:
+                one.close()
+            except OSError:
+                pass
+
+
+class PdfWorkerPool:
+    """ 进程内共享的pdf解析进程池，子进程空闲时常驻复用，异常退出的子进程在下次使用时重新创建 """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._idle: List[PdfWorkerProcess] = []
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(workers)
+        self.closed = False
+
+    def _acquire(self) -> PdfWorkerProcess:
+        self._semaphore.acquire()
+        try:
+            with self._lock:
+                while self._idle:
+                    one = self._idle.pop()
+                    if one.is_alive():
+                        return one
+                    one.kill()
+            return PdfWorkerProcess()
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    def _release(self, worker: PdfWorkerProcess, broken: bool):
+        try:
+            if self.closed or broken or not worker.is_alive():
+                worker.kill()
+            else:
+                with self._lock:
+                    self._idle.append(worker)
+        finally:
+            self._semaphore.release()
+
+    def convert_page_range(self, pdf_path: str, start: int, end: int, img_dir: str) -> List[str]:
+        worker = self._acquire()
+        broken = False
+        try:
+            return worker.convert(pdf_path, start, end, img_dir)
+        except PdfPageParseError:
+            raise
+        except BaseException:
+            # 子进程退出或者通信中断，管道内的状态不确定，直接结束
+            broken = True
+            raise
+        finally:
+            self._release(worker, broken)
+
+    def close(self):
+        """ 结束空闲的子进程，使用中的在归还时结束 """
+        self.closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for one in idle:
+            one.kill()
+
+
+def get_pdf_pool(workers: int) -> PdfWorkerPool:
+    """ 进程内共享的pdf解析进程池，进程数变化后重新创建 """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None or _pdf_pool.workers != workers:
+            if _pdf_pool is not None:
+                _pdf_pool.close()
+            _pdf_pool = PdfWorkerPool(workers)
+        return _pdf_pool
+
+
+def iter_pages_in_pool(pdf_path: str, page_count: int, img_dir: str, workers: int,
+                       pages_per_task: int) -> Iterator[str]:
+    """ 按页分片提交到进程池，按页码顺序返回结果 """
+    pool = get_pdf_pool(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(pool.convert_page_range, pdf_path, start,
+                                   min(start + pages_per_task, page_count), img_dir)
+                   for start in range(0, page_count, pages_per_task)]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def iter_pages_local(doc: fitz.Document, img_dir: str) -> Iterator[str]:
+    for page_num in range(len(doc)):
+        with pymu_lock:
+            page_md = convert_page(doc, page_num, img_dir)
+        yield page_md
+
 
-def convert_pdf_to_md(output_dir, pdf_path, doc_id):
+def convert_pdf_to_md(output_dir, pdf_path, doc_id, workers: int = PDF_WORKERS,
+                      pages_per_task: int = PAGES_PER_TASK):
     """
     将指定的 PDF 文件转换为 Markdown 文件，并保持内容的原有顺序。
 
     这个函数会提取 PDF 中的文本、表格和图片，并根据它们在页面上的
     垂直位置进行排序，然后整合到一个 Markdown 文件中。
     图片会作为独立文件保存在指定的输出目录中。
+    页数超过一个分片时，按页分片在进程池内并行解析，结果按页码顺序写入文件。
 
     Args:
         pdf_path (str): 输入的 PDF 文件路径。
         output_dir (str): 保存 Markdown 文件和图片的目录。
+        workers (int): 解析进程数，0表示使用CPU核数，1表示在当前进程内逐页解析。
+            解析进程运行pdf_page_worker.py，不导入bisheng包，空闲时常驻复用。
+        pages_per_task (int): 每个解析任务处理的页数。
     """
     # 确保输出目录存在
     if not os.path.exists(output_dir):
@@ -38,86 +204,16 @@ def convert_pdf_to_md(output_dir, pdf_path, doc_id):
     except Exception as e:
         raise Exception('The file is damaged.')
     try:
-        md_content = ""
-        image_counter = 1
-
-        for page_num in range(len(doc)):
-            with pymu_lock:
-                page = doc.load_page(page_num)
-
-                page_elements = []
-
-                tables = page.find_tables()
-                if tables.tables:
-                    for tab in tables.tables:
-                        if not tab.to_pandas().empty:
-                            md_table = tab.to_pandas().to_markdown(index=False)
-                            table_bbox = fitz.Rect(tab.bbox)
-                            page_elements.append(
-                                {
-                                    "type": "table",
-                                    "bbox": table_bbox,
-                                    "content": md_table,
-                                }
-                            )
-
-                image_info_list = page.get_image_info(xrefs=True)
-                if image_info_list:
-                    for img_info in image_info_list:
-                        xref = img_info["xref"]
-                        if xref == 0:
-                            continue
-
-                        base_image = doc.extract_image(xref)
-                        if not base_image:
-                            continue
-
-                        image_bytes = base_image["image"]
-                        image_ext = base_image["ext"]
-
-                        img_filename = f"image_{page_num + 1}_{image_counter}.{image_ext}"
-                        img_path = os.path.join(img_dir, img_filename)
-
-                        with open(img_path, "wb") as img_file:
-                            img_file.write(image_bytes)
-
-                        md_image = f"![{img_filename}]({img_dir}/{img_filename})"
-
-                        image_bbox = fitz.Rect(img_info["bbox"])
-                        page_elements.append(
-                            {"type": "image", "bbox": image_bbox, "content": md_image}
-                        )
-                        image_counter += 1
-
-                table_bboxes = (
-                    [fitz.Rect(tab.bbox) for tab in tables.tables]
-                    if tables.tables
-                    else []
-                )
-
-                text_blocks = page.get_text("blocks")
-                for b in text_blocks:
-                    block_rect = fitz.Rect(b[:4])
-                    block_text = b[4].strip()
-
-                    is_in_table = False
-                    for table_bbox in table_bboxes:
-                        if block_rect.intersects(table_bbox):
-                            is_in_table = True
-                            break
-
-                    if block_text and not is_in_table:
-                        page_elements.append(
-                            {"type": "text", "bbox": block_rect, "content": block_text}
-                        )
-
-            page_elements.sort(key=lambda el: el["bbox"].y0)
-
-            for elem in page_elements:
-                md_content += elem["content"] + "\n\n"
-
+        workers = workers or os.cpu_count() or 1
+        pages_per_task = max(pages_per_task, 1)
+        page_count = len(doc)
         with open(md_filepath, "w", encoding="utf-8") as md_file:
-            md_file.write(md_content)
+            if workers > 1 and page_count > pages_per_task:
+                pages = iter_pages_in_pool(pdf_path, page_count, img_dir, workers, pages_per_task)
+            else:
+                pages = iter_pages_local(doc, img_dir)
+            for page_md in pages:
+                md_file.write(page_md)
 
     except Exception as e:
         logger.exception(f"Error processing pdf: {e}")
@@ -147,10 +243,18 @@ def is_pdf_damaged(pdf_path: str) -> bool:
         return True
 
 
+def get_pdf_parse_conf() -> dict:
+    """ pdf解析的配置 {"workers": 解析进程数, "pages_per_task": 每个解析任务的页数} """
+    from bisheng.settings import settings
+    return settings.get_knowledge().get("pdf_parse", None) or {}
+
+
 def handler(cache_dir, file_or_url: str):
     doc_id = uuid4()
     ouput_dir = f"{cache_dir}/{doc_id}"
-    convert_pdf_to_md(ouput_dir, file_or_url, doc_id)
+    conf = get_pdf_parse_conf()
+    convert_pdf_to_md(ouput_dir, file_or_url, doc_id, workers=int(conf.get("workers", PDF_WORKERS)),
+                      pages_per_task=int(conf.get("pages_per_task", PAGES_PER_TASK)))
     return f"{ouput_dir}/{doc_id}.md", f"{ouput_dir}/images", doc_id
 
 
@@ -0,0 +1,114 @@
+"""
+pdf按页转换markdown的常驻解析进程，由md_from_pdf.py启动：
+    python pdf_page_worker.py <command_fd> <result_fd>
+按行读取json格式的请求 {"pdf_path", "start", "end", "img_dir"}，结果 {"pages": [每一页的markdown]} 按行写入result_fd。
+不导入bisheng包，md_from_pdf.py在当前进程内逐页解析时也直接使用这里的convert_page
+"""
+import json
+import os
+import sys
+from typing import List
+
+import fitz
+
+# 表格空间索引按页面高度划分的行数
+TABLE_INDEX_ROWS = 32
+
+
+class TableIndex:
+    """ 按纵坐标分桶的表格区域索引，判断文本块是否落在表格内时只和同一行桶内的表格比较 """
+
+    def __init__(self, page_rect: fitz.Rect, table_bboxes: List[fitz.Rect]):
+        self.top = page_rect.y0
+        self.row_height = max(page_rect.height / TABLE_INDEX_ROWS, 1)
+        self.rows = {}
+        for bbox in table_bboxes:
+            for row in self._row_range(bbox):
+                self.rows.setdefault(row, []).append(bbox)
+
+    def _row_range(self, rect: fitz.Rect) -> range:
+        return range(int((rect.y0 - self.top) // self.row_height), int((rect.y1 - self.top) // self.row_height) + 1)
+
+    def intersects(self, rect: fitz.Rect) -> bool:
+        if not self.rows:
+            return False
+        for row in self._row_range(rect):
+            for bbox in self.rows.get(row, ()):
+                if rect.intersects(bbox):
+                    return True
+        return False
+
+
+def convert_page(doc: fitz.Document, page_num: int, img_dir: str) -> str:
+    """ 将一页转换为markdown，文本、表格和图片按在页面上的垂直位置排序 """
+    page = doc.load_page(page_num)
+    page_elements = []
+
+    tables = page.find_tables()
+    table_bboxes = []
+    for tab in tables.tables:
+        table_bbox = fitz.Rect(tab.bbox)
+        table_bboxes.append(table_bbox)
+        df = tab.to_pandas()
+        if not df.empty:
+            page_elements.append({"type": "table", "bbox": table_bbox, "content": df.to_markdown(index=False)})
+
+    image_counter = 1
+    for img_info in page.get_image_info(xrefs=True):
+        xref = img_info["xref"]
+        if xref == 0:
+            continue
+
+        base_image = doc.extract_image(xref)
+        if not base_image:
+            continue
+
+        # 图片按页内序号命名，不依赖其他页的处理结果
+        img_filename = f"image_{page_num + 1}_{image_counter}.{base_image['ext']}"
+        with open(os.path.join(img_dir, img_filename), "wb") as img_file:
+            img_file.write(base_image["image"])
+
+        md_image = f"![{img_filename}]({img_dir}/{img_filename})"
+        page_elements.append({"type": "image", "bbox": fitz.Rect(img_info["bbox"]), "content": md_image})
+        image_counter += 1
+
+    table_index = TableIndex(page.rect, table_bboxes)
+    for b in page.get_text("blocks"):
+        block_text = b[4].strip()
+        if not block_text:
+            continue
+        block_rect = fitz.Rect(b[:4])
+        if not table_index.intersects(block_rect):
+            page_elements.append({"type": "text", "bbox": block_rect, "content": block_text})
+
+    page_elements.sort(key=lambda el: el["bbox"].y0)
+    return "".join(elem["content"] + "\n\n" for elem in page_elements)
+
+
+def convert_page_range(pdf_path: str, start: int, end: int, img_dir: str) -> List[str]:
+    """ 打开文档，返回[start, end)每一页的markdown """
+    doc = fitz.open(pdf_path)
+    try:
+        return [convert_page(doc, page_num, img_dir) for page_num in range(start, end)]
+    finally:
+        doc.close()
+
+
+def main():
+    command_file = os.fdopen(int(sys.argv[1]), 'r', encoding='utf-8')
+    result_file = os.fdopen(int(sys.argv[2]), 'w', encoding='utf-8')
+    for line in command_file:
+        if not line.strip():
+            continue
+        command = json.loads(line)
+        try:
+            response = {'pages': convert_page_range(command['pdf_path'], command['start'], command['end'],
+                                                    command['img_dir'])}
+        except Exception as e:
+            response = {'error': f'{type(e).__name__}: {e}'}
+        result_file.write(json.dumps(response, ensure_ascii=False) + '\n')
+        result_file.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -100,7 +100,7 @@ class ToolServices(BaseModel):
             # 实例化mcp服务对象，获取工具列表
             client = await ClientManager.connect_mcp_from_json(result)
 
-            tools = await client.list_tools()
+            tools = await client.list_tools(use_cache=False)
 
             for one in tools:
                 tool_type.children.append(GptsTools(
@@ -221,7 +221,7 @@ class ToolServices(BaseModel):
         # 1. get all new tools
         # 实例化mcp服务对象，获取工具列表
         client = await ClientManager.connect_mcp_from_json(tool_type.openapi_schema)
-        tools = await client.list_tools()
+        tools = await client.list_tools(use_cache=False)
         children = []
         for one in tools:
             children.append(GptsTools(
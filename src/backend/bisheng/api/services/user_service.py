@@ -1,7 +1,7 @@
 import functools
 import json
 from base64 import b64decode
-from typing import List, Dict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import rsa
 from bisheng.api.errcode.http_error import UnAuthorizedError
@@ -10,6 +10,8 @@ from bisheng.api.errcode.user import (UserLoginOfflineError, UserNameAlreadyExis
 from bisheng.api.JWT import ACCESS_TOKEN_EXPIRE_TIME
 from bisheng.api.utils import md5_hash
 from bisheng.api.v1.schemas import CreateUserReq
+from bisheng.cache.permission import (aget_permission_version, aget_user_permission, aset_user_permission,
+                                      get_permission_version, get_user_permission, set_user_permission)
 from bisheng.cache.redis import redis_client
 from bisheng.database.constants import AdminRole
 from bisheng.database.models.assistant import Assistant, AssistantDao
@@ -26,15 +28,77 @@ from fastapi import Depends, HTTPException, Request
 from fastapi_jwt_auth import AuthJWT
 
 
+class UserPermission:
+    """
+    用户的权限上下文：角色列表、管理的用户组、角色的资源授权
+    按用户缓存在redis和进程内，角色、用户组管理员、角色授权变化后通过版本号失效
+    """
+
+    def __init__(self, user_id: int, data: Dict):
+        self.user_id = user_id
+        self.data = data
+
+    @property
+    def roles(self) -> List[int]:
+        return self.data['roles']
+
+    @staticmethod
+    def _new_data(version: int, roles: List[int]) -> Dict:
+        return {
+            'version': version,
+            'roles': roles,
+            # 管理的用户组id列表，按需加载
+            'admin_groups': None,
+            # access_type: 有权限的资源id列表，按需加载
+            'access': {},
+        }
+
+    @classmethod
+    def get(cls, user_id: int) -> 'UserPermission':
+        version = get_permission_version()
+        data = get_user_permission(user_id, version)
+        if data is None:
+            data = cls._new_data(version, [one.role_id for one in UserRoleDao.get_user_roles(user_id)])
+            set_user_permission(user_id, data)
+        return cls(user_id, data)
+
+    @classmethod
+    async def aget(cls, user_id: int) -> 'UserPermission':
+        version = await aget_permission_version()
+        data = await aget_user_permission(user_id, version)
+        if data is None:
+            data = cls._new_data(version, [one.role_id for one in await UserRoleDao.aget_user_roles(user_id)])
+            await aset_user_permission(user_id, data)
+        return cls(user_id, data)
+
+    def get_admin_groups(self) -> Set[int]:
+        if self.data.get('admin_groups') is None:
+            self.data['admin_groups'] = [one.group_id for one in UserGroupDao.get_user_admin_group(self.user_id)]
+            set_user_permission(self.user_id, self.data)
+        return set(self.data['admin_groups'])
+
+    def get_access_ids(self, access_type: AccessType) -> Set[str]:
+        """ 用户的角色被授权的某类资源的id集合 """
+        access = self.data['access'].get(access_type.value)
+        if access is None:
+            access = [one.third_id for one in RoleAccessDao.get_role_access(self.roles, access_type)] \
+                if self.roles else []
+            self.data['access'][access_type.value] = access
+            set_user_permission(self.user_id, self.data)
+        return set(access)
+
+
 class UserPayload:
 
     def __init__(self, **kwargs):
         self.user_id = kwargs.get('user_id')
         self.user_role = kwargs.get('role')
         self.group_cache = {}
+        self.permission: Optional[UserPermission] = kwargs.get('permission')
         if self.user_role != 'admin':  # 非管理员用户，需要获取他的角色列表
-            roles = UserRoleDao.get_user_roles(self.user_id)
-            self.user_role = [one.role_id for one in roles]
+            if self.permission is None:
+                self.permission = UserPermission.get(self.user_id)
+            self.user_role = list(self.permission.roles)
         self.user_name = kwargs.get('user_name')
 
     def is_admin(self):
@@ -70,9 +134,18 @@ class UserPayload:
         if self.user_id == owner_user_id:
             return True
         # 判断授权
-        if RoleAccessDao.judge_role_access(self.user_role, target_id, access_type):
-            return True
-        return False
+        return str(target_id) in self.permission.get_access_ids(access_type)
+
+    def access_check_many(self, resources: Iterable[Tuple[int, str]], access_type: AccessType) -> List[bool]:
+        """
+            批量检查用户是否有资源的权限，resources: [(owner_user_id, target_id)]，列表接口使用
+        """
+        resources = list(resources)
+        if self.is_admin():
+            return [True] * len(resources)
+        access_ids = self.permission.get_access_ids(access_type)
+        return [self.user_id == owner_user_id or str(target_id) in access_ids
+                for owner_user_id, target_id in resources]
 
     @wrapper_access_check
     def copiable_check(self, owner_user_id: int) -> bool:
@@ -90,24 +163,14 @@ class UserPayload:
             检查用户是否是某个组的管理员
         """
         # 判断是否是用户组的管理员
-        user_group = UserGroupDao.get_user_admin_group(self.user_id)
-        if not user_group:
-            return False
-        for one in user_group:
-            if one.group_id == group_id:
-                return True
-        return False
+        return group_id in self.permission.get_admin_groups()
 
     @wrapper_access_check
     def check_groups_admin(self, group_ids: List[int]) -> bool:
         """
         检查用户是否是用户组列表中的管理员，有一个就是true
         """
-        user_groups = UserGroupDao.get_user_admin_group(self.user_id)
-        for one in user_groups:
-            if one.is_group_admin and one.group_id in group_ids:
-                return True
-        return False
+        return not self.permission.get_admin_groups().isdisjoint(group_ids)
 
     def get_user_groups(self, user_id: int) -> List[Dict]:
         """ 查询用户的角色列表 """
@@ -293,6 +356,9 @@ async def get_login_user(authorize: AuthJWT = Depends()) -> UserPayload:
     authorize.jwt_required()
 
     current_user = json.loads(authorize.get_jwt_subject())
+    if current_user.get('role') != 'admin':
+        # 异步获取权限上下文，避免阻塞事件循环
+        current_user['permission'] = await UserPermission.aget(current_user.get('user_id'))
     user = UserPayload(**current_user)
 
     # 判断是否允许多点登录
@@ -8,6 +8,7 @@ from sqlmodel import select
 from bisheng.api.errcode.qa import BackendProcessingError
 from bisheng.api.services.knowledge import KnowledgeService
 from bisheng.api.v1.schemas import resp_200
+from bisheng.chat.utils import is_source_trace_pending
 from bisheng.database.base import session_getter
 from bisheng.database.models.knowledge_file import KnowledgeFileDao
 from bisheng.database.models.recall_chunk import RecallChunk
@@ -21,6 +22,8 @@ router = APIRouter(prefix='/qa', tags=['QA'])
 async def get_answer_keyword(message_id: int):
     # 获取命中的key
     conter = 3
+    # 溯源信息还在异步任务中处理时，最多等待的秒数
+    max_wait = 30
     while True:
         with session_getter() as session:
             chunks = session.exec(
@@ -31,10 +34,11 @@ async def get_answer_keyword(message_id: int):
             return resp_200(json.loads(keywords))
         else:
             # 延迟循环
-            if conter <= 0:
+            if conter <= 0 and (max_wait <= 0 or not is_source_trace_pending(message_id)):
                 break
             await asyncio.sleep(1)
             conter -= 1
+            max_wait -= 1
     raise BackendProcessingError()
 
 
@@ -7,3 +7,5 @@ from pydantic import Field
 class KnowledgeFileResp(KnowledgeFileBase):
     id: Optional[int] = Field(default=None)
     title: Optional[str] = Field(default=None, description="文件摘要")
+    progress: Optional[dict] = Field(default=None,
+                                     description="解析中的文件的入库进度 {finished: 已入库的分块数, total: 总分块数}")
@@ -24,6 +24,7 @@ from bisheng.api.services.user_service import (UserPayload, gen_user_jwt, gen_us
                                                get_admin_user, UserService)
 from bisheng.api.utils import get_request_ip
 from bisheng.api.v1.schemas import resp_200, CreateUserReq
+from bisheng.cache.permission import invalidate_user_permission
 from bisheng.cache.redis import redis_client
 from bisheng.database.base import session_getter
 from bisheng.database.constants import AdminRole, DefaultRole
@@ -630,6 +631,7 @@ async def access_refresh(*, request: Request, data: RoleRefresh, login_user: Use
             role_access = RoleAccess(role_id=role_id, third_id=str(third_id), type=access_type)
             session.add(role_access)
         session.commit()
+    invalidate_user_permission()
     update_role_hook(request, login_user, db_role)
     return resp_200()
 
@@ -0,0 +1,120 @@
+import threading
+from typing import Dict, Optional
+
+from cachetools import TTLCache
+from loguru import logger
+
+from bisheng.cache.redis import redis_client
+
+# 权限数据的版本号，角色、用户组、角色授权变化时自增，所有副本的缓存随之失效
+PERMISSION_VERSION_KEY = 'user:permission:version'
+PERMISSION_EXPIRE = 300
+
+# user_id: 权限数据，进程内缓存，每次使用前和redis内的版本号比较
+_local_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+_local_lock = threading.Lock()
+
+
+def get_permission_key(user_id: int) -> str:
+    return f'user:permission:{user_id}'
+
+
+def get_permission_version() -> int:
+    try:
+        return int(redis_client.connection.get(PERMISSION_VERSION_KEY) or 0)
+    except Exception as e:
+        logger.warning(f'get permission version error: {e}')
+        return -1
+
+
+async def aget_permission_version() -> int:
+    try:
+        return int(await redis_client.async_connection.get(PERMISSION_VERSION_KEY) or 0)
+    except Exception as e:
+        logger.warning(f'get permission version error: {e}')
+        return -1
+
+
+def _get_local(user_id: int, version: int) -> Optional[Dict]:
+    with _local_lock:
+        data = _local_cache.get(user_id)
+    if data is not None and data['version'] == version:
+        return data
+    return None
+
+
+def _set_local(user_id: int, data: Dict):
+    with _local_lock:
+        _local_cache[user_id] = data
+
+
+def get_user_permission(user_id: int, version: int) -> Optional[Dict]:
+    """ 获取缓存的用户权限数据，版本号不一致返回None；version为-1表示redis不可用，不使用缓存 """
+    if version < 0:
+        return None
+    if data := _get_local(user_id, version):
+        return data
+    try:
+        data = redis_client.get(get_permission_key(user_id))
+    except Exception as e:
+        logger.warning(f'get user permission cache error: {e}')
+        return None
+    if data is None or data['version'] != version:
+        return None
+    _set_local(user_id, data)
+    return data
+
+
+async def aget_user_permission(user_id: int, version: int) -> Optional[Dict]:
+    if version < 0:
+        return None
+    if data := _get_local(user_id, version):
+        return data
+    try:
+        data = await redis_client.aget(get_permission_key(user_id))
+    except Exception as e:
+        logger.warning(f'get user permission cache error: {e}')
+        return None
+    if data is None or data['version'] != version:
+        return None
+    _set_local(user_id, data)
+    return data
+
+
+def set_user_permission(user_id: int, data: Dict):
+    if data['version'] < 0:
+        return
+    _set_local(user_id, data)
+    try:
+        redis_client.set(get_permission_key(user_id), data, expiration=PERMISSION_EXPIRE)
+    except Exception as e:
+        logger.warning(f'set user permission cache error: {e}')
+
+
+async def aset_user_permission(user_id: int, data: Dict):
+    if data['version'] < 0:
+        return
+    _set_local(user_id, data)
+    try:
+        await redis_client.aset(get_permission_key(user_id), data, expiration=PERMISSION_EXPIRE)
+    except Exception as e:
+        logger.warning(f'set user permission cache error: {e}')
+
+
+def invalidate_user_permission():
+    """ 角色、用户组管理员、角色授权变化后调用，使所有用户的权限缓存失效 """
+    try:
+        redis_client.incr(PERMISSION_VERSION_KEY, expiration=0)
+    except Exception as e:
+        logger.error(f'invalidate user permission cache error: {e}')
+    with _local_lock:
+        _local_cache.clear()
+
+
+async def ainvalidate_user_permission():
+    try:
+        await redis_client.aincr(PERMISSION_VERSION_KEY, expiration=0)
+    except Exception as e:
+        logger.error(f'invalidate user permission cache error: {e}')
+    with _local_lock:
+        _local_cache.clear()
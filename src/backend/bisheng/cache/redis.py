@@ -16,6 +16,11 @@ from redis.asyncio.sentinel import Sentinel as AsyncSentinel
 from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
 from redis.asyncio import Redis as AsyncRedis
 
+# 阻塞读取使用的连接的socket超时时间（秒），需要大于阻塞等待的时间
+BLOCK_SOCKET_TIMEOUT = 30
+# 阻塞读取的连接池满时，等待空闲连接的时间（秒）
+BLOCK_POOL_TIMEOUT = 10
+
 
 class RedisClient:
 
@@ -39,6 +44,12 @@ class RedisClient:
                                                         cluster_error_retry_attempts=1)
                 self.async_connection: typing.Union[AsyncRedisCluster, AsyncRedis] = AsyncRedisCluster.from_url(
                     cluster_url, **redis_conf, retry=Retry(ExponentialBackoff(), 6), cluster_error_retry_attempts=1)
+                # 阻塞读取会长时间占用连接，使用单独的客户端，避免占满普通命令的连接池
+                self.block_connection = RedisCluster.from_url(cluster_url, **redis_conf,
+                                                              retry=Retry(ExponentialBackoff(), 6),
+                                                              cluster_error_retry_attempts=1)
+                self.async_block_connection: AsyncRedisCluster = AsyncRedisCluster.from_url(
+                    cluster_url, **redis_conf, retry=Retry(ExponentialBackoff(), 6), cluster_error_retry_attempts=1)
                 return
             hosts = [eval(x) for x in redis_conf.pop('sentinel_hosts')]
             password = redis_conf.pop('sentinel_password')
@@ -48,6 +59,10 @@ class RedisClient:
             # 获取主节点的连接
             self.connection = sentinel.master_for(master, socket_timeout=0.1, **redis_conf)
             self.async_connection: AsyncRedis = async_sentinel.master_for(master, socket_timeout=0.1, **redis_conf)
+            # 普通连接的超时时间很短，阻塞读取使用单独的连接
+            self.block_connection = sentinel.master_for(master, socket_timeout=BLOCK_SOCKET_TIMEOUT, **redis_conf)
+            self.async_block_connection: AsyncRedis = async_sentinel.master_for(
+                master, socket_timeout=BLOCK_SOCKET_TIMEOUT, **redis_conf)
 
         else:
             # 单机模式
@@ -55,6 +70,13 @@ class RedisClient:
             self.async_pool = redis.asyncio.ConnectionPool.from_url(url, max_connections=max_connections)
             self.connection = redis.StrictRedis(connection_pool=self.pool)
             self.async_connection: AsyncRedis = redis.asyncio.Redis.from_pool(self.async_pool)
+            # 阻塞读取会长时间占用连接，使用单独的连接池，连接用完时排队等待而不是报错
+            self.block_pool = redis.BlockingConnectionPool.from_url(url, max_connections=max_connections,
+                                                                    timeout=BLOCK_POOL_TIMEOUT)
+            self.async_block_pool = redis.asyncio.BlockingConnectionPool.from_url(url, max_connections=max_connections,
+                                                                                  timeout=BLOCK_POOL_TIMEOUT)
+            self.block_connection = redis.StrictRedis(connection_pool=self.block_pool)
+            self.async_block_connection: AsyncRedis = redis.asyncio.Redis.from_pool(self.async_block_pool)
 
     def set(self, key, value, expiration=3600):
         try:
@@ -430,6 +452,79 @@ class RedisClient:
         except Exception as e:
             raise e
 
+    # ==================== Stream支持 ====================
+
+    def xadd(self, key, fields: dict, expiration=3600):
+        """ 往stream中追加一条消息，和过期时间一起通过pipeline一次发送 """
+        try:
+            self.cluster_nodes(key)
+            pipe = self.connection.pipeline(transaction=False)
+            pipe.xadd(key, fields)
+            if expiration:
+                pipe.expire(key, expiration)
+            return pipe.execute()[0]
+        except Exception as e:
+            raise e
+
+    def xadd_many(self, key, fields_list: typing.List[dict], expiration=3600) -> list:
+        """ 往stream中按顺序追加多条消息，和过期时间一起通过pipeline一次发送 """
+        try:
+            self.cluster_nodes(key)
+            pipe = self.connection.pipeline(transaction=False)
+            for fields in fields_list:
+                pipe.xadd(key, fields)
+            if expiration:
+                pipe.expire(key, expiration)
+            return pipe.execute()[:len(fields_list)]
+        except Exception as e:
+            raise e
+
+    @staticmethod
+    def _limit_block(connection, block: int | None) -> int | None:
+        """ 阻塞时间不能超过连接的socket超时时间，否则每次阻塞读取都会超时并断开连接 """
+        if not block:
+            return block
+        pool = getattr(connection, 'connection_pool', None)
+        socket_timeout = pool.connection_kwargs.get('socket_timeout') if pool else None
+        if socket_timeout:
+            block = min(block, max(int(socket_timeout * 1000) - 100, 1))
+        return block
+
+    def xread(self, key, last_id='0-0', count: int = None, block: int = None) -> list:
+        """ 读取stream中last_id之后的消息，block为阻塞等待的毫秒数
+        return: [(message_id, fields)] """
+        try:
+            self.cluster_nodes(key)
+            ret = self.block_connection.xread({key: last_id}, count=count,
+                                              block=self._limit_block(self.block_connection, block))
+        except redis.exceptions.TimeoutError:
+            # 网络异常导致的超时，当作没有消息处理
+            return []
+        return ret[0][1] if ret else []
+
+    async def axread(self, key, last_id='0-0', count: int = None, block: int = None) -> list:
+        try:
+            await self.acluster_nodes(key)
+            ret = await self.async_block_connection.xread({key: last_id}, count=count,
+                                                          block=self._limit_block(self.async_block_connection, block))
+        except redis.exceptions.TimeoutError:
+            return []
+        return ret[0][1] if ret else []
+
+    def xdel(self, key, *ids):
+        try:
+            self.cluster_nodes(key)
+            return self.connection.xdel(key, *ids)
+        except Exception as e:
+            raise e
+
+    async def axdel(self, key, *ids):
+        try:
+            await self.acluster_nodes(key)
+            return await self.async_connection.xdel(key, *ids)
+        except Exception as e:
+            raise e
+
     def publish(self, key, value):
         try:
             self.cluster_nodes(key)
@@ -460,11 +555,13 @@ class RedisClient:
 
     def close(self):
         self.connection.close()
+        self.block_connection.close()
 
     async def aclose(self):
         """Asynchronous close method for the Redis connection."""
         if hasattr(self, 'async_connection') and self.async_connection:
             await self.async_connection.close()
+            await self.async_block_connection.close()
         else:
             logger.warning("No async connection to close.")
 
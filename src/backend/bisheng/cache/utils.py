@@ -301,10 +301,51 @@ def save_download_file(file_byte, folder_name, filename):
     return str(file_path)
 
 
+@create_cache_folder
+def save_download_stream(response: requests.Response, folder_name, filename, chunk_size: int = 1024 * 1024):
+    """
+    流式保存下载的文件，边下载边计算hash，不把整个文件读入内存
+
+    Args:
+        response: stream=True 发起的下载请求
+        folder_name: The name of the folder to save the file in.
+        filename: 文件名
+
+    Returns:
+        The path to the saved file.
+    """
+    cache_path = Path(CACHE_DIR)
+    folder_path = cache_path / folder_name
+
+    # Create the folder if it doesn't exist
+    if not folder_path.exists():
+        folder_path.mkdir(exist_ok=True)
+
+    sha256_hash = hashlib.sha256()
+    tmp_file = tempfile.NamedTemporaryFile(dir=folder_path, delete=False)
+    try:
+        with tmp_file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                sha256_hash.update(chunk)
+                tmp_file.write(chunk)
+
+        md5_name = sha256_hash.hexdigest()
+        file_path = folder_path / f'{md5_name}_{filename}'
+        if len(filename) > 60:
+            file_path = folder_path / f'{md5_name}_{filename[-60:]}'
+        os.replace(tmp_file.name, file_path)
+    except BaseException:
+        # 下载中断时删除未完成的临时文件
+        if os.path.exists(tmp_file.name):
+            os.remove(tmp_file.name)
+        raise
+    return str(file_path)
+
+
 def file_download(file_path: str):
     """download file and return path"""
     if not os.path.isfile(file_path) and _is_valid_url(file_path):
-        r = requests.get(file_path, verify=False)
+        r = requests.get(file_path, verify=False, stream=True)
 
         if r.status_code != 200:
             raise ValueError('Check the url of your file; returned status code %s' % r.status_code)
@@ -315,7 +356,8 @@ def file_download(file_path: str):
             filename = unquote(content_disposition).split('filename=')[-1].strip("\"'")
         if not filename:
             filename = unquote(urlparse(file_path).path.split('/')[-1])
-        file_path = save_download_file(r.content, 'bisheng', filename)
+        with r:
+            file_path = save_download_stream(r, 'bisheng', filename)
         return file_path, filename
     elif not os.path.isfile(file_path):
         raise ValueError('File path %s is not a valid file or url' % file_path)
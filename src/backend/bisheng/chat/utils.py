@@ -12,6 +12,7 @@ from langchain.schema.document import Document
 
 from bisheng.api.services.llm import LLMService
 from bisheng.api.v1.schemas import ChatMessage
+from bisheng.cache.redis import redis_client
 from bisheng.database.base import session_getter
 from bisheng.database.models.recall_chunk import RecallChunk
 from bisheng.interface.utils import try_setting_streaming_options
@@ -152,31 +153,50 @@ async def judge_source(result, source_document, chat_id, extra: Dict):
     return sync_judge_source(result, source_document, chat_id, extra)
 
 
+def get_source_trace_pending_key(message_id) -> str:
+    return f'source_trace_pending:{message_id}'
+
+
+def is_source_trace_pending(message_id) -> bool:
+    """ 消息的溯源信息是否还在异步任务中处理 """
+    return bool(redis_client.exists(get_source_trace_pending_key(message_id)))
+
+
 def sync_process_source_document(source_document: List[Document], chat_id, message_id, answer):
+    """ 溯源需要请求模型提取答案的关键词，放到异步任务中处理，不阻塞答案的返回 """
     if not source_document or not message_id:
         return
 
+    # 只有支持溯源的chunk需要处理
+    documents = [{'page_content': doc.page_content, 'metadata': doc.metadata}
+                 for doc in source_document if 'bbox' in doc.metadata]
+    if not documents:
+        return
+
+    from bisheng.worker.chat.source_trace import process_source_document_celery
+    redis_client.set(get_source_trace_pending_key(message_id), 1, expiration=600)
+    process_source_document_celery.delay(documents, chat_id, message_id, answer)
+
+
+def save_source_document(documents: List[Dict], chat_id, message_id, answer):
+    """ 提取答案的关键词，并保存溯源的chunk """
     # 使用大模型进行关键词抽取，模型配置临时方案
     llm = LLMService.get_knowledge_source_llm()
 
-    answer_keywords = extract_answer_keys(answer, llm)
-
-    batch_insert = []
-    for doc in source_document:
-        if 'bbox' in doc.metadata:
-            # 表示支持溯源
-            content = doc.page_content
-            recall_chunk = RecallChunk(chat_id=chat_id,
-                                       keywords=json.dumps(answer_keywords),
-                                       chunk=content,
-                                       file_id=doc.metadata.get('file_id'),
-                                       meta_data=json.dumps(doc.metadata),
-                                       message_id=message_id)
-            batch_insert.append(recall_chunk)
-    if batch_insert:
-        with session_getter() as db_session:
-            db_session.add_all(batch_insert)
-            db_session.commit()
+    answer_keywords = json.dumps(extract_answer_keys(answer, llm))
+
+    batch_insert = [
+        RecallChunk(chat_id=chat_id,
+                    keywords=answer_keywords,
+                    chunk=doc['page_content'],
+                    file_id=doc['metadata'].get('file_id'),
+                    meta_data=json.dumps(doc['metadata']),
+                    message_id=message_id)
+        for doc in documents
+    ]
+    with session_getter() as db_session:
+        db_session.add_all(batch_insert)
+        db_session.commit()
 
 
 async def process_source_document(source_document: List[Document], chat_id, message_id, answer):
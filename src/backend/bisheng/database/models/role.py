@@ -4,6 +4,7 @@ from typing import List, Optional
 from sqlalchemy import Column, DateTime, text, func, delete, and_, UniqueConstraint
 from sqlmodel import Field, select
 
+from bisheng.cache.permission import invalidate_user_permission
 from bisheng.database.base import session_getter
 from bisheng.database.constants import AdminRole
 from bisheng.database.models.base import SQLModelSerializable
@@ -90,6 +91,7 @@ class RoleDao(RoleBase):
             session.exec(delete(UserRole).where(UserRole.role_id == role_id))
             session.exec(delete(RoleAccess).where(RoleAccess.role_id == role_id))
             session.commit()
+            invalidate_user_permission()
 
     @classmethod
     def get_role_by_ids(cls, role_ids: List[int]) -> List[Role]:
@@ -116,3 +118,4 @@ class RoleDao(RoleBase):
             session.exec(delete(UserRole).where(UserRole.id.in_([one.UserRole.id for one in all_user])))
             session.exec(delete(Role).where(Role.group_id == group_id))
             session.commit()
+            invalidate_user_permission()
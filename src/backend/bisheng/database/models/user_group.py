@@ -4,6 +4,7 @@ from typing import List, Optional
 from sqlalchemy import Column, DateTime, delete, text
 from sqlmodel import Field, select
 
+from bisheng.cache.permission import invalidate_user_permission
 from bisheng.database.base import session_getter
 from bisheng.database.models.base import SQLModelSerializable
 from bisheng.database.models.group import DefaultGroup
@@ -65,6 +66,7 @@ class UserGroupDao(UserGroupBase):
             user_group = UserGroup.validate(user_group)
             session.add(user_group)
             session.commit()
+            invalidate_user_permission()
             session.refresh(user_group)
             return user_group
 
@@ -77,6 +79,7 @@ class UserGroupDao(UserGroupBase):
             user_group = UserGroup(user_id=user_id, group_id=group_id, is_group_admin=True)
             session.add(user_group)
             session.commit()
+            invalidate_user_permission()
             session.refresh(user_group)
             return user_group
 
@@ -88,6 +91,7 @@ class UserGroupDao(UserGroupBase):
             user_group = session.exec(statement).first()
             session.delete(user_group)
             session.commit()
+            invalidate_user_permission()
 
     @classmethod
     def delete_user_groups(cls, user_id: int, group_ids: List[int]):
@@ -164,6 +168,7 @@ class UserGroupDao(UserGroupBase):
         with session_getter() as session:
             session.add_all(user_groups)
             session.commit()
+            invalidate_user_permission()
             return user_groups
 
     @classmethod
@@ -188,6 +193,7 @@ class UserGroupDao(UserGroupBase):
                 UserGroup.is_group_admin == 1)
             session.exec(statement)
             session.commit()
+            invalidate_user_permission()
 
     @classmethod
     def delete_group_all_admin(cls, group_id: int) -> None:
@@ -200,3 +206,4 @@ class UserGroupDao(UserGroupBase):
                 UserGroup.is_group_admin == 1)
             session.exec(statement)
             session.commit()
+            invalidate_user_permission()
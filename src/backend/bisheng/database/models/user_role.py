@@ -5,6 +5,7 @@ from pydantic import BaseModel
 from sqlalchemy import Column, DateTime, text, delete
 from sqlmodel import Field, select
 
+from bisheng.cache.permission import ainvalidate_user_permission, invalidate_user_permission
 from bisheng.database.base import session_getter, async_session_getter
 from bisheng.database.constants import AdminRole
 from bisheng.database.models.base import SQLModelSerializable
@@ -75,6 +76,7 @@ class UserRoleDao(UserRoleBase):
             user_role = UserRole(user_id=user_id, role_id=AdminRole)
             session.add(user_role)
             await session.commit()
+            await ainvalidate_user_permission()
             await session.refresh(user_role)
             return user_role
 
@@ -87,6 +89,7 @@ class UserRoleDao(UserRoleBase):
             user_roles = [UserRole(user_id=user_id, role_id=role_id) for role_id in role_ids]
             session.add_all(user_roles)
             session.commit()
+            invalidate_user_permission()
             return user_roles
 
     @classmethod
@@ -98,3 +101,4 @@ class UserRoleDao(UserRoleBase):
             statement = delete(UserRole).where(UserRole.user_id == user_id).where(UserRole.role_id.in_(role_ids))
             session.exec(statement)
             session.commit()
+            invalidate_user_permission()
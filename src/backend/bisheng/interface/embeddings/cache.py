@@ -0,0 +1,109 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from cachetools import LRUCache
+from loguru import logger
+
+from bisheng.cache.redis import redis_client
+from bisheng.settings import settings
+
+
+class EmbeddingCache:
+    """
+    以 (模型配置, sha256(文本)) 为key的embedding缓存
+    一级缓存为进程内的LRU，二级缓存为可选的redis，向量统一存储为float32的bytes
+    模型配置变化后命名空间随之变化，旧的缓存不会再被命中
+    """
+
+    def __init__(self):
+        self.conf = settings.embedding_cache
+        self._lock = threading.Lock()
+        self._local_cache: LRUCache = LRUCache(maxsize=self.conf.max_size)
+        self.hits = 0
+        self.misses = 0
+        self._stats_logged_at = time.monotonic()
+
+    @staticmethod
+    def get_namespace(model_id: int, config: Dict) -> str:
+        """ 根据模型的配置生成缓存的命名空间 """
+        config_hash = hashlib.sha256(json.dumps(config, sort_keys=True, ensure_ascii=False, default=str).encode(
+            'utf-8')).hexdigest()[:16]
+        return f'{model_id}:{config_hash}'
+
+    @staticmethod
+    def get_key(namespace: str, text: str) -> str:
+        return f'embedding:{namespace}:{hashlib.sha256(text.encode("utf-8")).hexdigest()}'
+
+    @staticmethod
+    def encode_vector(vector: List[float]) -> bytes:
+        return np.asarray(vector, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def decode_vector(value: bytes) -> List[float]:
+        return np.frombuffer(value, dtype=np.float32).tolist()
+
+    def get_many(self, namespace: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """ 批量获取缓存的向量，未命中的位置为None """
+        if not self.conf.enabled or not texts:
+            return [None] * len(texts)
+        keys = [self.get_key(namespace, text) for text in texts]
+        values = []
+        with self._lock:
+            for key in keys:
+                values.append(self._local_cache.get(key))
+
+        miss_index = [index for index, value in enumerate(values) if value is None]
+        if miss_index and self.conf.redis:
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                for index in miss_index:
+                    pipe.get(keys[index])
+                redis_values = pipe.execute()
+                with self._lock:
+                    for index, value in zip(miss_index, redis_values):
+                        if value is not None:
+                            values[index] = value
+                            self._local_cache[keys[index]] = value
+            except Exception as e:
+                logger.warning(f'get embedding cache from redis error: {e}')
+
+        hit_num = sum(1 for value in values if value is not None)
+        with self._lock:
+            self.hits += hit_num
+            self.misses += len(values) - hit_num
+            log_stats = self.conf.stats_log_interval and \
+                time.monotonic() - self._stats_logged_at >= self.conf.stats_log_interval
+            if log_stats:
+                self._stats_logged_at = time.monotonic()
+        if log_stats:
+            logger.info(f'embedding cache stats: {self.get_stats()}')
+        return [self.decode_vector(value) if value is not None else None for value in values]
+
+    def set_many(self, namespace: str, texts: List[str], vectors: List[List[float]]):
+        if not self.conf.enabled or not texts:
+            return
+        mapping = {self.get_key(namespace, text): self.encode_vector(vector) for text, vector in zip(texts, vectors)}
+        with self._lock:
+            self._local_cache.update(mapping)
+        if self.conf.redis:
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                for key, value in mapping.items():
+                    pipe.setex(key, self.conf.redis_expire, value)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f'set embedding cache into redis error: {e}')
+
+    def get_stats(self) -> Dict[str, float]:
+        """ 当前进程内缓存的命中统计 """
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / total, 4) if total else 0,
+                    'size': len(self._local_cache)}
+
+
+embedding_cache = EmbeddingCache()
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Dict
 
 import numpy as np
@@ -6,13 +7,25 @@ from langchain_community.embeddings.dashscope import BATCH_SIZE
 from loguru import logger
 from pydantic import ConfigDict, Field, BaseModel
 
-from bisheng.database.models.llm_server import (LLMDao, LLMModel, LLMModelType, LLMServer,
+from bisheng.database.models.llm_server import (LLMModel, LLMModelType, LLMServer,
                                                 LLMServerType)
+from bisheng.interface.embeddings.cache import EmbeddingCache, embedding_cache
 from bisheng.interface.importing import import_by_type
+from bisheng.interface.model_registry import model_registry
 from bisheng.interface.utils import wrapper_bisheng_model_limit_check
 
 BATCH_SIZE["text-embedding-v4"] = 10  # 设置DashScope的批处理大小为1
 
+# 兼容openai接口的embedding服务，运行中探测到的最大批处理数量 {模型配置的缓存命名空间: batch_size}，模型配置修改后重新探测
+_embedding_batch_limit: Dict[str, int] = {}
+
+# 不支持批处理的服务端常见的报错状态码，批次大于1时拆分重试（鉴权失败、限流等报错不拆分）
+_BATCH_TOO_LARGE_STATUS = (413, 422, 500)
+# 服务端返回400时，错误信息中包含这些关键词才认为是批处理过大
+_BATCH_TOO_LARGE_KEYWORDS = ('batch', 'too large', 'too many', 'too long', 'context length', 'token')
+# 批处理过大时最多拆分的次数，一个批次最多拆成 2^n 个请求
+_MAX_BATCH_SPLIT_DEPTH = 4
+
 
 class OpenAIProxyEmbedding(Embeddings):
     embeddings: Optional[Embeddings] = Field(default=None)
@@ -58,8 +71,13 @@ class BishengEmbedding(BaseModel, Embeddings):
     max_retries: int = Field(default=6, description='embedding模型调用失败重试次数')
     request_timeout: int = Field(default=200, description='embedding模型调用超时时间')
     model_kwargs: dict = Field(default={}, description='embedding模型调用参数')
+    batch_size: int = Field(default=16, description='兼容openai接口的模型，单次请求的最大文本数，未配置时使用模型配置的chunk_size，'
+                                                    '服务端报错时会自动减小')
+    batch_max_tokens: int = Field(default=0, description='单次请求的最大token数（按字符数估算），0表示不限制')
+    max_concurrency: int = Field(default=4, description='同时发送的embedding请求数')
 
     embeddings: Optional[Embeddings] = Field(default=None)
+    cache_namespace: str = Field(default='', description='embedding缓存的命名空间，由模型配置生成')
     llm_node_type: Dict = {
         # 开源推理框架
         LLMServerType.OLLAMA.value: 'OllamaEmbeddings',
@@ -94,10 +112,9 @@ class BishengEmbedding(BaseModel, Embeddings):
 
         if not self.model_id:
             raise Exception('没有找到embedding模型配置')
-        model_info = LLMDao.get_model_by_id(self.model_id)
+        model_info, server_info = model_registry.get_model(self.model_id)
         if not model_info:
             raise Exception('embedding模型配置已被删除，请重新配置模型')
-        server_info = LLMDao.get_server_by_id(model_info.server_id)
         if not server_info:
             raise Exception('服务提供方配置已被删除，请重新配置embedding模型')
         if model_info.model_type != LLMModelType.EMBEDDING.value:
@@ -109,11 +126,18 @@ class BishengEmbedding(BaseModel, Embeddings):
         self.model_info: LLMModel = model_info
         self.server_info: LLMServer = server_info
         self.model = model_info.model_name
+        self.cache_namespace = EmbeddingCache.get_namespace(self.model_id, {
+            'server_type': server_info.type,
+            'server_config': server_info.config,
+            'model_name': model_info.model_name,
+            'model_config': model_info.config,
+        })
 
         class_object = self._get_embedding_class(server_info.type)
         params = self._get_embedding_params(server_info, model_info)
         try:
-            self.embeddings = instantiate_embedding(class_object, params)
+            self.embeddings = model_registry.get_client(class_object.__name__, params,
+                                                        lambda: instantiate_embedding(class_object, params))
         except Exception as e:
             logger.exception('init_bisheng_embedding error')
             raise Exception(f'初始化bisheng embedding组件失败，请检查配置或联系管理员。错误信息：{e}')
@@ -135,9 +159,22 @@ class BishengEmbedding(BaseModel, Embeddings):
             'model': model_info.model_name,
         })
 
-        # 非openai官方但是符合openai接口标准的embedding模型，强制chunk_size=1，防止batch_size太大导致服务报错
+        # 批处理相关的配置由bisheng自己处理，不传给embedding组件
+        batch_size = params.pop('batch_size', None)
+        self.batch_max_tokens = int(params.pop('batch_max_tokens', None) or self.batch_max_tokens)
+        self.max_concurrency = max(int(params.pop('max_concurrency', None) or self.max_concurrency), 1)
+
+        # 符合openai接口标准的embedding模型，由bisheng控制每次请求的文本数，组件内部不再拆分
         if self.llm_node_type.get(server_info.type) == "OpenAIEmbeddings":
-            params['chunk_size'] = params.pop('chunk_size', 1)
+            # 显式配置的chunk_size是服务端能接受的上限（例如配置为1表示服务端不支持批处理），批处理数量不能超过它
+            chunk_size = params.pop('chunk_size', None)
+            batch_size = batch_size or chunk_size or self.batch_size
+            if chunk_size:
+                batch_size = min(int(batch_size), int(chunk_size))
+            self.batch_size = max(int(batch_size), 1)
+            params['chunk_size'] = self.batch_size
+        else:
+            self.batch_size = max(int(batch_size or self.batch_size), 1)
 
         if server_info.type == LLMServerType.QWEN.value:
             params = {
@@ -162,10 +199,25 @@ class BishengEmbedding(BaseModel, Embeddings):
     @wrapper_bisheng_model_limit_check
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """embedding"""
+        vectors = embedding_cache.get_many(self.cache_namespace, texts)
+        # 去重后只请求缓存未命中的文本
+        miss_texts = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if miss_texts:
+            miss_vectors = self._embed_documents(miss_texts)
+            embedding_cache.set_many(self.cache_namespace, miss_texts, miss_vectors)
+            miss_map = dict(zip(miss_texts, miss_vectors))
+            vectors = [vector if vector is not None else miss_map[text] for text, vector in zip(texts, vectors)]
+        logger.debug(f'embed_documents model_id: {self.model_id}, texts: {len(texts)}, request: {len(miss_texts)}')
+        return vectors
+
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
         try:
             if self.server_info.limit_flag:
                 pass
-            ret = self.embeddings.embed_documents(texts)
+            if self.llm_node_type.get(self.server_info.type) == "OpenAIEmbeddings":
+                ret = self._batch_embed_documents(texts)
+            else:
+                ret = self.embeddings.embed_documents(texts)
             # 盘单向量是否归一化了
             if ret:
                 vector = ret[0]
@@ -178,9 +230,79 @@ class BishengEmbedding(BaseModel, Embeddings):
             logger.exception('embedding error')
             raise Exception(f'embedding error: {e}')
 
+    def _get_batch_limit(self) -> int:
+        return min(_embedding_batch_limit.get(self.cache_namespace, self.batch_size), self.batch_size)
+
+    def _split_batches(self, texts: List[str]) -> List[List[str]]:
+        """ 按照批处理数量和token预算切分文本 """
+        batch_limit = self._get_batch_limit()
+        batches = []
+        current_batch = []
+        current_tokens = 0
+        for text in texts:
+            text_tokens = len(text)
+            if current_batch and (len(current_batch) >= batch_limit or (
+                    self.batch_max_tokens and current_tokens + text_tokens > self.batch_max_tokens)):
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+            current_batch.append(text)
+            current_tokens += text_tokens
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+
+    @staticmethod
+    def _is_batch_too_large(e: Exception) -> bool:
+        """ 不支持批处理的常见状态码，或者400并且错误信息明确提示批处理、token超限时才认为是批处理过大 """
+        status_code = getattr(e, 'status_code', None)
+        if status_code is None and getattr(e, 'response', None) is not None:
+            status_code = getattr(e.response, 'status_code', None)
+        if status_code in _BATCH_TOO_LARGE_STATUS:
+            return True
+        if status_code != 400:
+            return False
+        error_msg = str(e).lower()
+        return any(one in error_msg for one in _BATCH_TOO_LARGE_KEYWORDS)
+
+    def _embed_batch(self, texts: List[str], depth: int = 0) -> List[List[float]]:
+        """ 发送一个批次的请求，服务端提示批处理过大时拆成两半重试，并记录该模型的批处理上限 """
+        try:
+            return self.embeddings.embed_documents(texts)
+        except Exception as e:
+            if len(texts) <= 1 or depth >= _MAX_BATCH_SPLIT_DEPTH or not self._is_batch_too_large(e):
+                raise e
+            half = len(texts) // 2
+            ret = self._embed_batch(texts[:half], depth + 1) + self._embed_batch(texts[half:], depth + 1)
+            # 拆分后请求成功，说明是批处理过大导致的报错，记录该模型的批处理上限
+            if _embedding_batch_limit.get(self.cache_namespace, self.batch_size) > half:
+                _embedding_batch_limit[self.cache_namespace] = half
+                logger.warning(f'embedding batch too large, model_id: {self.model_id}, reduce batch size to {half}')
+            return ret
+
+    def _batch_embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = self._split_batches(texts)
+        if len(batches) == 1 or self.max_concurrency == 1:
+            ret = []
+            for batch in batches:
+                ret.extend(self._embed_batch(batch))
+            return ret
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+            results = executor.map(self._embed_batch, batches)
+            return [vector for batch_result in results for vector in batch_result]
+
     @wrapper_bisheng_model_limit_check
     def embed_query(self, text: str) -> List[float]:
         """embedding"""
+        # 部分模型的query和document的向量化方式不同，使用单独的命名空间
+        query_namespace = f'{self.cache_namespace}:query'
+        vector = embedding_cache.get_many(query_namespace, [text])[0]
+        if vector is None:
+            vector = self._embed_query(text)
+            embedding_cache.set_many(query_namespace, [text], [vector])
+        return vector
+
+    def _embed_query(self, text: str) -> List[float]:
         try:
             ret = self.embeddings.embed_query(text)
             if np.linalg.norm(ret) != 1:
@@ -194,10 +316,9 @@ class BishengEmbedding(BaseModel, Embeddings):
 
     def _update_model_status(self, status: int, remark: str = ''):
         """更新模型状态"""
-        # todo 接入到异步任务模块 累计5分钟更新一次
         if self.model_info.status != status:
             self.model_info.status = status
-            LLMDao.update_model_status(self.model_id, status, remark)
+            model_registry.report_status(self.model_id, status, remark)
 
 
 CUSTOM_EMBEDDING = {
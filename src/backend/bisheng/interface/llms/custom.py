@@ -13,11 +13,13 @@ from pydantic import Field
 
 from bisheng.api.errcode.server import NoLlmModelConfigError, LlmModelConfigDeletedError, LlmProviderDeletedError, \
     LlmModelTypeError, LlmModelOfflineError, InitLlmError
-from bisheng.database.models.llm_server import LLMDao, LLMModelType, LLMServerType, LLMModel, LLMServer
+from bisheng.database.models.llm_server import LLMModelType, LLMServerType, LLMModel, LLMServer
 from bisheng.interface.importing import import_by_type
 from bisheng.interface.initialize.loading import instantiate_llm
+from bisheng.interface.model_registry import model_registry
 from bisheng.interface.utils import wrapper_bisheng_model_limit_check, wrapper_bisheng_model_limit_check_async, \
     wrapper_bisheng_model_generator, wrapper_bisheng_model_generator_async
+from bisheng.settings import settings
 
 
 def _get_ollama_params(params: dict, server_config: dict, model_config: dict) -> dict:
@@ -172,11 +174,10 @@ class BishengLLM(BaseChatModel):
 
         if not self.model_id:
             raise NoLlmModelConfigError()
-        model_info = LLMDao.get_model_by_id(self.model_id)
+        model_info, server_info = model_registry.get_model(self.model_id)
         if not model_info:
             raise LlmModelConfigDeletedError()
         self.model_name = model_info.model_name
-        server_info = LLMDao.get_server_by_id(model_info.server_id)
         if not server_info:
             raise LlmProviderDeletedError()
         if model_info.model_type != LLMModelType.LLM.value:
@@ -192,7 +193,10 @@ class BishengLLM(BaseChatModel):
         class_object, class_name = self._get_llm_class(server_info.type)
         params = self._get_llm_params(server_info, model_info)
         try:
-            self.llm = instantiate_llm(class_name, class_object, params)
+            # 请求超时等全局配置也会影响实例化的结果，放到缓存的key里
+            self.llm = model_registry.get_client(
+                class_name, {'params': params, 'llm_request': settings.get_from_db('llm_request')},
+                lambda: instantiate_llm(class_name, class_object, params))
         except Exception as e:
             logger.exception('init bisheng llm error')
             raise InitLlmError(exception=e)
@@ -407,7 +411,7 @@ class BishengLLM(BaseChatModel):
         """更新模型状态"""
         if self.model_info.status != status:
             self.model_info.status = status
-            LLMDao.update_model_status(self.model_id, status, remark[-500:])  # 限制备注长度为500字符
+            model_registry.report_status(self.model_id, status, remark)
 
     def bind_tools(
             self,
@@ -0,0 +1,166 @@
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from cachetools import LRUCache, TTLCache
+from loguru import logger
+
+from bisheng.cache.redis import redis_client
+from bisheng.database.models.llm_server import LLMDao, LLMModel, LLMServer
+
+# 模型配置变化时自增的版本号，并通过频道通知所有进程清空本地缓存
+MODEL_REGISTRY_VERSION_KEY = 'llm:model:registry:version'
+MODEL_REGISTRY_CHANNEL = 'llm:model:registry:invalidate'
+
+
+class ModelRegistry:
+    """
+    进程内的模型注册表，缓存模型和服务提供方的配置以及实例化好的模型组件，构造BishengLLM、BishengEmbedding时不再查询数据库
+    模型配置变化后通过redis的版本号和发布订阅失效所有进程的缓存；订阅断开期间不使用配置缓存，直接查询数据库
+    模型状态的变化在后台线程内合并后批量写入数据库
+    """
+
+    def __init__(self, ttl: int = 600, max_clients: int = 256, flush_interval: int = 5):
+        self.flush_interval = flush_interval
+        # model_id: (LLMModel, LLMServer)
+        self._models: TTLCache = TTLCache(maxsize=1024, ttl=ttl)
+        # (组件类名, 初始化参数): 模型组件实例
+        self._clients: LRUCache = LRUCache(maxsize=max_clients)
+        # 待写入数据库的模型状态 model_id: (status, remark)
+        self._pending_status: Dict[int, Tuple[int, str]] = {}
+        self._lock = threading.Lock()
+        # 本地缓存的代数，失效时自增，避免把失效前查询到的数据写入缓存
+        self._generation = 0
+        self._remote_version: Optional[int] = None
+        self._subscribed = False
+        self._pid: Optional[int] = None
+        atexit.register(self.flush_status)
+
+    def _ensure_started(self):
+        """ 首次使用时启动订阅和状态写入线程，fork出来的子进程需要重新启动 """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._models.clear()
+            self._clients.clear()
+            self._pending_status.clear()
+            self._subscribed = False
+            self._remote_version = None
+            threading.Thread(target=self._subscribe, name='model-registry-subscriber', daemon=True).start()
+            threading.Thread(target=self._flush_loop, name='model-registry-status', daemon=True).start()
+
+    def _clear_local(self):
+        with self._lock:
+            self._generation += 1
+            self._models.clear()
+            self._clients.clear()
+
+    def _subscribe(self):
+        pid = os.getpid()
+        while pid == self._pid:
+            pubsub = None
+            try:
+                pubsub = redis_client.connection.pubsub()
+                pubsub.subscribe(MODEL_REGISTRY_CHANNEL)
+                # 订阅之前错过的失效通知通过版本号发现
+                version = int(redis_client.connection.get(MODEL_REGISTRY_VERSION_KEY) or 0)
+                if version != self._remote_version:
+                    self._remote_version = version
+                    self._clear_local()
+                self._subscribed = True
+                while pid == self._pid:
+                    message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message.get('type') == 'message':
+                        self._remote_version = int(message['data'] or 0)
+                        self._clear_local()
+            except Exception as e:
+                logger.warning(f'model registry subscribe error: {e}')
+            finally:
+                self._subscribed = False
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(5)
+
+    def get_model(self, model_id: int) -> Tuple[Optional[LLMModel], Optional[LLMServer]]:
+        """ 获取模型和所属服务提供方的配置，模型或者服务提供方不存在时对应的值为None """
+        self._ensure_started()
+        with self._lock:
+            cached = self._models.get(model_id) if self._subscribed else None
+            generation = self._generation
+        if cached is not None:
+            return cached
+
+        model_info = LLMDao.get_model_by_id(model_id)
+        if not model_info:
+            return None, None
+        server_info = LLMDao.get_server_by_id(model_info.server_id)
+        if not server_info:
+            return model_info, None
+        with self._lock:
+            if generation == self._generation:
+                pending = self._pending_status.get(model_id)
+                if pending is not None:
+                    model_info.status = pending[0]
+                self._models[model_id] = (model_info, server_info)
+        return model_info, server_info
+
+    def get_client(self, class_name: str, params: Dict, factory: Callable[[], Any]) -> Any:
+        """ 相同的组件类和初始化参数复用同一个模型组件实例，参数里包含了模型配置，配置变化后自然不会命中 """
+        self._ensure_started()
+        key = (class_name, json.dumps(params, sort_keys=True, ensure_ascii=False, default=str))
+        with self._lock:
+            client = self._clients.get(key)
+            generation = self._generation
+        if client is not None:
+            return client
+        client = factory()
+        with self._lock:
+            if generation == self._generation:
+                client = self._clients.setdefault(key, client)
+        return client
+
+    def invalidate(self):
+        """ 模型或者服务提供方的配置变化后调用，清空所有进程的缓存 """
+        self._clear_local()
+        try:
+            version = redis_client.incr(MODEL_REGISTRY_VERSION_KEY, expiration=0)
+            redis_client.publish(MODEL_REGISTRY_CHANNEL, version)
+        except Exception as e:
+            logger.error(f'invalidate model registry error: {e}')
+
+    def report_status(self, model_id: int, status: int, remark: str = ''):
+        """ 记录模型状态，由后台线程合并后写入数据库 """
+        self._ensure_started()
+        with self._lock:
+            self._pending_status[model_id] = (status, remark[-500:])  # 限制备注长度为500字符
+            cached = self._models.get(model_id)
+            if cached is not None:
+                cached[0].status = status
+
+    def flush_status(self):
+        """ 立即把待写入的模型状态写入数据库 """
+        with self._lock:
+            pending, self._pending_status = self._pending_status, {}
+        for model_id, (status, remark) in pending.items():
+            try:
+                LLMDao.update_model_status(model_id, status, remark)
+            except Exception as e:
+                logger.warning(f'update model status error: model_id={model_id} {e}')
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while pid == self._pid:
+            time.sleep(self.flush_interval)
+            self.flush_status()
+
+
+model_registry = ModelRegistry()
@@ -1,5 +1,9 @@
+import asyncio
+import heapq
+import time
 from abc import ABC
 from ast import literal_eval
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import jieba
@@ -41,6 +45,7 @@ class MilvusWithPermissionCheck(MilvusLangchain):
                  text_field: str = 'text',
                  vector_field: str = 'vector',
                  partition_field: str = 'knowledge_id',
+                 search_concurrency: int = 8,
                  **kwargs: Any):
         """Initialize the Milvus vector store."""
         try:
@@ -140,6 +145,8 @@ class MilvusWithPermissionCheck(MilvusLangchain):
         self.col: Optional[List[Collection]] = []
         self.col_partition_key: Optional[List[str]] = []
         self.collection_embeddings = collection_embeddings
+        # 多个collection同时检索的最大并发数
+        self.search_concurrency = search_concurrency
         # not used
         self.drop_old = drop_old
 
@@ -413,11 +420,20 @@ class MilvusWithPermissionCheck(MilvusLangchain):
 
         finally_k = kwargs.pop('k', k)
 
-        ret = []
-
-        for index, one_col in enumerate(self.col):
+        # 使用相同embedding模型的collection只需要计算一次query的向量
+        query_embeddings = {}
+        col_embeddings = []
+        for index in range(len(self.col)):
+            embedding_func = self.collection_embeddings[index]
+            embedding_key = getattr(embedding_func, 'model_id', None) or id(embedding_func)
+            if embedding_key not in query_embeddings:
+                query_embeddings[embedding_key] = embedding_func.embed_query(query)
+            col_embeddings.append(query_embeddings[embedding_key])
+
+        def search_one_col(index: int) -> List[Tuple[Document, float]]:
+            start_time = time.time()
+            one_col = self.col[index]
             search_expr = expr
-            embedding = self.collection_embeddings[index].embed_query(query)
             if self.col_partition_key[index]:
                 # add parttion
                 if expr:
@@ -426,7 +442,7 @@ class MilvusWithPermissionCheck(MilvusLangchain):
                     search_expr = f"{self._partition_field}==\"{self.col_partition_key[index]}\""
             # Perform the search.
             res = one_col.search(
-                data=[embedding],
+                data=[col_embeddings[index]],
                 anns_field=self._vector_field,
                 param=param,
                 limit=k,
@@ -436,16 +452,26 @@ class MilvusWithPermissionCheck(MilvusLangchain):
                 **kwargs,
             )
             # Organize results.
+            col_ret = []
             for result in res[0]:
                 meta = {x: result.entity.get(x) for x in output_fields}
                 doc = Document(page_content=meta.pop(self._text_field), metadata=meta)
-                pair = (doc, result.score)
-                ret.append(pair)
-            logger.debug(f'MilvusWithPermissionCheck Search {one_col.name} query: {query} results: {res[0]}')
-        ret.sort(key=lambda x: x[1])
+                col_ret.append((doc, result.score))
+            logger.debug(f'MilvusWithPermissionCheck Search {one_col.name} query: {query} results: {res[0]}'
+                         f' cost: {time.time() - start_time:.3f}s')
+            return col_ret
+
+        ret = []
+        if len(self.col) == 1 or self.search_concurrency <= 1:
+            for index in range(len(self.col)):
+                ret.extend(search_one_col(index))
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.search_concurrency, len(self.col))) as executor:
+                for col_ret in executor.map(search_one_col, range(len(self.col))):
+                    ret.extend(col_ret)
         logger.debug(f'MilvusWithPermissionCheck Search all results: {len(ret)}')
         # milvus是分数越小越好，所以直接取前几位就行
-        ret = ret[:finally_k]
+        ret = heapq.nsmallest(finally_k, ret, key=lambda x: x[1])
         logger.debug(f'MilvusWithPermissionCheck Search finally results: {len(ret)}')
         return ret
 
@@ -484,6 +510,10 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
         _ssl_verify = ssl_verify or {}
         self.elasticsearch_url = elasticsearch_url
         self.ssl_verify = _ssl_verify
+        # es服务的大版本号，第一次请求时获取
+        self._version_num = None
+        # 缺少异步依赖时使用同步客户端在线程中检索
+        self._async_client_available = True
         try:
             self.client = elasticsearch.Elasticsearch(elasticsearch_url, **_ssl_verify)
         except ValueError as e:
@@ -515,50 +545,111 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
     def _select_relevance_score_fn(self) -> Callable[[float], float]:
         return self._relevance_score_fn
 
-    def similarity_search_with_score(self,
-                                     query: str,
-                                     k: int = 4,
-                                     query_strategy: str = 'match_phrase',
-                                     must_or_should: str = 'should',
-                                     **kwargs: Any) -> List[Tuple[Document, float]]:
-        if k == 0:
-            # pm need to control
-            return []
-        assert must_or_should in ['must', 'should'], 'only support must and should.'
-        # llm or jiaba extract keywords
-        if self.llm_chain:
-            keywords_str = self.llm_chain.run(query)
+    @staticmethod
+    def _build_match_query(keywords: List[str], query: str, query_strategy: str, must_or_should: str) -> Dict:
+        keywords = keywords or [query]
+        logger.debug(f'finally search keywords: {keywords}')
+        match_query = {'bool': {must_or_should: []}}
+        for key in keywords:
+            match_query['bool'][must_or_should].append({query_strategy: {'text': key}})
+        return match_query
+
+    @staticmethod
+    def _parse_keywords(query: str, keywords_str: Optional[str]) -> List[str]:
+        """ 解析llm提取的关键词，失败则使用jieba提取 """
+        if keywords_str is not None:
             logger.debug('elasticsearch llm search keywords:', keywords_str)
             try:
                 keywords = literal_eval(keywords_str)
                 if not isinstance(keywords, list):
                     raise ValueError('Keywords extracted by llm is not list.')
+                return keywords
             except Exception:
-                keywords = jieba.analyse.extract_tags(query, topK=10, withWeight=False)
-        else:
-            keywords = jieba.analyse.extract_tags(query, topK=10, withWeight=False)
-        keywords = keywords or [query]
-        logger.debug(f'finally search keywords: {keywords}')
-        match_query = {'bool': {must_or_should: []}}
-        for key in keywords:
-            match_query['bool'][must_or_should].append({query_strategy: {'text': key}})
+                pass
+        return jieba.analyse.extract_tags(query, topK=10, withWeight=False)
 
-        ret = []
+    def _build_msearch_body(self, match_query: Dict, size: int) -> List[Dict]:
+        """ 所有索引的检索请求合并为一次 _msearch 请求，每个索引各自返回前size个结果 """
+        body = []
         for one_index_name in self.index_name:
-            response = self.client_search(self.client, one_index_name, match_query, size=k)
-            hits = [hit for hit in response['hits']['hits']]
+            body.append({'index': one_index_name})
+            body.append({'query': match_query, 'size': size})
+        return body
+
+    def _merge_msearch_response(self, response: Dict, finally_k: int) -> List[Tuple[Document, float]]:
+        ret = []
+        errors = []
+        for one_index_name, one_response in zip(self.index_name, response['responses']):
+            if 'error' in one_response:
+                logger.error(f'ElasticsearchWithPermissionCheck Search {one_index_name} error: '
+                             f'{one_response["error"]}')
+                errors.append(one_response['error'])
+                continue
+            hits = one_response['hits']['hits']
             for hit in hits:
                 ret.append((Document(page_content=hit['_source']['text'],
                                      metadata=hit['_source']['metadata']), hit['_score']))
             logger.debug(
                 f'ElasticsearchWithPermissionCheck Search {one_index_name} results: {hits}')
+        if errors and len(errors) == len(self.index_name):
+            # 所有索引都检索失败，和单独检索每个索引时一样抛出异常
+            raise Exception(f'ElasticsearchWithPermissionCheck Search all index error: {errors[0]}')
         logger.debug(f'ElasticsearchWithPermissionCheck Search all results: {len(ret)}')
-        finally_k = kwargs.pop('finally_k', k)
-        ret.sort(key=lambda x: x[1], reverse=True)
-        ret = ret[:finally_k]
+        ret = heapq.nlargest(finally_k, ret, key=lambda x: x[1])
         logger.debug(f'ElasticsearchWithPermissionCheck Search finally results: {len(ret)}')
         return ret
 
+    def similarity_search_with_score(self,
+                                     query: str,
+                                     k: int = 4,
+                                     query_strategy: str = 'match_phrase',
+                                     must_or_should: str = 'should',
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        if k == 0 or not self.index_name:
+            # pm need to control
+            return []
+        assert must_or_should in ['must', 'should'], 'only support must and should.'
+        # llm or jiaba extract keywords
+        keywords_str = self.llm_chain.run(query) if self.llm_chain else None
+        keywords = self._parse_keywords(query, keywords_str)
+        match_query = self._build_match_query(keywords, query, query_strategy, must_or_should)
+
+        response = self.client_msearch(self.client, self._build_msearch_body(match_query, k))
+        finally_k = kwargs.pop('finally_k', k)
+        return self._merge_msearch_response(response, finally_k)
+
+    async def asimilarity_search_with_score(self,
+                                            query: str,
+                                            k: int = 4,
+                                            query_strategy: str = 'match_phrase',
+                                            must_or_should: str = 'should',
+                                            **kwargs: Any) -> List[Tuple[Document, float]]:
+        if k == 0 or not self.index_name:
+            return []
+        assert must_or_should in ['must', 'should'], 'only support must and should.'
+        keywords_str = await self.llm_chain.arun(query) if self.llm_chain else None
+        keywords = self._parse_keywords(query, keywords_str)
+        match_query = self._build_match_query(keywords, query, query_strategy, must_or_should)
+
+        response = await self.aclient_msearch(self._build_msearch_body(match_query, k))
+        finally_k = kwargs.pop('finally_k', k)
+        return self._merge_msearch_response(response, finally_k)
+
+    async def asimilarity_search(self,
+                                 query: str,
+                                 k: int = 4,
+                                 query_strategy: str = 'match_phrase',
+                                 must_or_should: str = 'should',
+                                 **kwargs: Any) -> List[Document]:
+        if k == 0:
+            return []
+        docs_and_scores = await self.asimilarity_search_with_score(query,
+                                                                   k=k,
+                                                                   query_strategy=query_strategy,
+                                                                   must_or_should=must_or_should,
+                                                                   **kwargs)
+        return [d[0] for d in docs_and_scores]
+
     def add_texts(
             self,
             texts: Iterable[str],
@@ -619,15 +710,52 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
 
         return vectorsearch
 
+    def get_version_num(self, client: Any) -> int:
+        if self._version_num is None:
+            self._version_num = int(client.info()['version']['number'].split('.')[0])
+        return self._version_num
+
     def client_search(self, client: Any, index_name: str, script_query: Dict, size: int) -> Any:
-        version_num = client.info()['version']['number'][0]
-        version_num = int(version_num)
+        version_num = self.get_version_num(client)
         if version_num >= 8:
             response = client.search(index=index_name, query=script_query, size=size)
         else:
             response = client.search(index=index_name, body={'query': script_query, 'size': size})
         return response
 
+    def client_msearch(self, client: Any, body: List[Dict]) -> Any:
+        if self.get_version_num(client) >= 8:
+            return client.msearch(searches=body)
+        return client.msearch(body=body)
+
+    def _create_async_client(self) -> Any:
+        if not self._async_client_available:
+            return None
+        try:
+            from elasticsearch import AsyncElasticsearch
+            return AsyncElasticsearch(self.elasticsearch_url, **self.ssl_verify)
+        except (ImportError, ValueError) as e:
+            # 没有安装aiohttp等异步依赖
+            logger.warning(f'ElasticsearchWithPermissionCheck async client unavailable, use sync client: {e}')
+            self._async_client_available = False
+            return None
+
+    async def aclient_msearch(self, body: List[Dict]) -> Any:
+        """ 检索的实例按请求创建且可能在不同的事件循环中使用，异步客户端每次检索后关闭，不遗留未关闭的会话 """
+        async_client = self._create_async_client()
+        if async_client is None:
+            # 在线程中执行同步请求
+            return await asyncio.to_thread(self.client_msearch, self.client, body)
+        try:
+            if self._version_num is None:
+                info = await async_client.info()
+                self._version_num = int(info['version']['number'].split('.')[0])
+            if self._version_num >= 8:
+                return await async_client.msearch(searches=body)
+            return await async_client.msearch(body=body)
+        finally:
+            await async_client.close()
+
     def delete(self, **kwargs: Any) -> None:
         # TODO: Check if this can be done in bulk
         self.client.indices.delete(index=self.index_name)
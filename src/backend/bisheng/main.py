@@ -80,7 +80,8 @@ def create_app():
 
     @app.get('/health')
     def get_health():
-        return {'status': 'OK'}
+        from bisheng.interface.embeddings.cache import embedding_cache
+        return {'status': 'OK', 'embedding_cache': embedding_cache.get_stats()}
 
     app.add_middleware(
         CORSMiddleware,
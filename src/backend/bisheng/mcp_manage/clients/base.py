@@ -1,9 +1,13 @@
+import hashlib
+import json
 from abc import abstractmethod
 from contextlib import AsyncExitStack, asynccontextmanager
 from typing import Any
 
 from mcp import ClientSession
 
+from bisheng.mcp_manage.pool import mcp_session_pool
+
 
 class BaseMcpClient(object):
     """
@@ -15,6 +19,10 @@ class BaseMcpClient(object):
 
         self.client_session: ClientSession | None = None
 
+        # 相同配置的client共享会话池中的同一个会话
+        self.pool_key = hashlib.sha256(
+            json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
     @abstractmethod
     async def get_transport(self):
         raise NotImplementedError("get_mcp_client_transport() must be implemented in subclasses.")
@@ -29,18 +37,20 @@ class BaseMcpClient(object):
                 await session.initialize()
                 yield session
 
-    async def list_tools(self):
-        async with self.initialize() as client_session:
-            tools = await client_session.list_tools()
-        return tools.tools
+    async def list_tools(self, use_cache: bool = True):
+        """
+        List tools, the result is cached for a while unless use_cache is False.
+        """
+        return await mcp_session_pool.list_tools(self, use_cache)
 
     async def call_tool(self, name: str, arguments: dict[str, Any] | None = None) -> str:
         """
         Call a tool.
         """
-        async with self.initialize() as client_session:
-            try:
-                resp = await client_session.call_tool(name, arguments)
-            except Exception as e:
-                return f"Tool call failed: {str(e)}"
-        return resp.model_dump_json()
+        return await mcp_session_pool.call_tool(self, name, arguments)
+
+    def sync_call_tool(self, name: str, arguments: dict[str, Any] | None = None) -> str:
+        """
+        Call a tool from sync code.
+        """
+        return mcp_session_pool.sync_call_tool(self, name, arguments)
@@ -16,7 +16,7 @@ class SseClient(BaseMcpClient):
 
         :param url: The URL of the SSE server.
         """
-        super().__init__()
+        super().__init__(client_type='sse', url=url, **kwargs)
         self.url = url
         self.kwargs = kwargs
 
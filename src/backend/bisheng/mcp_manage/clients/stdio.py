@@ -16,7 +16,7 @@ class StdioClient(BaseMcpClient):
 
         :param url: The URL of the SSE server.
         """
-        super().__init__()
+        super().__init__(client_type='stdio', **kwargs)
         self.server_params = StdioServerParameters(**kwargs)
 
     @asynccontextmanager
@@ -16,7 +16,7 @@ class StreamableClient(BaseMcpClient):
 
         :param url: The URL of the streamable server.
         """
-        super().__init__()
+        super().__init__(client_type='streamable', url=url, **kwargs)
         self.url = url
         self.kwargs = kwargs
 
@@ -1,6 +1,3 @@
-import asyncio
-import concurrent
-import concurrent.futures
 from typing import Any
 
 from langchain_core.tools import StructuredTool
@@ -29,11 +26,9 @@ class McpTool(BaseModel):
         return kwargs
 
     def run(self, *args, **kwargs: Any) -> Any:
-        # todo call async method better when using in event pool
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            future = pool.submit(asyncio.run, self.arun(*args, **kwargs))
-            resp = future.result()
-        return resp
+        kwargs = self.parse_kwargs_schema(kwargs)
+        # 会话池在独立的事件循环中运行，同步调用时直接等待结果
+        return self.mcp_client.sync_call_tool(self.mcp_tool_name, kwargs)
 
     async def arun(self, *args, **kwargs: Any) -> Any:
         """Use the tool asynchronously."""
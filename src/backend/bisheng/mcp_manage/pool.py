@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Coroutine, Dict
+
+from cachetools import TTLCache
+from loguru import logger
+
+
+class PooledSession:
+    """
+    一个mcp服务的长连接，连接的建立和关闭都在同一个task内完成（anyio的cancel scope要求）
+    """
+
+    def __init__(self, client, max_concurrency: int):
+        self.client = client
+        self.session = None
+        self.error: Exception | None = None
+        # 限制同一个mcp服务同时进行的请求数
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def _hold(self):
+        try:
+            async with self.client.initialize() as session:
+                self.session = session
+                self._ready.set()
+                await self._closing.wait()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def start(self, timeout: int):
+        self._task = asyncio.create_task(self._hold())
+        await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        if self.session is None:
+            raise self.error or RuntimeError('mcp session initialize failed')
+
+    def is_alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def ping(self, timeout: int) -> bool:
+        """ 健康检查 """
+        if not self.is_alive():
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=timeout)
+            return True
+        except Exception as e:
+            logger.warning(f'mcp session ping failed: {e}')
+            return False
+
+    async def close(self):
+        self._closing.set()
+        if self._task is not None and not self._task.done():
+            await asyncio.wait([self._task], timeout=5)
+
+
+class McpSessionPool:
+    """
+    进程内共享的mcp会话池，按mcp服务的配置复用初始化过的会话
+    所有会话运行在池内独立线程的事件循环中，任意线程和事件循环都可以调用
+    """
+
+    def __init__(self, max_concurrency: int = 8, idle_timeout: int = 300, health_check_interval: int = 60,
+                 tools_cache_ttl: int = 60, connect_timeout: int = 30):
+        self.max_concurrency = max_concurrency
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_lock = threading.Lock()
+        # 以下属性只在池的事件循环内访问
+        self._sessions: Dict[str, PooledSession] = {}
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+        self._tools_cache: TTLCache = TTLCache(maxsize=256, ttl=tools_cache_ttl)
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=self._run_loop, args=(loop,), name='mcp-session-pool', daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._sweep(), loop)
+                self._loop = loop
+        return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    async def _get_session(self, client) -> PooledSession:
+        key = client.pool_key
+        lock = self._session_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            pooled = self._sessions.get(key)
+            if pooled is not None and pooled.is_alive():
+                return pooled
+            if pooled is not None:
+                await pooled.close()
+            pooled = PooledSession(client, self.max_concurrency)
+            try:
+                await pooled.start(self.connect_timeout)
+            except Exception:
+                await pooled.close()
+                self._sessions.pop(key, None)
+                raise
+            self._sessions[key] = pooled
+            return pooled
+
+    async def _evict(self, key: str, pooled: PooledSession):
+        if self._sessions.get(key) is pooled:
+            self._sessions.pop(key, None)
+        await pooled.close()
+
+    async def _call_tool(self, client, name: str, arguments: dict[str, Any] | None) -> str:
+        for retry in range(2):
+            pooled = await self._get_session(client)
+            async with pooled.semaphore:
+                pooled.in_use += 1
+                pooled.last_used = time.monotonic()
+                try:
+                    resp = await pooled.session.call_tool(name, arguments)
+                    return resp.model_dump_json()
+                except Exception as e:
+                    # 连接已断开时重新建立连接再试一次，否则是工具本身执行出错
+                    if retry == 0 and not await pooled.ping(self.connect_timeout):
+                        await self._evict(client.pool_key, pooled)
+                        continue
+                    return f"Tool call failed: {str(e)}"
+                finally:
+                    pooled.in_use -= 1
+                    pooled.last_used = time.monotonic()
+
+    async def _list_tools(self, client, use_cache: bool):
+        key = client.pool_key
+        if use_cache and key in self._tools_cache:
+            return self._tools_cache[key]
+        pooled = await self._get_session(client)
+        async with pooled.semaphore:
+            pooled.last_used = time.monotonic()
+            try:
+                tools = (await pooled.session.list_tools()).tools
+            except Exception:
+                await self._evict(key, pooled)
+                raise
+        self._tools_cache[key] = tools
+        return tools
+
+    async def _sweep(self):
+        """ 定期关闭长时间未使用的会话，并对空闲的会话做健康检查 """
+        while True:
+            await asyncio.sleep(min(self.health_check_interval, self.idle_timeout))
+            now = time.monotonic()
+            for key, pooled in list(self._sessions.items()):
+                if pooled.in_use:
+                    continue
+                idle = now - pooled.last_used
+                if idle >= self.idle_timeout:
+                    logger.debug(f'close idle mcp session {key}')
+                    await self._evict(key, pooled)
+                elif idle >= self.health_check_interval and not await pooled.ping(self.connect_timeout):
+                    await self._evict(key, pooled)
+
+    async def call_tool(self, client, name: str, arguments: dict[str, Any] | None = None) -> str:
+        return await asyncio.wrap_future(self.submit(self._call_tool(client, name, arguments)))
+
+    def sync_call_tool(self, client, name: str, arguments: dict[str, Any] | None = None) -> str:
+        return self.submit(self._call_tool(client, name, arguments)).result()
+
+    async def list_tools(self, client, use_cache: bool = True):
+        return await asyncio.wrap_future(self.submit(self._list_tools(client, use_cache)))
+
+
+mcp_session_pool = McpSessionPool()
@@ -92,9 +92,28 @@ class ObjectStore(BaseModel):
     minio: Optional[MinioConf] = Field(default_factory=MinioConf, description="minio 配置")
 
 
+class CodeSandboxConf(BaseModel):
+    enabled: bool = Field(default=True, description="代码节点是否在独立的子进程内执行")
+    pool_size: int = Field(default=4, description="每个worker进程内的沙箱进程数")
+    timeout: int = Field(default=60, description="单次执行的超时时间（秒）")
+    memory_limit: int = Field(default=1024, description="沙箱进程的内存上限（MB）")
+    max_calls: int = Field(default=200, description="沙箱进程执行多少次后重启")
+
+
 class WorkflowConf(BaseModel):
     max_steps: int = Field(default=50, description="节点运行最大步数")
     timeout: int = Field(default=720, description="节点超时时间（min）")
+    checkpoint: bool = Field(default=False,
+                             description="是否将等待输入的workflow持久化到redis，开启后任意worker都可以继续执行")
+    code_sandbox: CodeSandboxConf = Field(default_factory=CodeSandboxConf, description="代码节点的执行沙箱配置")
+
+
+class EmbeddingCacheConf(BaseModel):
+    enabled: bool = Field(default=True, description='是否缓存文本的embedding结果')
+    max_size: int = Field(default=20000, description='进程内LRU缓存的最大向量数')
+    redis: bool = Field(default=False, description='是否使用redis作为二级缓存，多个进程间共享')
+    redis_expire: int = Field(default=3600 * 24 * 7, description='redis缓存的过期时间（秒）')
+    stats_log_interval: int = Field(default=300, description='日志输出缓存命中统计的间隔（秒），0表示不输出')
 
 
 class CeleryConf(BaseModel):
@@ -106,6 +125,7 @@ class CeleryConf(BaseModel):
             return {
                 "bisheng.worker.knowledge.*": {"queue": "knowledge_celery"},  # 知识库相关任务
                 "bisheng.worker.workflow.*": {"queue": "workflow_celery"},  # 工作流执行相关任务
+                "bisheng.worker.chat.*": {"queue": "chat_celery"},  # 会话溯源等答案返回后的处理任务
             }
         return value
 
@@ -169,6 +189,7 @@ class Settings(BaseModel):
     object_storage: ObjectStore = {}
     workflow_conf: WorkflowConf = WorkflowConf()
     celery_task: CeleryConf = CeleryConf()
+    embedding_cache: EmbeddingCacheConf = EmbeddingCacheConf()
 
     # @field_validator('database_url')
     # @classmethod
@@ -1,34 +1,101 @@
 import os
 import tempfile
+from bisect import bisect_right
+from collections import deque
 from pathlib import Path
-from typing import IO, Dict, List, Any, Tuple
+from typing import IO, Dict, List, Any, Tuple, Iterable, Optional
 from urllib.parse import unquote, urlparse
 
 import pandas as pd
 import requests
 from docx import Document
 from docx.shared import Inches
+from docx.table import _Cell
+from docx.text.paragraph import Paragraph
 from loguru import logger
 
 from bisheng.utils.minio_client import MinioClient
 from bisheng.utils.util import _is_valid_url
 
 
-def find_lcs(str1, str2):
-    lstr1 = len(str1)
-    lstr2 = len(str2)
-    record = [[0 for i in range(lstr2 + 1)] for j in range(lstr1 + 1)]  # 多一位
-    maxNum = 0
-    p = 0
-    for i in range(lstr1):
-        for j in range(lstr2):
-            if str1[i] == str2[j]:
-                record[i + 1][j + 1] = record[i][j] + 1
-                if record[i + 1][j + 1] > maxNum:
-                    maxNum = record[i + 1][j + 1]
-                    p = i + 1
-
-    return str1[p - maxNum: p], maxNum
+class PlaceholderMatcher(object):
+    """
+    Aho-Corasick多模式匹配，一次扫描找出文本中所有不重叠的占位符，同一起点优先匹配最长的占位符
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        # 每个节点的子节点、失败指针、以该节点结尾的占位符、失败链上最近的有占位符的节点
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._key: List[Optional[str]] = [None]
+        self._link: List[int] = [0]
+        self._first_chars = set()
+        for key in keys:
+            if key:
+                self._add(key)
+        self._build()
+
+    def _add(self, key: str):
+        node = 0
+        for ch in key:
+            if ch not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._key.append(None)
+                self._link.append(0)
+                self._goto[node][ch] = len(self._goto) - 1
+            node = self._goto[node][ch]
+        self._key[node] = key
+        self._first_chars.add(key[0])
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[child] = fail if fail != child else 0
+                self._link[child] = self._fail[child] if self._key[self._fail[child]] is not None \
+                    else self._link[self._fail[child]]
+                queue.append(child)
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """ 返回 [(开始位置, 结束位置, 占位符)]，按位置排序且互不重叠 """
+        if not text or not any(ch in text for ch in self._first_chars):
+            return []
+        goto, fail, keys, link = self._goto, self._fail, self._key, self._link
+        found = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            match = node if keys[node] is not None else link[node]
+            while match:
+                found.append((i + 1 - len(keys[match]), i + 1, keys[match]))
+                match = link[match]
+        found.sort(key=lambda one: (one[0], one[0] - one[1]))
+        result = []
+        pos = 0
+        for start, end, key in found:
+            if start >= pos:
+                result.append((start, end, key))
+                pos = end
+        return result
+
+    @staticmethod
+    def replace(text: str, matches: List[Tuple[int, int, str]], values: Dict[str, str]) -> str:
+        parts = []
+        pos = 0
+        for start, end, key in matches:
+            parts.append(text[pos:start])
+            parts.append(values[key])
+            pos = end
+        parts.append(text[pos:])
+        return "".join(parts)
 
 
 class DocxTemplateRender(object):
@@ -282,89 +349,133 @@ class DocxTemplateRender(object):
             for i in range(end_run_index - 1, start_run_index, -1):
                 paragraph.runs[i].text = ""
 
-    def _process_resource_placeholders(self, doc, placeholder_map):
-        """
-        按位置顺序处理段落中混合的占位符
+    def _index_paragraphs(self, doc) -> Tuple[List[Paragraph], List[Tuple[_Cell, Paragraph]]]:
+        """ 遍历一次文档，收集正文段落和表格单元格内的段落 """
+        return list(doc.paragraphs), self._index_cell_paragraphs(doc.tables)
+
+    @staticmethod
+    def _index_cell_paragraphs(tables) -> List[Tuple[_Cell, Paragraph]]:
+        cell_paragraphs = []
+        for table in tables:
+            # 直接遍历单元格元素，合并的单元格只处理一次
+            for tr in table._tbl.tr_lst:
+                for tc in tr.tc_lst:
+                    cell = _Cell(tc, table)
+                    for paragraph in cell.paragraphs:
+                        cell_paragraphs.append((cell, paragraph))
+        return cell_paragraphs
 
-        Args:
-            doc: Word文档对象  
-            placeholder_map: 占位符映射字典
+    def _replace_in_runs(self, paragraph, matcher: PlaceholderMatcher, values: Dict[str, str]):
         """
-        # 处理所有段落中的占位符
-        paragraphs_to_process = list(doc.paragraphs)  # 创建副本，因为我们可能会修改段落结构
-
-        for i, p in enumerate(paragraphs_to_process):
-            paragraph_text = p.text
-            if not paragraph_text:
-                continue
-
-            # 找到该段落中的所有占位符及其位置
-            placeholders_with_positions = []
-            for placeholder, resource_info in placeholder_map.items():
-                pos = paragraph_text.find(placeholder)
-                if pos != -1:
-                    placeholders_with_positions.append({
-                        'placeholder': placeholder,
-                        'resource_info': resource_info,
-                        'position': pos,
-                        'end_position': pos + len(placeholder)
-                    })
-
-            if not placeholders_with_positions:
-                continue
+        替换段落内的变量，保留run的格式。变量跨多个run时，值写入包含变量名字符最多的run（不计算花括号），
+        其余run中变量的部分删除
+        """
+        runs = paragraph.runs
+        run_texts = [r.text for r in runs]
+        text = "".join(run_texts)
+        matches = matcher.find_all(text)
+        if not matches:
+            return
+
+        run_starts = []
+        offset = 0
+        for run_text in run_texts:
+            run_starts.append(offset)
+            offset += len(run_text)
+        new_texts = [[] for _ in runs]
+
+        def append_plain(start: int, end: int):
+            index = bisect_right(run_starts, start) - 1
+            while start < end:
+                run_end = run_starts[index] + len(run_texts[index])
+                if run_end > start:
+                    new_texts[index].append(text[start:min(end, run_end)])
+                    start = min(end, run_end)
+                index += 1
+
+        pos = 0
+        for start, end, key in matches:
+            append_plain(pos, start)
+            index = bisect_right(run_starts, start) - 1
+            target, target_weight = index, (0, 0)
+            while index < len(runs) and run_starts[index] < end:
+                overlap = text[max(start, run_starts[index]):min(end, run_starts[index] + len(run_texts[index]))]
+                weight = (len(overlap) - overlap.count("{") - overlap.count("}"), len(overlap))
+                if weight > target_weight:
+                    target, target_weight = index, weight
+                index += 1
+            new_texts[target].append(values[key])
+            pos = end
+        append_plain(pos, len(text))
+
+        for run, run_text, new_text in zip(runs, run_texts, new_texts):
+            new_text = "".join(new_text)
+            if new_text != run_text:
+                run.text = new_text
+
+    def _render_cell_paragraph(self, cell, paragraph, var_matcher: PlaceholderMatcher, var_values: Dict[str, str],
+                               resource_matcher: PlaceholderMatcher, placeholder_map: Dict[str, Dict]):
+        """ 替换表格单元格段落内的变量和资源占位符，单元格内的表格资源显示为文字说明 """
+        original_text = paragraph.text
+        if not original_text:
+            return
+        cell_text = original_text
+        var_matches = var_matcher.find_all(cell_text)
+        if var_matches:
+            cell_text = var_matcher.replace(cell_text, var_matches, var_values)
+
+        placeholders = dict.fromkeys(key for _, _, key in resource_matcher.find_all(cell_text))
+        for placeholder in placeholders:
+            resource_info = placeholder_map[placeholder]
+            if resource_info["type"] == "image":
+                # 在表格单元格中插入实际图片
+                image_path = resource_info.get("local_path") or resource_info.get("path", "")
+                if image_path and os.path.exists(image_path):
+                    try:
+                        # 在单元格中插入图片（这会清空单元格并插入图片）
+                        self._insert_image_in_table_cell(cell, image_path)
+                        logger.info(f"✅ 表格单元格中成功插入图片: {image_path}")
+                        # 标记占位符已处理，不需要更新文本
+                        cell_text = ""
+                    except Exception as e:
+                        logger.error(f"❌ 表格单元格插入图片失败: {str(e)}")
+                        # 失败时显示文件名
+                        cell_text = cell_text.replace(placeholder, os.path.basename(image_path))
+                else:
+                    # 图片文件不存在，显示路径
+                    cell_text = cell_text.replace(placeholder, resource_info.get("path", placeholder))
+            elif resource_info["type"] == "excel":
+                cell_text = cell_text.replace(placeholder, "[Excel表格]")
+            elif resource_info["type"] == "csv":
+                cell_text = cell_text.replace(placeholder, "[CSV表格]")
+            elif resource_info["type"] == "markdown_table":
+                cell_text = cell_text.replace(placeholder, "[Markdown表格]")
+            logger.info(f"处理表格单元格占位符: {placeholder}")
+
+        # 更新单元格文本
+        if cell_text != paragraph.text:
+            if paragraph.runs:
+                paragraph.runs[0].text = cell_text
+                for r_index in range(1, len(paragraph.runs)):
+                    paragraph.runs[r_index].text = ""
+            else:
+                paragraph.add_run(cell_text)
 
-            # 按位置排序，从前往后处理
-            placeholders_with_positions.sort(key=lambda x: x['position'])
-
-            # 分割段落为文本段和占位符段
-            self._process_mixed_content_paragraph(doc, p, placeholders_with_positions, paragraph_text)
-
-        # 处理表格单元格中的占位符
-        for table in doc.tables:
-            for i, row in enumerate(table.rows):
-                for j, cell in enumerate(row.cells):
-                    for one in cell.paragraphs:
-                        cell_text = one.text
-                        if not cell_text:
-                            continue
-
-                        # 检查单元格中的占位符
-                        for placeholder, resource_info in placeholder_map.items():
-                            if placeholder in cell_text:
-                                if resource_info["type"] == "image":
-                                    # 在表格单元格中插入实际图片
-                                    image_path = resource_info.get("local_path") or resource_info.get("path", "")
-                                    if image_path and os.path.exists(image_path):
-                                        try:
-                                            # 在单元格中插入图片（这会清空单元格并插入图片）
-                                            self._insert_image_in_table_cell(cell, image_path)
-                                            logger.info(f"✅ 表格单元格中成功插入图片: {image_path}")
-                                            # 标记占位符已处理，不需要更新文本
-                                            cell_text = ""
-                                        except Exception as e:
-                                            logger.error(f"❌ 表格单元格插入图片失败: {str(e)}")
-                                            # 失败时显示文件名
-                                            cell_text = cell_text.replace(placeholder, os.path.basename(image_path))
-                                    else:
-                                        # 图片文件不存在，显示路径
-                                        cell_text = cell_text.replace(placeholder,
-                                                                      resource_info.get("path", placeholder))
-                                elif resource_info["type"] == "excel":
-                                    cell_text = cell_text.replace(placeholder, "[Excel表格]")
-                                elif resource_info["type"] == "csv":
-                                    cell_text = cell_text.replace(placeholder, "[CSV表格]")
-                                elif resource_info["type"] == "markdown_table":
-                                    cell_text = cell_text.replace(placeholder, "[Markdown表格]")
-                                logger.info(f"处理表格单元格占位符: {placeholder}")
-
-                        # 更新单元格文本
-                        if cell_text != one.text:
-                            if one.runs:
-                                one.runs[0].text = cell_text
-                                for r_index in range(1, len(one.runs)):
-                                    one.runs[r_index].text = ""
-                            else:
-                                one.add_run(cell_text)
+    def _render_paragraph_resources(self, doc, paragraph, resource_matcher: PlaceholderMatcher,
+                                    placeholder_map: Dict[str, Dict]):
+        """ 按位置顺序处理段落中混合的资源占位符 """
+        paragraph_text = paragraph.text
+        matches = resource_matcher.find_all(paragraph_text)
+        if not matches:
+            return
+        placeholders_with_positions = [{
+            'placeholder': placeholder,
+            'resource_info': placeholder_map[placeholder],
+            'position': start,
+            'end_position': end,
+        } for start, end, placeholder in matches]
+        # 分割段落为文本段和占位符段
+        self._process_mixed_content_paragraph(doc, paragraph, placeholders_with_positions, paragraph_text)
 
     def _process_mixed_content_paragraph(self, doc, paragraph, placeholders_with_positions, original_text):
         """
@@ -1420,126 +1531,26 @@ class DocxTemplateRender(object):
         for table_info in resources.get("markdown_tables", []):
             placeholder_map[table_info["placeholder"]] = {"type": "markdown_table", "content": table_info["content"]}
 
-        # 原有的文本替换逻辑
+        # 同一个变量出现多次时以第一次为准
+        var_values = {}
         for replace_info in template_def:
-            k1 = replace_info[0]
-            v1 = replace_info[1]
-
-            # 处理表格中的占位符
-            for table in doc.tables:
-                for i, row in enumerate(table.rows):
-                    for j, cell in enumerate(row.cells):
-                        if k1 in cell.text:
-                            for one in cell.paragraphs:
-                                if k1 in one.text:
-                                    # 检查是否包含需要特殊处理的占位符
-                                    cell_text = one.text.replace(k1, v1)
-
-                                    # 处理占位符
-                                    for placeholder, resource_info in placeholder_map.items():
-                                        if placeholder in cell_text:
-                                            if resource_info["type"] == "image":
-                                                # 在表格单元格中插入实际图片
-                                                image_path = resource_info.get("local_path") or resource_info.get(
-                                                    "path", "")
-                                                if image_path and os.path.exists(image_path):
-                                                    try:
-                                                        # 清空单元格文本
-                                                        cell_text = cell_text.replace(placeholder, "")
-                                                        # 在单元格中插入图片
-                                                        self._insert_image_in_table_cell(cell, image_path)
-                                                        logger.info(f"✅ 表格单元格中成功插入图片: {image_path}")
-                                                    except Exception as e:
-                                                        logger.error(f"❌ 表格单元格插入图片失败: {str(e)}")
-                                                        # 失败时显示文件名
-                                                        cell_text = cell_text.replace(placeholder,
-                                                                                      os.path.basename(image_path))
-                                                else:
-                                                    # 图片文件不存在，显示路径
-                                                    cell_text = cell_text.replace(placeholder, resource_info.get("path",
-                                                                                                                 placeholder))
-                                            elif resource_info["type"] == "excel":
-                                                cell_text = cell_text.replace(placeholder, "[Excel表格]")
-                                            elif resource_info["type"] == "csv":
-                                                cell_text = cell_text.replace(placeholder, "[CSV表格]")
-                                            elif resource_info["type"] == "markdown_table":
-                                                cell_text = cell_text.replace(placeholder, "[Markdown表格]")
-
-                                    one.runs[0].text = cell_text
-                                    for r_index, r in enumerate(one.runs):
-                                        if r_index == 0:
-                                            continue
-                                        r.text = ""
-
-            # 处理段落中的占位符
-            for p in doc.paragraphs:
-                if k1 not in p.text:
-                    continue
-
-                runs_cnt = len(p.runs)
-                s_e = []
-                i = 0
-                while i < runs_cnt:
-                    new_i = i + 1
-                    for j in range(i + 1, runs_cnt + 1):
-                        part_text = "".join([r.text for r in p.runs[i:j]])
-                        if k1 in part_text:
-                            # 找到最小的范围内包含k1的runs
-                            tmp_i, tmp_j = i, j
-                            while tmp_i <= tmp_j:
-                                tmp_part_text = "".join([r.text for r in p.runs[tmp_i:tmp_j]])
-                                if k1 in tmp_part_text:
-                                    tmp_i += 1
-                                    continue
-                                else:
-                                    tmp_i -= 1
-                                    break
-                            s_e.append((tmp_i, j))
-                            new_i = j
-                            break
-                    i = new_i
-
-                for one in s_e:
-                    s, e = one
-                    assert e > 0, [r.text for r in p.runs]
-
-                    if e - s == 1:
-                        replace_mapping = [(k1, v1)]
-                    elif e - s == 2:
-                        s_tgt_text = p.runs[s].text
-                        comm_str, max_num = find_lcs(k1, s_tgt_text)
-                        assert k1.startswith(comm_str)
-                        p1 = comm_str
-                        p2 = k1[max_num:]
-                        n = len(v1)
-                        sub_n1 = int(1.0 * len(p1) / (len(p1) + len(p2)) * n)
-                        replace_mapping = [(p1, v1[:sub_n1]), (p2, v1[sub_n1:])]
-                    elif e - s == 3:
-                        m_text = p.runs[s + 1].text
-                        head_tail = k1.split(m_text, 1)
-                        assert len(head_tail) == 2
-                        h_text = head_tail[0]
-                        t_text = head_tail[1]
-                        replace_mapping = [(h_text, ""), (m_text, v1), (t_text, "")]
-                    else:
-                        m_texts = [p.runs[i].text for i in range(s + 1, e - 1)]
-                        m_text = "".join(m_texts)
-                        head_tail = k1.split(m_text, 1)
-                        assert len(head_tail) == 2
-                        h_text = head_tail[0]
-                        t_text = head_tail[1]
-                        replace_mapping = [(h_text, "")]
-                        replace_mapping.append((m_texts[0], v1))
-                        for text in m_texts[1:]:
-                            replace_mapping.append((text, ""))
-                        replace_mapping.append((t_text, ""))
-
-                    for i in range(s, e):
-                        _k, _v = replace_mapping[i - s]
-                        p.runs[i].text = p.runs[i].text.replace(_k, _v)
-
-        # 所有变量替换完成后，统一处理资源占位符
-        self._process_resource_placeholders(doc, placeholder_map)
+            var_values.setdefault(replace_info[0], replace_info[1])
+        var_matcher = PlaceholderMatcher(var_values.keys())
+        resource_matcher = PlaceholderMatcher(placeholder_map.keys())
+
+        # 遍历一次文档建立段落索引，每个段落只扫描一次，同时替换所有变量和资源占位符
+        body_paragraphs, cell_paragraphs = self._index_paragraphs(doc)
+        template_tables = {id(table._tbl) for table in doc.tables}
+        for cell, paragraph in cell_paragraphs:
+            self._render_cell_paragraph(cell, paragraph, var_matcher, var_values, resource_matcher, placeholder_map)
+        for paragraph in body_paragraphs:
+            self._replace_in_runs(paragraph, var_matcher, var_values)
+            self._render_paragraph_resources(doc, paragraph, resource_matcher, placeholder_map)
+
+        # 正文中插入的表格（markdown、excel、csv）的单元格里也可能有资源占位符，例如报告节点放在表格里的图片
+        inserted_tables = [table for table in doc.tables if id(table._tbl) not in template_tables]
+        for cell, paragraph in self._index_cell_paragraphs(inserted_tables):
+            self._render_cell_paragraph(cell, paragraph, var_matcher, var_values, resource_matcher, placeholder_map)
 
         # 添加最终文档内容检查
         self._log_final_document_content(doc)
@@ -4,3 +4,4 @@ from bisheng.worker.knowledge.file_worker import file_copy_celery, parse_knowled
     retry_knowledge_file_celery
 from bisheng.worker.knowledge.rebuild_knowledge_worker import rebuild_knowledge_celery
 from bisheng.worker.workflow.tasks import *
+from bisheng.worker.chat.source_trace import process_source_document_celery
@@ -0,0 +1,20 @@
+from typing import Dict, List
+
+from loguru import logger
+
+from bisheng.cache.redis import redis_client
+from bisheng.chat.utils import get_source_trace_pending_key, save_source_document
+from bisheng.worker.main import bisheng_celery
+
+
+@bisheng_celery.task()
+def process_source_document_celery(documents: List[Dict], chat_id: str, message_id: int, answer: str):
+    """ 提取答案关键词并保存溯源的chunk """
+    with logger.contextualize(trace_id=f'source_trace_{message_id}'):
+        logger.info("process_source_document_celery start message_id={} chunks={}", message_id, len(documents))
+        try:
+            save_source_document(documents, chat_id, message_id, answer)
+        except Exception as e:
+            logger.exception("process_source_document_celery error: {}", str(e))
+        finally:
+            redis_client.delete(get_source_trace_pending_key(message_id))
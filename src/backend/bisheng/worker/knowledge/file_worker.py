@@ -4,7 +4,7 @@ from typing import List
 from loguru import logger
 from pymilvus import Collection, MilvusException
 from bisheng.api.services.knowledge_imp import decide_vectorstores, process_file_task, delete_knowledge_file_vectors, \
-    KnowledgeUtils, delete_vector_files
+    KnowledgeUtils, delete_vector_files, update_file_title
 from bisheng.api.v1.schemas import FileProcessBase
 from bisheng.database.models.knowledge import Knowledge, KnowledgeDao, KnowledgeTypeEnum, KnowledgeState
 from bisheng.database.models.knowledge_file import (
@@ -336,6 +336,26 @@ def retry_knowledge_file_celery(file_id: int, preview_cache_key: str = None, cal
             logger.error("retry_knowledge_file_celery error: {}", str(e))
 
 
+@bisheng_celery.task()
+def extract_file_title_celery(file_id: int):
+    """ 文件入库后再提取文档的总结标题，并更新已入库的分块 """
+    with logger.contextualize(trace_id=f'extract_title_{file_id}'):
+        logger.info("extract_file_title_celery start file_id={}", file_id)
+        db_file = KnowledgeFileDao.get_file_by_ids([file_id])
+        if not db_file:
+            logger.error("file_id={} not found in db", file_id)
+            return
+        db_file = db_file[0]
+        db_knowledge = KnowledgeDao.query_by_id(db_file.knowledge_id)
+        if not db_knowledge:
+            logger.error("knowledge_id={} not found", db_file.knowledge_id)
+            return
+        try:
+            update_file_title(db_knowledge, db_file)
+        except Exception as e:
+            logger.exception("extract_file_title_celery error: {}", str(e))
+
+
 @bisheng_celery.task()
 def delete_knowledge_file_celery(file_ids: List[int], knowledge_id: int, clear_minio: bool = True):
     """ 异步删除知识文件及其向量 """
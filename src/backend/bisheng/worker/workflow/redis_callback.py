@@ -1,6 +1,6 @@
-import asyncio
 import json
 import os
+import threading
 import time
 import uuid
 from typing import AsyncIterator, Iterator
@@ -23,6 +23,7 @@ from bisheng.workflow.callback.base_callback import BaseCallback
 from bisheng.workflow.callback.event import NodeStartData, NodeEndData, UserInputData, GuideWordData, GuideQuestionData, \
     OutputMsgData, StreamMsgData, StreamMsgOverData, OutputMsgChooseData, OutputMsgInputData
 from bisheng.workflow.common.workflow import WorkflowStatus
+from bisheng.workflow.graph.plan import get_workflow_data_hash
 
 
 class RedisCallback(BaseCallback):
@@ -43,26 +44,69 @@ class RedisCallback(BaseCallback):
         self.redis_client = redis_client
         self.workflow_data_key = f'workflow:{unique_id}:data'
         self.workflow_status_key = f'workflow:{unique_id}:status'
-        self.workflow_event_key = f'workflow:{unique_id}:event'
+        # 事件和状态变化都写入同一个stream，消费方阻塞读取
+        self.workflow_event_key = f'workflow:{unique_id}:events'
         self.workflow_input_key = f'workflow:{unique_id}:input'
         self.workflow_stop_key = f'workflow:{unique_id}:stop'
+        self.workflow_checkpoint_key = f'workflow:{unique_id}:checkpoint'
         self.workflow_expire_time = settings.get_workflow_conf().timeout * 60 + 60
-
-    def set_workflow_data(self, data: dict):
-        self.redis_client.set(self.workflow_data_key, data, expiration=self.workflow_expire_time)
-
-    def get_workflow_data(self) -> dict:
+        # 没有事件时阻塞等待的时间（毫秒）和每次读取的最大事件数
+        self.workflow_event_block = 5000
+        self.workflow_event_batch = 100
+
+        # 流式输出的事件先在内存中合并，按时间窗口或者大小批量写入stream；其他事件写入前会先写入缓冲区内的事件
+        self.stream_buffer: list[dict] = []
+        self.stream_buffer_size = 0
+        self.stream_flush_interval = 0.05
+        self.stream_flush_size = 256
+        self.stream_buffer_lock = threading.RLock()
+        self.stream_flush_timer: threading.Timer | None = None
+
+    @staticmethod
+    def get_workflow_content_key(data_hash: str) -> str:
+        return f'workflow:content:{data_hash}'
+
+    def set_workflow_data(self, data: dict, version_id: int | str = None):
+        """ 相同内容的工作流数据只存一份，每次运行只存储版本和内容hash的引用 """
+        data_hash = get_workflow_data_hash(data)
+        content_key = self.get_workflow_content_key(data_hash)
+        # 先续期再判断是否存在，避免判断后恰好过期
+        self.redis_client.expire_key(content_key, self.workflow_expire_time)
+        if not self.redis_client.exists(content_key):
+            self.redis_client.set(content_key, data, expiration=self.workflow_expire_time)
+        self.redis_client.set(self.workflow_data_key, {'version_id': version_id, 'data_hash': data_hash},
+                              expiration=self.workflow_expire_time)
+
+    def get_workflow_data_ref(self) -> dict | None:
+        """ {"version_id": 版本ID, "data_hash": 工作流内容的hash} """
         return self.redis_client.get(self.workflow_data_key)
 
+    def get_workflow_data(self) -> dict | None:
+        data_ref = self.get_workflow_data_ref()
+        if not data_ref:
+            return None
+        return self.redis_client.get(self.get_workflow_content_key(data_ref['data_hash']))
+
     def set_workflow_status(self, status: str, reason: str = None):
-        self.redis_client.set(self.workflow_status_key,
-                              {'status': status, 'reason': reason, 'time': time.time()},
-                              expiration=3600 * 24 * 7)
+        self.flush_stream_buffer()
+        status_info = {'status': status, 'reason': reason, 'time': time.time()}
+        self.redis_client.set(self.workflow_status_key, status_info, expiration=3600 * 24 * 7)
+        # 状态变化通知到事件stream，唤醒阻塞等待的消费方
+        self.redis_client.xadd(self.workflow_event_key, {'status': json.dumps(status_info)},
+                               expiration=self.workflow_expire_time)
         self.workflow_cache.clear()
         if status in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
             # 消息事件和状态key可能还需要消费
             self.redis_client.delete(self.workflow_data_key)
             self.redis_client.delete(self.workflow_input_key)
+            self.redis_client.delete(self.workflow_checkpoint_key)
+
+    def set_workflow_checkpoint(self, data: dict):
+        """ 存储等待用户输入的workflow运行状态 """
+        self.redis_client.set(self.workflow_checkpoint_key, data, expiration=self.workflow_expire_time)
+
+    def get_workflow_checkpoint(self) -> dict | None:
+        return self.redis_client.get(self.workflow_checkpoint_key)
 
     def get_workflow_status(self, user_cache: bool = True) -> dict | None:
         # if user_cache and self.workflow_cache.get(self.workflow_status_key):
@@ -71,28 +115,110 @@ class RedisCallback(BaseCallback):
         self.workflow_cache.setdefault(self.workflow_status_key, workflow_status)
         return workflow_status
 
+    async def aget_workflow_status(self) -> dict | None:
+        return await self.redis_client.aget(self.workflow_status_key)
+
     def clear_workflow_status(self):
         self.redis_client.delete(self.workflow_status_key)
         self.redis_client.delete(self.workflow_stop_key)
         self.redis_client.delete(self.workflow_data_key)
+        self.redis_client.delete(self.workflow_checkpoint_key)
 
     def insert_workflow_response(self, event: dict):
-        self.redis_client.rpush(self.workflow_event_key, json.dumps(event), expiration=self.workflow_expire_time)
-
-    def get_workflow_response(self) -> ChatResponse | None:
-        response = self.redis_client.lpop(self.workflow_event_key)
-        if self.get_workflow_stop():
-            self.redis_client.delete(self.workflow_event_key)
-            return None
-        if response:
-            response = ChatResponse(**json.loads(response))
+        with self.stream_buffer_lock:
+            self._flush_stream_buffer()
+            self.redis_client.xadd(self.workflow_event_key, {'event': json.dumps(event)},
+                                   expiration=self.workflow_expire_time)
+
+    @staticmethod
+    def _merge_stream_event(last_event: dict, event: dict) -> bool:
+        """ 同一个节点同一个输出的连续流式事件合并为一个事件 """
+        last_msg, msg = last_event['message'], event['message']
+        if (last_msg['unique_id'] != msg['unique_id'] or last_msg['node_id'] != msg['node_id']
+                or last_msg['output_key'] != msg['output_key']):
+            return False
+        last_msg['msg'] = (last_msg['msg'] or '') + (msg['msg'] or '')
+        if msg['reasoning_content'] is not None:
+            last_msg['reasoning_content'] = (last_msg['reasoning_content'] or '') + msg['reasoning_content']
+        return True
+
+    def buffer_stream_response(self, event: dict):
+        """ 流式事件写入缓冲区 """
+        with self.stream_buffer_lock:
+            if not self.stream_buffer or not self._merge_stream_event(self.stream_buffer[-1], event):
+                self.stream_buffer.append(event)
+            self.stream_buffer_size += len(event['message']['msg'] or '') + len(
+                event['message']['reasoning_content'] or '')
+            if self.stream_buffer_size >= self.stream_flush_size:
+                self._flush_stream_buffer()
+            elif self.stream_flush_timer is None:
+                self.stream_flush_timer = threading.Timer(self.stream_flush_interval, self.flush_stream_buffer)
+                self.stream_flush_timer.daemon = True
+                self.stream_flush_timer.start()
+
+    def flush_stream_buffer(self):
+        with self.stream_buffer_lock:
+            try:
+                self._flush_stream_buffer()
+            except Exception as e:
+                logger.exception(f'flush stream buffer error: {e}')
+
+    def _flush_stream_buffer(self):
+        if self.stream_flush_timer is not None:
+            self.stream_flush_timer.cancel()
+            self.stream_flush_timer = None
+        if not self.stream_buffer:
+            return
+        events = self.stream_buffer
+        self.stream_buffer = []
+        self.stream_buffer_size = 0
+        self.redis_client.xadd_many(self.workflow_event_key, [{'event': json.dumps(one)} for one in events],
+                                    expiration=self.workflow_expire_time)
+
+    def parse_workflow_events(self, messages: list) -> (list[ChatResponse], dict | None):
+        """ 解析从stream中读取的消息
+        return: 业务事件列表, 最新的workflow状态（没有状态变化时为None） """
+        responses = []
+        status_info = None
+        for _, fields in messages:
+            if b'status' in fields:
+                status_info = json.loads(fields[b'status'])
+                continue
+            response = ChatResponse(**json.loads(fields[b'event']))
             if ((response.category == WorkflowEventType.NodeRun.value and response.type == 'end'
                  and response.message and response.message.get('node_id', '').startswith('end_')) or
                     (response.category in [WorkflowEventType.UserInput.value, WorkflowEventType.OutputWithChoose.value
                         , WorkflowEventType.OutputWithInput.value])):
                 # 如果是结束节点或者输入事件，清空状态缓存
                 self.workflow_cache.clear()
-        return response
+            responses.append(response)
+        return responses, status_info
+
+    def read_workflow_events(self, block: int = None) -> (list[ChatResponse], dict | None, bool):
+        """ 批量读取workflow的事件，block为没有事件时阻塞等待的毫秒数，读取后的事件会从stream中删除
+        return: 业务事件列表, 最新的workflow状态, 是否读取到了消息（只有状态变化时业务事件列表为空） """
+        messages = self.redis_client.xread(self.workflow_event_key, count=self.workflow_event_batch, block=block)
+        if not messages:
+            return [], None, False
+        self.redis_client.xdel(self.workflow_event_key, *[one[0] for one in messages])
+        chat_responses, status_info = self.parse_workflow_events(messages)
+        if self.get_workflow_stop():
+            # 已经停止的workflow只关心状态变化
+            self.redis_client.delete(self.workflow_event_key)
+            return [], status_info, False
+        return chat_responses, status_info, True
+
+    async def aread_workflow_events(self, block: int = None) -> (list[ChatResponse], dict | None, bool):
+        messages = await self.redis_client.axread(self.workflow_event_key, count=self.workflow_event_batch,
+                                                  block=block)
+        if not messages:
+            return [], None, False
+        await self.redis_client.axdel(self.workflow_event_key, *[one[0] for one in messages])
+        chat_responses, status_info = self.parse_workflow_events(messages)
+        if await self.redis_client.aget(self.workflow_stop_key) == 1:
+            await self.redis_client.adelete(self.workflow_event_key)
+            return [], status_info, False
+        return chat_responses, status_info, True
 
     def build_chat_response(self, category, category_type, message, extra=None, files=None):
         return ChatResponse(
@@ -128,103 +254,79 @@ class RedisCallback(BaseCallback):
             return self.build_chat_response(WorkflowEventType.Error.value, 'over',
                                             WorkFlowTaskOtherError(exception=status_info['reason']).to_dict())
 
+    def judge_response_break(self, status_info: dict | None) -> (bool, ChatResponse | None):
+        """ 根据workflow的状态判断是否需要停止获取事件
+        return: 是否停止, 停止前需要额外返回的错误事件 """
+        if not status_info:
+            return True, self.build_chat_response(WorkflowEventType.Error.value, 'over',
+                                                  message=WorkFlowTaskOtherError(
+                                                      exception=Exception("workflow status not found")).to_dict())
+        elif status_info['status'] == WorkflowStatus.FAILED.value:
+            return True, self.parse_workflow_failed(status_info)
+        elif status_info['status'] in [WorkflowStatus.SUCCESS.value, WorkflowStatus.INPUT.value]:
+            return True, None
+        elif status_info['status'] in [WorkflowStatus.WAITING.value,
+                                       WorkflowStatus.INPUT_OVER.value] and time.time() - status_info['time'] > 10:
+            # 10秒内没有收到状态更新，说明workflow没有启动，可能是celery worker线程数已满
+            self.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow task execute busy')
+            return True, self.build_chat_response(WorkflowEventType.Error.value, 'over',
+                                                  message=WorkFlowTaskBusyError().to_dict())
+        elif time.time() - status_info['time'] > 86400:
+            self.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow status not update over 1 day')
+            self.set_workflow_stop()
+            return True, self.build_chat_response(WorkflowEventType.Error.value, 'over',
+                                                  message=WorkFlowTaskOtherError(exception=Exception(
+                                                      "workflow status not update over 1 day")).to_dict())
+        return False, None
+
     def sync_get_response_until_break(self) -> Iterator[ChatResponse]:
+        status_info = self.get_workflow_status()
         while True:
-            # get workflow status
-            status_info = self.get_workflow_status()
-            if not status_info:
-                yield self.build_chat_response(WorkflowEventType.Error.value, 'over',
-                                               message=WorkFlowTaskOtherError(
-                                                   exception=Exception("workflow status not found")).to_dict())
-                break
-            elif status_info['status'] in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
-                while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
-                        break
-                    yield chat_response
-                if status_info['status'] == WorkflowStatus.FAILED.value:
-                    error_resp = self.parse_workflow_failed(status_info)
-                    if error_resp:
-                        yield error_resp
-                break
-            elif status_info['status'] == WorkflowStatus.INPUT.value:
-                while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
-                        break
-                    yield chat_response
-                break
-            elif status_info['status'] in [WorkflowStatus.WAITING.value,
-                                           WorkflowStatus.INPUT_OVER.value] and time.time() - status_info['time'] > 10:
-                # 10秒内没有收到状态更新，说明workflow没有启动，可能是celery worker线程数已满
-                self.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow task execute busy')
-                yield self.build_chat_response(WorkflowEventType.Error.value, 'over',
-                                               message=WorkFlowTaskBusyError().to_dict())
+            is_break, error_resp = self.judge_response_break(status_info)
+            if is_break:
+                # 结束前把剩余的事件全部返回
+                if status_info and status_info['status'] in [WorkflowStatus.FAILED.value,
+                                                             WorkflowStatus.SUCCESS.value,
+                                                             WorkflowStatus.INPUT.value]:
+                    # 只有状态变化的一批消息也要继续读取，直到stream中没有消息
+                    has_more = True
+                    while has_more:
+                        chat_responses, _, has_more = self.read_workflow_events()
+                        yield from chat_responses
+                if error_resp:
+                    yield error_resp
                 break
-            elif time.time() - status_info['time'] > 86400:
-                yield self.build_chat_response(WorkflowEventType.Error.value, 'over',
-                                               WorkFlowTaskOtherError(
-                                                   exception=Exception(
-                                                       "workflow status not update over 1 day")).to_dict())
-                self.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow status not update over 1 day')
-                self.set_workflow_stop()
-                break
-            else:
-                chat_response = self.get_workflow_response()
-                if not chat_response:
-                    time.sleep(1)
-                    continue
-                yield chat_response
+            # 阻塞等待新的事件，状态变化也会作为事件写入同一个stream
+            chat_responses, new_status, _ = self.read_workflow_events(block=self.workflow_event_block)
+            yield from chat_responses
+            if new_status and (not status_info or new_status['time'] >= status_info['time']):
+                status_info = new_status
 
     async def get_response_until_break(self) -> AsyncIterator[ChatResponse]:
         """ 不断获取workflow的response，直到遇到运行结束或者待输入 """
+        status_info = await self.aget_workflow_status()
         while True:
-            # get workflow status
-            status_info = self.get_workflow_status()
-            if not status_info:
-                yield self.build_chat_response(WorkflowEventType.Error.value, 'over',
-                                               message=WorkFlowTaskOtherError(
-                                                   exception=Exception("workflow status not found")).to_dict())
-                break
-            elif status_info['status'] in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
-                while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
-                        break
-                    yield chat_response
-                if status_info['status'] == WorkflowStatus.FAILED.value:
-                    error_resp = self.parse_workflow_failed(status_info)
-                    if error_resp:
-                        yield error_resp
+            is_break, error_resp = self.judge_response_break(status_info)
+            if is_break:
+                # 结束前把剩余的事件全部返回
+                if status_info and status_info['status'] in [WorkflowStatus.FAILED.value,
+                                                             WorkflowStatus.SUCCESS.value,
+                                                             WorkflowStatus.INPUT.value]:
+                    # 只有状态变化的一批消息也要继续读取，直到stream中没有消息
+                    has_more = True
+                    while has_more:
+                        chat_responses, _, has_more = await self.aread_workflow_events()
+                        for one in chat_responses:
+                            yield one
+                if error_resp:
+                    yield error_resp
                 break
-            elif status_info['status'] == WorkflowStatus.INPUT.value:
-                while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
-                        break
-                    yield chat_response
-                break
-            elif status_info['status'] in [WorkflowStatus.WAITING.value,
-                                           WorkflowStatus.INPUT_OVER.value] and time.time() - status_info['time'] > 10:
-                # 10秒内没有收到状态更新，说明workflow没有启动，可能是celery worker线程数已满
-                self.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow task execute busy')
-                yield self.build_chat_response(WorkflowEventType.Error.value, 'over',
-                                               message=WorkFlowTaskBusyError().to_dict())
-                break
-            elif time.time() - status_info['time'] > 86400:
-                yield self.build_chat_response(WorkflowEventType.Error.value, 'over',
-                                               message=WorkFlowTaskOtherError(exception=Exception(
-                                                   "workflow status not update over 1 day")).to_dict())
-                self.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow status not update over 1 day')
-                self.set_workflow_stop()
-                break
-            else:
-                chat_response = self.get_workflow_response()
-                if not chat_response:
-                    await asyncio.sleep(1)
-                    continue
-                yield chat_response
+            # 阻塞等待新的事件，状态变化也会作为事件写入同一个stream
+            chat_responses, new_status, _ = await self.aread_workflow_events(block=self.workflow_event_block)
+            for one in chat_responses:
+                yield one
+            if new_status and (not status_info or new_status['time'] >= status_info['time']):
+                status_info = new_status
 
     def set_user_input(self, data: dict, message_id: int = None, message_content: str = None):
         if self.chat_id and message_id:
@@ -414,14 +516,15 @@ class RedisCallback(BaseCallback):
         self.send_chat_response(chat_response)
 
     def on_stream_msg(self, data: StreamMsgData):
-        logger.debug(f'stream msg: {data}')
-        self.send_chat_response(
+        logger.debug('stream msg: {}', data)
+        # 流式输出不判断是否需要停止workflow，直接写入缓冲区
+        self.buffer_stream_response(
             ChatResponse(message=data.dict(),
                          category=WorkflowEventType.StreamMsg.value,
                          extra='',
                          type='stream',
                          flow_id=self.workflow_id,
-                         chat_id=self.chat_id))
+                         chat_id=self.chat_id).dict())
 
     def on_stream_over(self, data: StreamMsgOverData):
         logger.debug(f'stream over: {data}')
@@ -7,6 +7,7 @@ from bisheng.utils.exceptions import IgnoreException
 from bisheng.worker.main import bisheng_celery
 from bisheng.worker.workflow.redis_callback import RedisCallback
 from bisheng.workflow.common.workflow import WorkflowStatus
+from bisheng.workflow.graph.plan import get_graph_plan, set_graph_plan
 from bisheng.workflow.graph.workflow import Workflow
 
 # 存储全局的工作流对象
@@ -25,14 +26,21 @@ def _clear_workflow_obj(unique_id: str):
 def _judge_workflow_status(redis_callback: RedisCallback, workflow: Workflow):
     status = workflow.status()
     reason = workflow.reason()
-    if workflow.status() in [WorkflowStatus.SUCCESS.value, WorkflowStatus.FAILED.value]:
+    if status != WorkflowStatus.FAILED.value and redis_callback.get_workflow_stop():
+        # 运行中被用户停止（停止任务可能在其他worker执行），不能再覆盖为其他状态
+        status, reason = WorkflowStatus.FAILED.value, 'workflow stop by user'
+    if status in [WorkflowStatus.SUCCESS.value, WorkflowStatus.FAILED.value]:
         redis_callback.set_workflow_status(status, reason)
         _clear_workflow_obj(redis_callback.unique_id)
         return
-    if workflow.status() == WorkflowStatus.INPUT.value:
-        # 如果是输入状态，将对象放到内存中
-        _global_workflow[redis_callback.unique_id] = workflow
-        # redis_callback.save_workflow_object(workflow)
+    if status == WorkflowStatus.INPUT.value:
+        if settings.get_workflow_conf().checkpoint:
+            # 持久化模式，将运行状态存储到redis，任意worker都可以继续执行
+            redis_callback.set_workflow_checkpoint(workflow.dump_checkpoint())
+            _global_workflow.pop(redis_callback.unique_id, None)
+        else:
+            # 如果是输入状态，将对象放到内存中
+            _global_workflow[redis_callback.unique_id] = workflow
         redis_callback.set_workflow_status(status, reason)
         return
     logger.error(f'unexpected workflow status error: {status}')
@@ -41,25 +49,58 @@ def _judge_workflow_status(redis_callback: RedisCallback, workflow: Workflow):
     _clear_workflow_obj(redis_callback.unique_id)
 
 
+def _init_workflow(redis_callback: RedisCallback, workflow_id: str, user_id: str) -> Workflow:
+    data_ref = redis_callback.get_workflow_data_ref()
+    if not data_ref:
+        raise Exception('workflow data not found maybe data is expired')
+
+    # 相同版本的工作流复用已解析的拓扑信息，不再从redis获取工作流数据
+    plan_key = (workflow_id, data_ref.get('version_id'), data_ref['data_hash'])
+    plan = get_graph_plan(plan_key)
+    workflow_data = None
+    if not plan:
+        workflow_data = redis_callback.get_workflow_data()
+        if not workflow_data:
+            raise Exception('workflow data not found maybe data is expired')
+
+    workflow_conf = settings.get_workflow_conf()
+    workflow = Workflow(workflow_id, user_id, workflow_data, False,
+                        workflow_conf.max_steps,
+                        workflow_conf.timeout,
+                        redis_callback,
+                        plan=plan)
+    if not plan:
+        set_graph_plan(plan_key, workflow.plan)
+    redis_callback.workflow = workflow
+    return workflow
+
+
+def _restore_workflow(redis_callback: RedisCallback, workflow_id: str, user_id: str) -> Workflow | None:
+    """ 从redis中的checkpoint恢复等待输入的workflow """
+    checkpoint = redis_callback.get_workflow_checkpoint()
+    if not checkpoint:
+        return None
+    workflow = _init_workflow(redis_callback, workflow_id, user_id)
+    workflow.load_checkpoint(checkpoint)
+    logger.debug(f'restore workflow object from checkpoint for unique_id: {redis_callback.unique_id}')
+    return workflow
+
+
+def _run_workflow(redis_callback: RedisCallback, workflow: Workflow, user_input: dict = None):
+    """ 运行期间放到全局对象中，同一个进程内的停止任务可以停止正在运行的workflow """
+    _global_workflow[redis_callback.unique_id] = workflow
+    workflow.run(user_input)
+    _judge_workflow_status(redis_callback, workflow)
+
+
 def _execute_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: str):
     redis_callback = RedisCallback(unique_id, workflow_id, chat_id, user_id)
     try:
         # update workflow status
         redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
-        # get workflow data
-        workflow_data = redis_callback.get_workflow_data()
-        if not workflow_data:
-            raise Exception('workflow data not found maybe data is expired')
-
         # init workflow
-        workflow_conf = settings.get_workflow_conf()
-        workflow = Workflow(workflow_id, user_id, workflow_data, False,
-                            workflow_conf.max_steps,
-                            workflow_conf.timeout,
-                            redis_callback)
-        redis_callback.workflow = workflow
-        status, reason = workflow.run()
-        _judge_workflow_status(redis_callback, workflow)
+        workflow = _init_workflow(redis_callback, workflow_id, user_id)
+        _run_workflow(redis_callback, workflow)
     except IgnoreException as e:
         logger.warning(f'execute_workflow ignore error: {e}')
         redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e))
@@ -82,6 +123,8 @@ def _continue_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id:
     redis_callback = RedisCallback(unique_id, workflow_id, chat_id, user_id)
     try:
         workflow = _global_workflow.get(redis_callback.unique_id, None)
+        if not workflow:
+            workflow = _restore_workflow(redis_callback, workflow_id, user_id)
         if not workflow:
             raise Exception('workflow object not found maybe data is expired')
         if workflow.status() not in [WorkflowStatus.INPUT.value, WorkflowStatus.INPUT_OVER.value]:
@@ -90,8 +133,7 @@ def _continue_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id:
         if not user_input:
             raise IgnoreException('workflow continue not found user input')
         redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
-        status, reason = workflow.run(user_input)
-        _judge_workflow_status(redis_callback, workflow)
+        _run_workflow(redis_callback, workflow, user_input)
     except IgnoreException as e:
         logger.warning(f'continue_workflow ignore error: {e}')
         redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e))
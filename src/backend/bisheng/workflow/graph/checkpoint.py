@@ -0,0 +1,33 @@
+from collections import defaultdict
+from typing import Any, Dict
+
+from langgraph.checkpoint.memory import MemorySaver
+
+
+class WorkflowCheckpointSaver(MemorySaver):
+    """
+    langgraph 的 checkpointer，运行过程中和 MemorySaver 一致，
+    在工作流中断（等待用户输入）时可以导出全部的checkpoint数据，存储到redis后由任意worker导入并继续执行
+    """
+
+    def dump(self) -> Dict[str, Any]:
+        """ 导出checkpoint数据, 内部的值已经是serde序列化后的结果，可以直接pickle """
+        return {
+            'storage': {
+                thread_id: {ns: dict(checkpoints) for ns, checkpoints in thread_data.items()}
+                for thread_id, thread_data in self.storage.items()
+            },
+            'writes': {key: dict(value) for key, value in self.writes.items()},
+            'blobs': dict(self.blobs),
+        }
+
+    def load(self, data: Dict[str, Any]) -> None:
+        """ 导入 dump 导出的checkpoint数据 """
+        self.storage = defaultdict(lambda: defaultdict(dict))
+        for thread_id, thread_data in data.get('storage', {}).items():
+            for ns, checkpoints in thread_data.items():
+                self.storage[thread_id][ns].update(checkpoints)
+        self.writes = defaultdict(dict)
+        for key, value in data.get('writes', {}).items():
+            self.writes[key].update(value)
+        self.blobs = dict(data.get('blobs', {}))
@@ -0,0 +1,370 @@
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+
+from bisheng.workflow.edges.edges import EdgeManage
+
+# 互斥分支判断时，连接到所有condition节点的虚拟起点
+_VIRTUAL_SOURCE = '__virtual_source__'
+# 环内枚举简单路径的最大步数，超过后环内的层级改为按去掉回边后的最长路径计算
+_MAX_CYCLE_PATH_STEPS = 100000
+
+
+def _reverse_post_order(succ: Dict[Hashable, List], root: Hashable) -> (List, Set[tuple]):
+    """
+    从root开始非递归的深度优先遍历，返回可达节点的逆后序和回边集合
+    去掉回边后图中不再有环，逆后序即为拓扑序
+    """
+    order = []
+    back_edges = set()
+    visited = {root}
+    on_stack = {root}
+    stack = [(root, iter(succ.get(root, ())))]
+    while stack:
+        node, next_iter = stack[-1]
+        for next_node in next_iter:
+            if next_node in on_stack:
+                back_edges.add((node, next_node))
+            elif next_node not in visited:
+                visited.add(next_node)
+                on_stack.add(next_node)
+                stack.append((next_node, iter(succ.get(next_node, ()))))
+                break
+        else:
+            stack.pop()
+            on_stack.discard(node)
+            order.append(node)
+    order.reverse()
+    return order, back_edges
+
+
+def _immediate_dominators(succ: Dict[Hashable, List], root: Hashable) -> Dict[Hashable, Hashable]:
+    """ Cooper-Harvey-Kennedy 迭代算法计算root可达节点的直接支配节点 """
+    order, _ = _reverse_post_order(succ, root)
+    index = {node: i for i, node in enumerate(order)}
+    preds = {node: [] for node in order}
+    for node in order:
+        for next_node in succ.get(node, ()):
+            preds[next_node].append(node)
+
+    idom = {root: root}
+
+    def intersect(a, b):
+        while a != b:
+            while index[a] > index[b]:
+                a = idom[a]
+            while index[b] > index[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for node in order[1:]:
+            new_idom = None
+            for one in preds[node]:
+                if one not in idom:
+                    continue
+                new_idom = one if new_idom is None else intersect(one, new_idom)
+            if idom.get(node) != new_idom:
+                idom[node] = new_idom
+                changed = True
+    return idom
+
+
+def _strongly_connected_components(succ: Dict[Hashable, List], nodes: Iterable[Hashable]) -> List[List]:
+    """ 非递归的Tarjan算法，返回的强连通分量是逆拓扑序（下游的分量在前） """
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(succ.get(root, ())))]
+        while work:
+            node, next_iter = work[-1]
+            for next_node in next_iter:
+                if next_node not in index:
+                    index[next_node] = low[next_node] = len(index)
+                    stack.append(next_node)
+                    on_stack.add(next_node)
+                    work.append((next_node, iter(succ.get(next_node, ()))))
+                    break
+                if next_node in on_stack:
+                    low[node] = min(low[node], index[next_node])
+            else:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        one = stack.pop()
+                        on_stack.discard(one)
+                        component.append(one)
+                        if one == node:
+                            break
+                    components.append(component)
+    return components
+
+
+class _DominatorTree:
+    """ 支配树，预先计算深度和先序区间，支持O(1)的支配关系判断 """
+
+    def __init__(self, idom: Dict[Hashable, Hashable], root: Hashable):
+        self.idom = idom
+        self.root = root
+        children = {}
+        for node, parent in idom.items():
+            if node != root:
+                children.setdefault(parent, []).append(node)
+        self.depth = {root: 0}
+        self.enter = {}
+        self.exit = {}
+        counter = 0
+        stack = [(root, False)]
+        while stack:
+            node, finished = stack.pop()
+            if finished:
+                self.exit[node] = counter
+                continue
+            self.enter[node] = counter
+            counter += 1
+            stack.append((node, True))
+            for child in children.get(node, ()):
+                self.depth[child] = self.depth[node] + 1
+                stack.append((child, False))
+
+    def dominates(self, a: Hashable, b: Hashable) -> bool:
+        return self.enter[a] <= self.enter[b] and self.exit[b] <= self.exit[a]
+
+    def common_dominator(self, a: Hashable, b: Hashable) -> Hashable:
+        """ 树上的最近公共祖先，耗时和两个节点到公共祖先的距离相关 """
+        while self.depth[a] > self.depth[b]:
+            a = self.idom[a]
+        while self.depth[b] > self.depth[a]:
+            b = self.idom[b]
+        while a != b:
+            a = self.idom[a]
+            b = self.idom[b]
+        return a
+
+
+class _MergeContext:
+    """
+    一组condition节点对应的互斥分支分析数据，整个图只计算一次：
+    虚拟起点连接所有condition节点后的支配树、强连通分量，以及每个分量可以由哪些condition节点到达（最多记录3个）
+    """
+
+    def __init__(self, succ: Dict[str, List[str]], condition_nodes: List[str]):
+        self.source = condition_nodes
+        self.condition_nodes = set(condition_nodes)
+        all_succ = dict(succ)
+        all_succ[_VIRTUAL_SOURCE] = condition_nodes
+        self.tree = _DominatorTree(_immediate_dominators(all_succ, _VIRTUAL_SOURCE), _VIRTUAL_SOURCE)
+
+        nodes = set(succ)
+        for targets in succ.values():
+            nodes.update(targets)
+        self.components = _strongly_connected_components(succ, nodes)
+        self.component_id = {}
+        for i, component in enumerate(self.components):
+            for one in component:
+                self.component_id[one] = i
+        # 逆拓扑序反转后依次向下游传递
+        self.reach_conditions = [set() for _ in self.components]
+        for i in range(len(self.components) - 1, -1, -1):
+            reach = self.reach_conditions[i]
+            for one in self.components[i]:
+                if one in self.condition_nodes and len(reach) < 3:
+                    reach.add(one)
+            for one in self.components[i]:
+                for next_node in succ.get(one, ()):
+                    next_reach = self.reach_conditions[self.component_id[next_node]]
+                    if next_reach is reach:
+                        continue
+                    for condition in reach:
+                        if len(next_reach) >= 3:
+                            break
+                        next_reach.add(condition)
+
+
+class GraphAnalyzer:
+    """
+    工作流拓扑的分析，避免枚举所有路径。节点层级和边数线性相关；
+    扇入节点的互斥判断共用一次全图的支配树计算，每个节点只处理它的前驱和所在的环
+    """
+
+    def __init__(self, edges: EdgeManage):
+        # source: [target]，保留重复的边，同一个condition节点的多个分支可以连接到同一个节点
+        self.succ: Dict[str, List[str]] = {}
+        self.pred: Dict[str, List[str]] = {}
+        for one in edges.edges:
+            self.succ.setdefault(one.source, []).append(one.target)
+            self.pred.setdefault(one.target, []).append(one.source)
+        self._merge_context: Optional[_MergeContext] = None
+
+    def get_node_level(self, start_node: str) -> Dict[str, int]:
+        """
+        计算start节点可达的节点的层级，即从start节点到此节点的最长简单路径，和原先枚举所有路径的结果一致。
+        简单路径经过每个环（强连通分量）时只会连续地经过一段，所以按缩点后的拓扑序依次计算：
+        进入环的节点的层级由上游的环决定，只在环内枚举从这些节点出发的简单路径；无环时和边数线性相关
+        """
+        components = _strongly_connected_components(self.succ, [start_node])
+        component_id = {}
+        for i, component in enumerate(components):
+            for one in component:
+                component_id[one] = i
+        # 从上游的环进入此节点时的最大层级
+        entry_level = {start_node: 0}
+        node_level = {}
+        # 分量是逆拓扑序，从后往前依次向下游传递
+        for i in range(len(components) - 1, -1, -1):
+            component = components[i]
+            if len(component) == 1 and component[0] not in self.succ.get(component[0], ()):
+                node_level[component[0]] = entry_level[component[0]]
+            else:
+                self._cycle_node_level(component_id, i, entry_level, node_level)
+            for one in component:
+                level = node_level[one] + 1
+                for next_node in self.succ.get(one, ()):
+                    if component_id[next_node] != i and entry_level.get(next_node, -1) < level:
+                        entry_level[next_node] = level
+        return node_level
+
+    def _cycle_node_level(self, component_id: Dict[str, int], index: int, entry_level: Dict[str, int],
+                          node_level: Dict[str, int]):
+        """ 从进入环的节点出发，枚举环内的简单路径，更新环内节点的最大层级 """
+        succ = {}
+        for one, i in component_id.items():
+            if i == index:
+                succ[one] = sorted(next_node for next_node in set(self.succ.get(one, ()))
+                                   if component_id[next_node] == index)
+        entries = sorted(one for one in succ if one in entry_level)
+        levels = dict.fromkeys(succ, -1)
+        steps = 0
+        for entry in entries:
+            on_path = {entry}
+            stack = [(entry, entry_level[entry], iter(succ[entry]))]
+            levels[entry] = max(levels[entry], entry_level[entry])
+            while stack:
+                node, level, next_iter = stack[-1]
+                next_node = next(next_iter, None)
+                if next_node is None:
+                    stack.pop()
+                    on_path.discard(node)
+                    continue
+                steps += 1
+                if steps > _MAX_CYCLE_PATH_STEPS:
+                    node_level.update(self._cycle_node_level_without_back_edges(succ, entries, entry_level))
+                    return
+                if next_node in on_path:
+                    continue
+                levels[next_node] = max(levels[next_node], level + 1)
+                on_path.add(next_node)
+                stack.append((next_node, level + 1, iter(succ[next_node])))
+        node_level.update(levels)
+
+    @staticmethod
+    def _cycle_node_level_without_back_edges(succ: Dict[str, List[str]], entries: List[str],
+                                             entry_level: Dict[str, int]) -> Dict[str, int]:
+        """ 环内简单路径过多时，按节点名排序后深度优先遍历，去掉回边取最长路径，结果和边的顺序无关 """
+        all_succ = dict(succ)
+        all_succ[_VIRTUAL_SOURCE] = entries
+        order, back_edges = _reverse_post_order(all_succ, _VIRTUAL_SOURCE)
+        levels = {one: entry_level[one] for one in entries}
+        for node in order[1:]:
+            level = levels[node] + 1
+            for next_node in succ[node]:
+                if (node, next_node) not in back_edges and levels.get(next_node, -1) < level:
+                    levels[next_node] = level
+        return levels
+
+    def _get_merge_context(self, condition_nodes: List[str]) -> _MergeContext:
+        # 调用方每次传入同一个列表，先按对象判断，避免每个扇入节点都要比较一遍所有的condition节点
+        context = self._merge_context
+        if context is None or (context.source is not condition_nodes
+                                and context.condition_nodes != set(condition_nodes)):
+            context = self._merge_context = _MergeContext(self.succ, list(condition_nodes))
+            context.source = condition_nodes
+        return context
+
+    def _condition_node_idom(self, context: _MergeContext, node_id: str) -> Optional[str]:
+        """
+        condition节点本身没有来自虚拟起点的边，去掉此节点后它的前驱的支配关系只在它所在的环内发生变化：
+        环外的前驱沿用全图的支配树，压缩成从公共支配节点出发的树边；环内的节点和边保留，在这个小图上重新计算
+        """
+        tree = context.tree
+        members = context.components[context.component_id[node_id]]
+        inside = set(members)
+        inside.discard(node_id)
+        entries = []
+        for one in inside:
+            if one in context.condition_nodes:
+                entries.append((_VIRTUAL_SOURCE, one))
+        for one in members:
+            for source in self.pred.get(one, ()):
+                if source in tree.depth and context.component_id[source] != context.component_id[node_id]:
+                    entries.append((source, one))
+        if not entries:
+            return None
+
+        root = entries[0][0]
+        for source, _ in entries[1:]:
+            root = tree.common_dominator(root, source)
+        if not inside:
+            return root
+
+        succ = {}
+        walked = {root}
+        for source, target in entries:
+            succ.setdefault(source, []).append(target)
+            while source not in walked:
+                walked.add(source)
+                succ.setdefault(tree.idom[source], []).append(source)
+                source = tree.idom[source]
+        for one in inside:
+            for target in self.succ.get(one, ()):
+                if target in inside or target == node_id:
+                    succ.setdefault(one, []).append(target)
+        return _immediate_dominators(succ, root).get(node_id)
+
+    def is_exclusive_merge_node(self, node_id: str, condition_nodes: Iterable[str]) -> bool:
+        """
+        判断节点是否是互斥分支的收尾节点：
+        是否存在从condition节点（可以是不同的condition节点）到此节点的两条路径，除去起止节点外没有公共节点
+        虚拟起点连接所有condition节点（此节点除外），此节点的直接支配节点是虚拟起点时，由Menger定理一定存在这样的两条路径；
+        直接支配节点是某个condition节点时，所有路径都经过它，它和此节点之间没有直连的边时同样由Menger定理一定存在，
+        有直连的边时这条分支没有中间节点，只要还有其他分支即可；其他情况所有路径都有公共节点
+        """
+        context = self._get_merge_context(condition_nodes)
+        if not context.condition_nodes or context.condition_nodes == {node_id}:
+            return False
+        tree = context.tree
+        if node_id in context.condition_nodes:
+            idom = self._condition_node_idom(context, node_id)
+        else:
+            idom = tree.idom.get(node_id)
+        if idom is None:
+            # 没有condition节点可以到达此节点
+            return False
+        if idom == _VIRTUAL_SOURCE:
+            return True
+        if idom not in context.condition_nodes:
+            return False
+
+        direct_edge_num = self.succ.get(idom, []).count(node_id)
+        if direct_edge_num != 1:
+            return True
+        # 其他condition节点可以到达此节点
+        reach = context.reach_conditions[context.component_id[node_id]]
+        if len(reach) >= 3 or any(one != idom and one != node_id for one in reach):
+            return True
+        # 不经过直连的边，从condition节点到达此节点：存在不需要经过此节点就能到达的其他前驱
+        for one in self.pred.get(node_id, ()):
+            if one != idom and one != node_id and one in tree.depth and not tree.dominates(node_id, one):
+                return True
+        return False
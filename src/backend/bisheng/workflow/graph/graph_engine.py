@@ -1,7 +1,7 @@
+import copy
 import operator
 from typing import Annotated, Any, Dict
 
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.constants import END, START
 from langgraph.graph import StateGraph
 from loguru import logger
@@ -13,7 +13,10 @@ from bisheng.workflow.callback.event import UserInputData
 from bisheng.workflow.common.node import BaseNodeData, NodeType
 from bisheng.workflow.common.workflow import WorkflowStatus
 from bisheng.workflow.edges.edges import EdgeManage
+from bisheng.workflow.graph.checkpoint import WorkflowCheckpointSaver
+from bisheng.workflow.graph.graph_analysis import GraphAnalyzer
 from bisheng.workflow.graph.graph_state import GraphState
+from bisheng.workflow.graph.plan import GraphPlan
 from bisheng.workflow.nodes.base import BaseNode
 from bisheng.workflow.nodes.node_manage import NodeFactory
 from bisheng.workflow.nodes.output.output_fake import OutputFakeNode
@@ -32,10 +35,14 @@ class GraphEngine:
                  workflow_data: Dict = None,
                  async_mode: bool = False,
                  max_steps: int = 0,
-                 callback: BaseCallback = None):
+                 callback: BaseCallback = None,
+                 plan: GraphPlan = None):
         self.user_id = user_id
         self.workflow_id = workflow_id
-        self.workflow_data = workflow_data
+        # 复用已解析的拓扑信息时，节点的配置需要复制一份，避免运行时的修改影响其他运行
+        self.plan_reused = plan is not None
+        self.plan = plan or GraphPlan(workflow_data)
+        self.workflow_data = self.plan.workflow_data
         self.max_steps = max_steps
         self.async_mode = async_mode
         # 回调
@@ -59,6 +66,7 @@ class GraphEngine:
         # init langgraph state graph
         self.graph_builder = StateGraph(TempState)
         self.graph = None
+        self.checkpointer = WorkflowCheckpointSaver()
         self.graph_config = {'configurable': {'thread_id': '1'}, 'recursion_limit': 50}
 
         self.status = WorkflowStatus.RUNNING.value
@@ -69,7 +77,8 @@ class GraphEngine:
 
     def build_edges(self):
         # init edges
-        self.edges = EdgeManage(self.workflow_data.get('edges', []))
+        self.edges: EdgeManage = self.plan.edges
+        self.graph_analyzer = GraphAnalyzer(self.edges)
 
     def add_node_edge(self, node_instance: BaseNode):
         """  把节点的边链接起来  """
@@ -119,7 +128,9 @@ class GraphEngine:
             if not source_ids or len(source_ids) <= 1:
                 continue
             # 有多个扇入节点，判断此节点是否需要等待
-            wait_nodes, no_wait_nodes = self.parse_fan_in_node(node_id)
+            if node_id not in self.plan.fan_in_edges:
+                self.plan.fan_in_edges[node_id] = self.parse_fan_in_node(node_id)
+            wait_nodes, no_wait_nodes = self.plan.fan_in_edges[node_id]
             logger.debug(f'node {node_id} wait nodes {wait_nodes}, no wait nodes {no_wait_nodes}')
             if wait_nodes:
                 self.graph_builder.add_edge(wait_nodes, node_id)
@@ -142,28 +153,8 @@ class GraphEngine:
             return [], [one for one in source_ids if not one.startswith(('output_', 'condition_'))]
 
         # 判断是否存在从condition节点或者output节点（选择型交互）到此节点的 两条不重复的路径
-        all_branches = []
-        for one in self.condition_nodes:
-            if node_id == one:
-                continue
-            branches = self.edges.get_all_edges_nodes(one, node_id)
-            for branch in branches:
-                if node_id not in branch:
-                    continue
-                branch.remove(node_id)
-                branch.remove(one)
-                all_branches.append(branch)
-
-        def judge_not_same_branch():
-            # 判断所有边中是否存在两条不重复的路径
-            for i in range(len(all_branches)):
-                for j in range(i + 1, len(all_branches)):
-                    if not (set(all_branches[i]) & set(all_branches[j])):
-                        return True
-            return False
-
         # 说明是互斥收尾节点，不需要等待
-        if judge_not_same_branch():
+        if self.graph_analyzer.is_exclusive_merge_node(node_id, self.condition_nodes):
             return [], [one for one in source_ids if not one.startswith(('output_', 'condition_'))]
 
         # 说明不是互斥收尾节点，需要等待所有前驱节点执行完毕再执行
@@ -176,24 +167,12 @@ class GraphEngine:
 
     def build_node_level(self, start_node: str):
         """ 计算所有节点的层级 """
-
-        # 标记节点的层级
-        def mark_node_level(node_id, node_map: dict, level: int):
-            # 已经遍历过的节点不再遍历，说明成环了
-            if node_id in node_map:
-                return
-            self.node_level[node_id] = max(self.node_level.get(node_id, 0), level)
-            node_map[node_id] = True
-            next_nodes = self.edges.get_target_node(node_id)
-            if not next_nodes:
-                return
-
-            for one_node in next_nodes:
-                tmp_node_map = node_map.copy()
-                mark_node_level(one_node, tmp_node_map, level + 1)
+        if self.plan.node_level:
+            self.node_level = self.plan.node_level
             return
 
-        mark_node_level(start_node, {}, 0)
+        self.node_level = self.graph_analyzer.get_node_level(start_node)
+        self.plan.node_level = self.node_level
 
     def init_nodes(self, nodes):
         """ return node id """
@@ -201,7 +180,10 @@ class GraphEngine:
         end_nodes = []
         interrupt_nodes = []
         for node in nodes:
-            node_data = BaseNodeData(**node.get('data', {}))
+            node_data = node.get('data', {})
+            if self.plan_reused:
+                node_data = copy.deepcopy(node_data)
+            node_data = BaseNodeData(**node_data)
             if not node_data.id:
                 raise Exception('node must have attribute id')
             if node_data.type == NodeType.NOTE.value:
@@ -221,8 +203,10 @@ class GraphEngine:
             self.nodes_map[node_data.id] = node_instance
             self.nodes_fan_in[node_instance.id] = self.edges.get_source_node(node_instance.id)
             if node_instance.type not in [NodeType.START.value]:
-                self.nodes_next_nodes[node_instance.id] = self.edges.get_next_nodes(
-                    node_instance.id)
+                if node_instance.id not in self.plan.nodes_next_nodes:
+                    self.plan.nodes_next_nodes[node_instance.id] = self.edges.get_next_nodes(
+                        node_instance.id)
+                self.nodes_next_nodes[node_instance.id] = self.plan.nodes_next_nodes[node_instance.id]
 
             # add node into langgraph
             if self.async_mode:
@@ -272,7 +256,7 @@ class GraphEngine:
         self.build_more_fan_in_node()
 
         # compile langgraph
-        self.graph = self.graph_builder.compile(checkpointer=MemorySaver(),
+        self.graph = self.graph_builder.compile(checkpointer=self.checkpointer,
                                                 interrupt_before=interrupt_nodes)
         self.graph_config['recursion_limit'] = max(
             (len(nodes) - len(end_nodes) - 1) * self.max_steps, 1) + len(end_nodes) + 1
@@ -379,6 +363,31 @@ class GraphEngine:
                     self.status = WorkflowStatus.INPUT.value
                     return
 
+    def dump_checkpoint(self) -> Dict:
+        """ 导出引擎的运行状态，包含langgraph的checkpoint、全局变量和节点的运行状态 """
+        return {
+            'status': self.status,
+            'reason': self.reason,
+            'checkpoint': self.checkpointer.dump(),
+            'graph_state': self.graph_state.dump_state(),
+            'nodes': {
+                node_id: node_instance.dump_state()
+                for node_id, node_instance in self.nodes_map.items() if isinstance(node_instance, BaseNode)
+            },
+        }
+
+    def load_checkpoint(self, data: Dict):
+        """ 导入 dump_checkpoint 导出的运行状态，需要保证引擎是由同一份workflow_data构建的 """
+        self.status = data['status']
+        self.reason = data['reason']
+        self.checkpointer.load(data['checkpoint'])
+        self.graph_state.load_state(data['graph_state'])
+        for node_id, node_state in data['nodes'].items():
+            node_instance = self.nodes_map.get(node_id)
+            if node_instance is None:
+                raise IgnoreException(f'{node_id} -- workflow node is update')
+            node_instance.load_state(node_state)
+
     def stop(self):
         for _, node_instance in self.nodes_map.items():
             node_instance.stop()
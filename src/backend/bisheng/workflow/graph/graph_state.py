@@ -95,6 +95,18 @@ class GraphState(BaseModel):
             value = old_value
         self.set_variable(node_id, var_key, value)
 
+    def dump_state(self) -> Dict[str, Any]:
+        """ 导出全局状态，用于持久化等待输入的workflow """
+        return {
+            'variables_pool': self.variables_pool,
+            'history_memory': self.history_memory,
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """ 导入 dump_state 导出的全局状态 """
+        self.variables_pool = state.get('variables_pool', {})
+        self.history_memory = state.get('history_memory')
+
     def get_all_variables(self) -> Dict[str, Any]:
         """ 获取所有的变量，key为node_id.key的格式 """
         ret = {}
@@ -0,0 +1,48 @@
+import hashlib
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from bisheng.workflow.edges.edges import EdgeManage
+
+
+class GraphPlan:
+    """
+    工作流解析后的拓扑信息：边、节点层级、扇入节点的等待关系等
+    只和工作流的内容有关，和单次运行无关，同一个worker内相同版本的工作流多次运行时直接复用，
+    每次运行只需要重新实例化节点
+    """
+
+    def __init__(self, workflow_data: Dict):
+        self.workflow_data = workflow_data
+        self.edges = EdgeManage(workflow_data.get('edges', []))
+
+        # node_id: 从start节点到此节点的最长路径
+        self.node_level: Dict[str, int] = {}
+        # node_id: 所有的下游节点
+        self.nodes_next_nodes: Dict[str, List[str]] = {}
+        # node_id: (需要等待的前驱节点, 不需要等待的前驱节点)
+        self.fan_in_edges: Dict[str, Tuple[List[str], List[str]]] = {}
+
+
+def get_workflow_data_hash(workflow_data: Dict) -> str:
+    """ 工作流内容的hash，内容不变hash就不变 """
+    return hashlib.sha256(json.dumps(workflow_data, sort_keys=True, ensure_ascii=False,
+                                     default=str).encode('utf-8')).hexdigest()
+
+
+# (workflow_id, version_id, data_hash): GraphPlan
+_graph_plan_cache: LRUCache = LRUCache(maxsize=128)
+_graph_plan_lock = threading.Lock()
+
+
+def get_graph_plan(key: Tuple) -> Optional[GraphPlan]:
+    with _graph_plan_lock:
+        return _graph_plan_cache.get(key)
+
+
+def set_graph_plan(key: Tuple, plan: GraphPlan):
+    with _graph_plan_lock:
+        _graph_plan_cache[key] = plan
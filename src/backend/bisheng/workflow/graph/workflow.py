@@ -5,6 +5,7 @@ from typing import Dict
 from bisheng.workflow.callback.base_callback import BaseCallback
 from bisheng.workflow.common.workflow import WorkflowStatus
 from bisheng.workflow.graph.graph_engine import GraphEngine
+from bisheng.workflow.graph.plan import GraphPlan
 
 
 class Workflow:
@@ -16,7 +17,8 @@ class Workflow:
                  async_mode: bool = False,
                  max_steps: int = 0,
                  timeout: int = 0,
-                 callback: BaseCallback = None):
+                 callback: BaseCallback = None,
+                 plan: GraphPlan = None):
 
         # 运行的唯一标识，保存到数据库的唯一ID
         self.workflow_id = workflow_id
@@ -31,7 +33,13 @@ class Workflow:
                                         workflow_id=workflow_id,
                                         workflow_data=workflow_data,
                                         max_steps=max_steps,
-                                        callback=callback)
+                                        callback=callback,
+                                        plan=plan)
+
+    @property
+    def plan(self) -> GraphPlan:
+        """ 工作流解析后的拓扑信息，相同内容的工作流可以复用 """
+        return self.graph_engine.plan
 
     def save_user_input_history(self, input_data: dict | None):
         if not input_data:
@@ -79,6 +87,17 @@ class Workflow:
             await self.graph_engine.acontinue_run()
         return self.graph_engine.status, self.graph_engine.reason
 
+    def dump_checkpoint(self) -> Dict:
+        """ 导出等待输入的workflow的运行状态，可以在其他进程中通过 load_checkpoint 恢复执行 """
+        return {
+            'current_time': self.current_time,
+            'graph_engine': self.graph_engine.dump_checkpoint(),
+        }
+
+    def load_checkpoint(self, data: Dict):
+        self.current_time = data.get('current_time')
+        self.graph_engine.load_checkpoint(data['graph_engine'])
+
     def stop(self):
         self.graph_engine.stop()
 
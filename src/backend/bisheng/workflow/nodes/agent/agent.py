@@ -72,6 +72,8 @@ class AgentNode(BaseNode):
         # 聊天消息
         self._chat_history_flag = self.node_params['chat_history_flag']['value'] > 0
         self._chat_history_num = self.node_params['chat_history_flag']['value']
+        # 历史消息和本次输入的最大token数，超出后从最早的历史消息开始丢弃；未配置时不裁剪
+        self._max_token = self.node_params.get('max_token')
 
         self._llm = LLMService.get_bisheng_llm(model_id=self.node_params['model_id'],
                                                temperature=self.node_params.get(
@@ -424,6 +426,8 @@ class AgentNode(BaseNode):
         }])
         human_message = self.contact_file_into_prompt(human_message, self._image_prompt)
         chat_history.append(human_message)
+        if self._max_token:
+            chat_history = AssistantAgent.cl100k_token_counter().trim_messages(chat_history, int(self._max_token))
         logger.debug(f'agent invoke chat_history: {chat_history}')
 
         if self._agent_executor_type == 'ReAct':
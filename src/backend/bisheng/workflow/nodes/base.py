@@ -172,6 +172,22 @@ class BaseNode(ABC):
                 })
         return human_message
 
+    def dump_state(self) -> Dict[str, Any]:
+        """ 导出节点的运行状态，用于持久化等待输入的workflow，节点有额外的运行状态需要自己补充 """
+        return {
+            'current_step': self.current_step,
+            'exec_unique_id': self.exec_unique_id,
+            'node_params': self.node_params,
+            'other_node_variable': self.other_node_variable,
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """ 导入 dump_state 导出的节点运行状态 """
+        self.current_step = state.get('current_step', 0)
+        self.exec_unique_id = state.get('exec_unique_id')
+        self.node_params = state.get('node_params', self.node_params)
+        self.other_node_variable = state.get('other_node_variable', {})
+
     def run(self, state: dict) -> Any:
         """
         Run node entry
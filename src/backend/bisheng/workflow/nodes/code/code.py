@@ -1,7 +1,9 @@
 from typing import Any
 
+from bisheng.settings import settings
 from bisheng.workflow.nodes.base import BaseNode
 from bisheng.workflow.nodes.code.code_parse import CodeParser
+from bisheng.workflow.nodes.code.sandbox import CodeSandboxError, get_code_sandbox_pool
 
 
 class CodeNode(BaseNode):
@@ -13,6 +15,7 @@ class CodeNode(BaseNode):
         self._code_output = self.node_params['code_output']
 
         self._code_parser = CodeParser(self._code)
+        self._sandbox_conf = settings.get_workflow_conf().code_sandbox
 
         self._parse_code()
 
@@ -24,14 +27,25 @@ class CodeNode(BaseNode):
 
     def _parse_code(self):
         try:
-            self._code_parser.parse_code()
+            if self._sandbox_conf.enabled:
+                # 只校验语法，导入和执行在沙箱进程内进行
+                self._code_parser.get_tree()
+            else:
+                self._code_parser.parse_code()
         except Exception as e:
             raise Exception(f"CodeNode {self.name} exec code error: " + str(e))
 
     def _run(self, unique_id: str):
         main_params = self._parse_code_input()
 
-        main_ret = self._code_parser.exec_method('main', **main_params)
+        if self._sandbox_conf.enabled:
+            try:
+                main_ret = get_code_sandbox_pool(self._sandbox_conf).exec_method(self._code_parser.code, 'main',
+                                                                                 main_params)
+            except CodeSandboxError as e:
+                raise Exception(f"CodeNode {self.name} exec code error: " + str(e))
+        else:
+            main_ret = self._code_parser.exec_method('main', **main_params)
         main_ret = self._parse_code_output(main_ret)
 
         return main_ret
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from bisheng.settings import CodeSandboxConf
+
+SANDBOX_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'sandbox_worker.py')
+# 执行期间检查沙箱进程内存的间隔
+CHECK_INTERVAL = 0.2
+
+
+class CodeSandboxError(Exception):
+    def __init__(self, message: str, fatal: bool = False):
+        super().__init__(message)
+        # 超时、内存超限或者进程退出，沙箱进程不能再复用
+        self.fatal = fatal
+
+
+def get_process_rss(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return 0
+
+
+class SandboxProcess:
+    """ 一个沙箱子进程，记录已经发送过的代码，相同的代码只发送hash """
+
+    def __init__(self):
+        command_read, command_write = os.pipe()
+        result_read, result_write = os.pipe()
+        try:
+            self.process = subprocess.Popen([sys.executable, SANDBOX_SCRIPT, str(command_read), str(result_write)],
+                                            pass_fds=(command_read, result_write),
+                                            stdin=subprocess.DEVNULL,
+                                            start_new_session=True)
+        finally:
+            os.close(command_read)
+            os.close(result_write)
+        self._command = os.fdopen(command_write, 'w', encoding='utf-8')
+        self._result_fd = result_read
+        self._buffer = b''
+        self.code_hashes = set()
+        self.calls = 0
+        self.rss = 0
+        self.closed = False
+
+    def is_alive(self) -> bool:
+        return not self.closed and self.process.poll() is None
+
+    def _send(self, command: Dict):
+        self._command.write(json.dumps(command, ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+        self._command.flush()
+
+    def _read_line(self, timeout: float, memory_limit: int) -> Dict:
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise CodeSandboxError(f'exec timeout after {timeout}s', fatal=True)
+            readable, _, _ = select.select([self._result_fd], [], [], min(remaining, CHECK_INTERVAL))
+            if not readable:
+                if memory_limit and get_process_rss(self.process.pid) > memory_limit:
+                    raise CodeSandboxError(f'exceed memory limit {memory_limit // 1024 // 1024}MB', fatal=True)
+                continue
+            chunk = os.read(self._result_fd, 65536)
+            if not chunk:
+                raise CodeSandboxError('sandbox process exited unexpectedly', fatal=True)
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return json.loads(line)
+
+    def exec_method(self, code: str, code_hash: str, method: str, kwargs: Dict, timeout: float,
+                    memory_limit: int) -> Any:
+        command = {'hash': code_hash, 'method': method, 'kwargs': kwargs}
+        if code_hash not in self.code_hashes:
+            command['code'] = code
+        self._send(command)
+        response = self._read_line(timeout, memory_limit)
+        if response.get('missing'):
+            # 沙箱内的缓存已经淘汰，重新发送代码
+            command['code'] = code
+            self._send(command)
+            response = self._read_line(timeout, memory_limit)
+        self.calls += 1
+        self.rss = response.get('rss', 0)
+        if response.get('stage') != 'parse':
+            self.code_hashes.add(code_hash)
+        if 'error' in response:
+            raise CodeSandboxError(response['error'])
+        return response.get('result')
+
+    def kill(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                self.process.kill()
+        self.process.wait()
+        for one in (self._command.close, lambda: os.close(self._result_fd)):
+            try:
+                one()
+            except OSError:
+                pass
+
+
+class CodeSandboxPool:
+    """
+    代码节点的沙箱进程池，用户代码在子进程内执行，不阻塞worker也不影响worker的内存
+    超时、内存超限或者异常退出的沙箱进程直接结束，下次使用时重新创建
+    """
+
+    def __init__(self, conf: CodeSandboxConf):
+        self.conf = conf
+        self._idle: List[SandboxProcess] = []
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max(conf.pool_size, 1))
+        self.closed = False
+
+    def _acquire(self) -> SandboxProcess:
+        self._semaphore.acquire()
+        try:
+            with self._lock:
+                while self._idle:
+                    one = self._idle.pop()
+                    if one.is_alive():
+                        return one
+                    one.kill()
+            return SandboxProcess()
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    def _release(self, sandbox: SandboxProcess, broken: bool):
+        try:
+            if self.closed or broken or not sandbox.is_alive() or sandbox.calls >= self.conf.max_calls \
+                    or sandbox.rss > self.conf.memory_limit * 1024 * 1024:
+                sandbox.kill()
+            else:
+                with self._lock:
+                    self._idle.append(sandbox)
+        finally:
+            self._semaphore.release()
+
+    def close(self):
+        """ 结束空闲的沙箱进程，使用中的在归还时结束 """
+        self.closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for one in idle:
+            one.kill()
+
+    def exec_method(self, code: str, method: str, kwargs: Dict) -> Any:
+        code_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
+        sandbox = self._acquire()
+        broken = False
+        try:
+            return sandbox.exec_method(code, code_hash, method, kwargs, self.conf.timeout,
+                                       self.conf.memory_limit * 1024 * 1024)
+        except CodeSandboxError as e:
+            # 用户代码本身的异常沙箱进程仍然可用
+            broken = e.fatal
+            if e.fatal:
+                logger.warning(f'kill code sandbox pid={sandbox.process.pid}: {e}')
+            raise
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self._release(sandbox, broken)
+
+
+_code_sandbox_pool: Optional[CodeSandboxPool] = None
+_code_sandbox_lock = threading.Lock()
+
+
+def get_code_sandbox_pool(conf: CodeSandboxConf) -> CodeSandboxPool:
+    """ 进程内共享的沙箱进程池，配置变化后重新创建 """
+    global _code_sandbox_pool
+    with _code_sandbox_lock:
+        if _code_sandbox_pool is None or _code_sandbox_pool.conf != conf:
+            if _code_sandbox_pool is not None:
+                _code_sandbox_pool.close()
+            _code_sandbox_pool = CodeSandboxPool(conf)
+        return _code_sandbox_pool
@@ -0,0 +1,80 @@
+"""
+代码节点的沙箱执行进程，由sandbox.py启动：
+    python sandbox_worker.py <command_fd> <result_fd>
+按行读取json格式的请求，解析后的代码按hash缓存，结果按行写入result_fd。
+不导入bisheng包，只按文件路径加载同目录下的code_parse.py
+"""
+import importlib.util
+import json
+import os
+import sys
+import traceback
+from collections import OrderedDict
+
+# 进程内缓存的已解析代码数
+MAX_CACHED_CODE = 64
+
+
+def load_code_parser():
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'code_parse.py')
+    spec = importlib.util.spec_from_file_location('bisheng_code_parse', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.CodeParser
+
+
+def get_rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return 0
+
+
+def handle(code_parser_class, cache: OrderedDict, command: dict) -> dict:
+    code_hash = command['hash']
+    parser = cache.get(code_hash)
+    if parser is None:
+        if command.get('code') is None:
+            return {'missing': True}
+        parser = code_parser_class(command['code'])
+        try:
+            parser.parse_code()
+        except BaseException as e:
+            return {'error': f'exec code error: {e}', 'stage': 'parse'}
+        cache[code_hash] = parser
+        if len(cache) > MAX_CACHED_CODE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(code_hash)
+
+    try:
+        result = parser.exec_method(command['method'], **command['kwargs'])
+    except BaseException as e:
+        traceback.print_exc()
+        return {'error': f'{type(e).__name__}: {e}'}
+    return {'result': result}
+
+
+def main():
+    command_file = os.fdopen(int(sys.argv[1]), 'r', encoding='utf-8')
+    result_file = os.fdopen(int(sys.argv[2]), 'w', encoding='utf-8')
+    code_parser_class = load_code_parser()
+    cache = OrderedDict()
+    for line in command_file:
+        if not line.strip():
+            continue
+        response = handle(code_parser_class, cache, json.loads(line))
+        response['rss'] = get_rss()
+        try:
+            # 无法json序列化的值转为字符串
+            data = json.dumps(response, ensure_ascii=False, separators=(',', ':'), default=str)
+        except (TypeError, ValueError) as e:
+            data = json.dumps({'error': f'main function output is not json serializable: {e}', 'rss': get_rss()},
+                              ensure_ascii=False)
+        result_file.write(data + '\n')
+        result_file.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import json
-from typing import Any
+from typing import Any, Dict
 
 from bisheng.utils.minio_client import MinioClient
 from bisheng.workflow.callback.event import OutputMsgChooseData, OutputMsgData, OutputMsgInputData
@@ -44,6 +44,23 @@ class OutputNode(BaseNode):
         self._handled_output_result = user_input['output_result']
         self.graph_state.set_variable(self.id, 'output_result', user_input['output_result'])
 
+    def dump_state(self) -> Dict[str, Any]:
+        state = super().dump_state()
+        state.update({
+            'handled_output_result': self._handled_output_result,
+            'parsed_output_msg': self._parsed_output_msg,
+            'parsed_files': self._parsed_files,
+            'source_documents': self._source_documents,
+        })
+        return state
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        super().load_state(state)
+        self._handled_output_result = state.get('handled_output_result', self._output_result)
+        self._parsed_output_msg = state.get('parsed_output_msg', '')
+        self._parsed_files = state.get('parsed_files', [])
+        self._source_documents = state.get('source_documents', [])
+
     def get_input_schema(self) -> Any:
         # 说明不需要交互
         if self._output_type not in ['input', 'choose']:
@@ -0,0 +1,220 @@
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+KERNEL_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'kernel_worker.py')
+# 执行进程启动并导入常用库的超时时间
+KERNEL_START_TIMEOUT = 120
+
+
+class Kernel:
+    """
+    一个常驻的python执行进程，通过两个管道和kernel_worker.py通信，代码在同一个命名空间内执行
+    """
+
+    def __init__(self):
+        command_read, command_write = os.pipe()
+        result_read, result_write = os.pipe()
+        try:
+            self.process = subprocess.Popen([sys.executable, KERNEL_SCRIPT, str(command_read), str(result_write)],
+                                            pass_fds=(command_read, result_write),
+                                            stdin=subprocess.DEVNULL,
+                                            stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL,
+                                            start_new_session=True)
+        finally:
+            os.close(command_read)
+            os.close(result_write)
+        self._command = os.fdopen(command_write, 'w', encoding='utf-8')
+        self._result_fd = result_read
+        self._buffer = b''
+        self.ready = False
+        self.closed = False
+        # 管道已关闭，进程已经退出
+        self.exited = False
+        # 执行期间持有，避免被回收
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.rss = 0
+        self.last_used = time.monotonic()
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _read_line(self, timeout: float) -> Optional[Dict]:
+        """ 读取一行执行结果，超时或者进程退出返回None """
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([self._result_fd], [], [], remaining)
+            if not readable:
+                return None
+            chunk = os.read(self._result_fd, 65536)
+            if not chunk:
+                self.exited = True
+                return None
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return json.loads(line)
+
+    def execute(self, code: str, filename: str, work_dir: str, timeout: float) -> Optional[Dict]:
+        """ 返回 {'exitcode', 'stdout', 'stderr', 'rss'}，超时或者进程异常退出返回None """
+        with self.lock:
+            return self._execute(code, filename, work_dir, timeout)
+
+    def _execute(self, code: str, filename: str, work_dir: str, timeout: float) -> Optional[Dict]:
+        if self.closed:
+            return None
+        self.last_used = time.monotonic()
+        try:
+            if not self.ready:
+                if self._read_line(KERNEL_START_TIMEOUT) is None:
+                    return None
+                self.ready = True
+            self._command.write(json.dumps({'code': code, 'filename': filename, 'work_dir': work_dir},
+                                           ensure_ascii=False) + '\n')
+            self._command.flush()
+            result = self._read_line(timeout)
+            if result is not None:
+                self.runs += 1
+                self.rss = result.get('rss', 0)
+            return result
+        except (OSError, ValueError) as e:
+            logger.warning(f'code kernel execute error: {e}')
+            return None
+        finally:
+            self.last_used = time.monotonic()
+
+    def kill(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.is_alive():
+            try:
+                # 同时结束用户代码启动的子进程
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                self.process.kill()
+        self.process.wait()
+        for one in (self._command.close, lambda: os.close(self._result_fd)):
+            try:
+                one()
+            except OSError:
+                pass
+
+
+class KernelPool:
+    """
+    预先启动的执行进程池，执行进程在首次使用时才开始预热
+    租出去的进程只属于一个会话，不会再放回池中，长时间未使用的会被回收
+    """
+
+    def __init__(self, warm_size: int = 1, idle_timeout: int = 1800):
+        self.warm_size = warm_size
+        self.idle_timeout = idle_timeout
+        self._idle: List[Kernel] = []
+        self._leased: List[Kernel] = []
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+
+    def acquire(self) -> Kernel:
+        with self._lock:
+            kernel = None
+            while self._idle:
+                one = self._idle.pop(0)
+                if one.is_alive():
+                    kernel = one
+                    break
+                one.kill()
+            if kernel is None:
+                kernel = Kernel()
+            self._leased.append(kernel)
+            # 补充预热的进程，导入依赖库在子进程内完成，不会阻塞这里
+            while len(self._idle) < self.warm_size:
+                self._idle.append(Kernel())
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep, name='code-kernel-sweeper', daemon=True)
+                self._sweeper.start()
+        return kernel
+
+    def release(self, kernel: Kernel):
+        """ 会话结束或者进程需要回收，执行过用户代码的进程直接结束 """
+        with self._lock:
+            if kernel in self._leased:
+                self._leased.remove(kernel)
+        kernel.kill()
+
+    def _sweep(self):
+        while True:
+            time.sleep(min(60, self.idle_timeout))
+            now = time.monotonic()
+            with self._lock:
+                leased = list(self._leased)
+            for one in leased:
+                # 正在执行的进程跳过
+                if not one.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if now - one.last_used >= self.idle_timeout or not one.is_alive():
+                        logger.debug(f'recycle idle code kernel pid={one.process.pid}')
+                        self.release(one)
+                finally:
+                    one.lock.release()
+
+
+kernel_pool = KernelPool()
+
+
+class KernelLease:
+    """
+    一个会话租用的执行进程，多次执行之间变量保留，执行次数或者内存超出限制后更换新的进程
+    """
+
+    def __init__(self, pool: KernelPool = kernel_pool, max_runs: int = 100, memory_limit: int = 2048):
+        """ memory_limit: 执行进程的内存上限，单位MB """
+        self.pool = pool
+        self.max_runs = max_runs
+        self.memory_limit = memory_limit * 1024 * 1024
+        self.kernel: Optional[Kernel] = None
+        self._lock = threading.Lock()
+
+    def execute(self, code: str, filename: str, work_dir: str, timeout: float) -> Optional[Dict]:
+        """ 执行超时返回None，超时的进程会被结束，下次执行时更换新的进程 """
+        with self._lock:
+            if self.kernel is not None and not self.kernel.is_alive():
+                self.pool.release(self.kernel)
+                self.kernel = None
+            if self.kernel is None:
+                self.kernel = self.pool.acquire()
+            kernel = self.kernel
+            result = kernel.execute(code, filename, work_dir, timeout)
+            if result is None and (kernel.exited or not kernel.is_alive()):
+                # 进程异常退出（如被系统OOM结束），不是执行超时
+                try:
+                    returncode = kernel.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    returncode = 1
+                result = {'exitcode': returncode or 1, 'stdout': '', 'stderr': 'Kernel died unexpectedly', 'rss': 0}
+            if result is None or kernel.runs >= self.max_runs or kernel.rss > self.memory_limit \
+                    or not kernel.is_alive():
+                if result is not None:
+                    logger.debug(f'recycle code kernel runs={kernel.runs} rss={kernel.rss}')
+                self.pool.release(kernel)
+                self.kernel = None
+            return result
+
+    def close(self):
+        with self._lock:
+            if self.kernel is not None:
+                self.pool.release(self.kernel)
+                self.kernel = None
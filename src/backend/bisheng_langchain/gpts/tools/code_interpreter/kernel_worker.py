@@ -0,0 +1,108 @@
+"""
+代码解释器的常驻执行进程，由kernel_pool启动：
+    python kernel_worker.py <command_fd> <result_fd>
+从command_fd按行读取json格式的执行请求，代码在同一个命名空间内执行，变量在多次执行之间保留，
+执行结果按行写入result_fd。脚本不依赖bisheng的任何模块，启动时预先导入常用的数据分析库
+"""
+import glob
+import json
+import linecache
+import os
+import sys
+import tempfile
+import traceback
+
+
+def preload():
+    try:
+        import matplotlib
+        # 删除字体缓存，重新加载系统内的中文字体
+        for cache in glob.glob(f'{matplotlib.get_cachedir()}/fontlist*'):
+            os.remove(cache)
+        matplotlib.use('Agg')
+        matplotlib.rc('font', family='WenQuanYi Zen Hei')
+        import matplotlib.pyplot  # noqa: F401
+    except Exception:
+        pass
+    try:
+        import numpy  # noqa: F401
+        import pandas  # noqa: F401
+    except Exception:
+        pass
+
+
+def get_rss() -> int:
+    """ 当前进程占用的物理内存，单位字节 """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_code(namespace: dict, code: str, filename: str, work_dir: str) -> (int, str, str):
+    os.chdir(work_dir)
+    sys.path[0] = work_dir
+    # 在文件描述符层面重定向输出，子进程和C扩展的输出也能拿到
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved = os.dup(1), os.dup(2)
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        exitcode = 0
+        try:
+            namespace['__file__'] = os.path.join(work_dir, filename)
+            # 代码没有写入文件，放到linecache中异常堆栈才能显示出错的代码行
+            linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+            exec(compile(code, filename, 'exec'), namespace)
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                exitcode = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                exitcode = 1
+        except BaseException as e:
+            # 去掉执行进程本身的调用栈
+            traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+            exitcode = 1
+        finally:
+            # 未关闭的图像不带到下一次执行
+            if 'matplotlib.pyplot' in sys.modules:
+                try:
+                    sys.modules['matplotlib.pyplot'].close('all')
+                except Exception:
+                    pass
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+        out.seek(0)
+        err.seek(0)
+        return (exitcode, out.read().decode('utf-8', errors='replace'),
+                err.read().decode('utf-8', errors='replace'))
+
+
+def main():
+    command_file = os.fdopen(int(sys.argv[1]), 'r', encoding='utf-8')
+    result_file = os.fdopen(int(sys.argv[2]), 'w', encoding='utf-8')
+    preload()
+    result_file.write(json.dumps({'ready': True, 'rss': get_rss()}) + '\n')
+    result_file.flush()
+
+    namespace = {'__name__': '__main__', '__builtins__': __builtins__}
+    for line in command_file:
+        if not line.strip():
+            continue
+        command = json.loads(line)
+        exitcode, stdout, stderr = run_code(namespace, command['code'], command['filename'], command['work_dir'])
+        result_file.write(json.dumps({'exitcode': exitcode, 'stdout': stdout, 'stderr': stderr,
+                                      'rss': get_rss()}, ensure_ascii=False) + '\n')
+        result_file.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,7 @@ import matplotlib
 from loguru import logger
 
 from bisheng_langchain.gpts.tools.code_interpreter.base_executor import BaseExecutor
+from bisheng_langchain.gpts.tools.code_interpreter.kernel_pool import KernelLease
 
 CODE_BLOCK_PATTERN = r"```(\w*)\n(.*?)\n```"
 DEFAULT_TIMEOUT = 600
@@ -41,6 +42,11 @@ class LocalExecutor(BaseExecutor):
     def __init__(self, minio: dict = None, **kwargs):
         super().__init__(minio, **kwargs)
         self.minio = minio
+        # python代码在常驻的执行进程内运行，同一个会话多次执行之间变量保留
+        self.kernel_lease = None
+        if kwargs.get('keep_kernel', True) and not WIN32:
+            self.kernel_lease = KernelLease(max_runs=kwargs.get('kernel_max_runs', 100),
+                                            memory_limit=kwargs.get('kernel_memory_limit', 2048))
 
     @property
     def description(self) -> str:
@@ -212,13 +218,34 @@ class LocalExecutor(BaseExecutor):
             if filepath is not None:
                 os.remove(filepath)
 
+    def use_kernel(self, lang: str) -> bool:
+        return self.kernel_lease is not None and lang.startswith('python')
+
+    def execute_in_kernel(self, code: str, work_dir: str, timeout: Optional[int] = None) -> Tuple[int, str, str]:
+        """在会话租用的执行进程内运行python代码"""
+        timeout = timeout or DEFAULT_TIMEOUT
+        filename = f"tmp_code_{md5(code.encode()).hexdigest()}.py"
+        (Path(work_dir) / 'output').mkdir(exist_ok=True, parents=True)
+        result = self.kernel_lease.execute(code, filename, work_dir, timeout)
+        if result is None:
+            return 1, TIMEOUT_MSG, ""
+        if result['exitcode']:
+            abs_path = str(Path(os.path.join(work_dir, filename)).absolute())
+            logs = result['stderr'].replace(abs_path, '').replace(filename, '')
+        else:
+            logs = result['stdout']
+        return result['exitcode'], logs, ""
+
     def run_with_dir(self, code: str, dir_path: str, lang: str) -> (int, str, list):
         """在指定目录下运行代码，并返回日志和生成的文件列表"""
-        exitcode, logs, _ = self.execute_code(
-            code,
-            work_dir=dir_path,
-            lang=lang,
-        )
+        if self.use_kernel(lang):
+            exitcode, logs, _ = self.execute_in_kernel(code, work_dir=dir_path)
+        else:
+            exitcode, logs, _ = self.execute_code(
+                code,
+                work_dir=dir_path,
+                lang=lang,
+            )
         logs += '\n' + logs
         file_list = []
         if exitcode != 0:
@@ -243,7 +270,9 @@ class LocalExecutor(BaseExecutor):
         for i, code_block in enumerate(code_blocks):
             lang, code = code_block
             lang = self.infer_lang(code)
-            code = self.insert_set_font_code(code)
+            if not self.use_kernel(lang):
+                # 执行进程启动时已经设置过字体
+                code = self.insert_set_font_code(code)
             if self.local_sync_path and os.path.exists(self.local_sync_path):
                 exit_code, logs, file_list = self.run_with_dir(code, dir_path=self.local_sync_path, lang=lang)
             else:
@@ -256,6 +285,13 @@ class LocalExecutor(BaseExecutor):
 
         return {'exitcode': 0, 'log': logs_all, 'file_list': all_file_list}
 
+    def close(self) -> None:
+        if self.kernel_lease is not None:
+            self.kernel_lease.close()
+
+    def __del__(self):
+        self.close()
+
     def sync_files_to_local(self, files_info: List[DirEntry], root_path: str):
         if not files_info:
             return
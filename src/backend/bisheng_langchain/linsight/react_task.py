@@ -10,7 +10,7 @@ from bisheng_langchain.linsight.const import TaskStatus, CallUserInputToolName
 from bisheng_langchain.linsight.event import NeedUserInput, ExecStep
 from bisheng_langchain.linsight.react_prompt import ReactSingleAgentPrompt, ReactLoopAgentPrompt
 from bisheng_langchain.linsight.task import BaseTask
-from bisheng_langchain.linsight.utils import encode_str_tokens, generate_uuid_str, \
+from bisheng_langchain.linsight.utils import token_counter, generate_uuid_str, \
     extract_json_from_markdown
 
 
@@ -28,9 +28,9 @@ class ReactTask(BaseTask):
             else:
                 remain_messages.append(one)
 
-        all_tool_messages_str = json.dumps([json.loads(one.content) for one in tool_messages], ensure_ascii=False,
-                                           indent=2)
-        if len(encode_str_tokens(all_tool_messages_str)) > self.exec_config.tool_buffer:
+        tool_messages_tokens = token_counter.count_messages(
+            tool_messages, lambda one: json.dumps(json.loads(one.content), ensure_ascii=False, indent=2))
+        if tool_messages_tokens > self.exec_config.tool_buffer:
             messages_str = ''
             for one in self.history:
                 messages_str += "\n" + one.content + ","
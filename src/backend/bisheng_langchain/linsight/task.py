@@ -17,7 +17,7 @@ from bisheng_langchain.linsight.const import TaskStatus, CallUserInputToolName,
 from bisheng_langchain.linsight.event import ExecStep, GenerateSubTask, BaseEvent, NeedUserInput, TaskStart, TaskEnd
 from bisheng_langchain.linsight.prompt import SingleAgentPrompt, SummarizeHistoryPrompt, LoopAgentSplitPrompt, \
     LoopAgentPrompt, SummarizeAnswerPrompt, SplitEvent
-from bisheng_langchain.linsight.utils import encode_str_tokens, generate_uuid_str, \
+from bisheng_langchain.linsight.utils import token_counter, generate_uuid_str, \
     record_llm_prompt, extract_json_from_markdown, get_model_name_from_llm
 
 
@@ -468,9 +468,9 @@ class Task(BaseTask):
                 all_tool_messages.append(one)
             else:
                 all_remain_messages.append(one)
-        all_tool_messages_str = json.dumps([one.model_dump() for one in all_tool_messages], ensure_ascii=False,
-                                           indent=2)
-        if len(encode_str_tokens(all_tool_messages_str)) > self.exec_config.tool_buffer:
+        tool_messages_tokens = token_counter.count_messages(
+            all_tool_messages, lambda one: json.dumps(one.model_dump(), ensure_ascii=False, indent=2))
+        if tool_messages_tokens > self.exec_config.tool_buffer:
             messages_str = json.dumps([one.model_dump() for one in messages], ensure_ascii=False, indent=2)
             history_summary = await self.summarize_history(messages_str)
             # 将总结后的历史记录插入到system_message后面
@@ -7,6 +7,8 @@ from typing import Any
 from langchain_core.language_models import BaseLanguageModel
 from transformers import AutoTokenizer
 
+from bisheng_langchain.utils.token_budget import TokenCounter
+
 tokenizer = AutoTokenizer.from_pretrained(os.path.join(os.path.dirname(__file__), "resource/model_tokenizer"),
                                           trust_remote_code=True)
 
@@ -72,6 +74,10 @@ def encode_str_tokens(text: str) -> list[int]:
     return tokens
 
 
+# 按消息缓存token数，历史记录每轮只需要对新增的消息分词
+token_counter = TokenCounter('linsight', encode_str_tokens)
+
+
 def generate_uuid_str() -> str:
     """
     Generate a UUID string.
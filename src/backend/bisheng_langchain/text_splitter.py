@@ -94,9 +94,14 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
             separator_rule: Optional[List[str]] = None,
             is_separator_regex: bool = False,
             keep_separator: bool = True,
+            share_metadata: bool = False,
             **kwargs: Any,
     ) -> None:
-        """Create a new TextSplitter."""
+        """Create a new TextSplitter.
+
+        share_metadata: 为True时分块不再深拷贝整个文档的metadata，文档级别的字段直接引用，
+            只保留分块自身的chunk_bboxes，不再携带整个文档的indexes、pages、types、bboxes
+        """
         super().__init__(
             separators=separators,
             keep_separator=keep_separator,
@@ -107,6 +112,7 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
         self.separator_rule = {one: self._separator_rule[index] for index, one in enumerate(separators)}
         self._is_separator_regex = is_separator_regex
         self._chunk_overlap = kwargs.get('chunk_overlap', 0)
+        self._share_metadata = share_metadata
 
     def split_documents(self, documents: Iterable[Document]) -> List[Document]:
         texts, metadatas = [], []
@@ -161,6 +167,14 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
     def split_text(self, text: str) -> List[str]:
         return self._split_text(text, self._separators)
 
+    # 文档级别的元素位置信息，分块只需要自身对应的部分
+    _elem_metadata_keys = ('indexes', 'pages', 'types', 'bboxes')
+
+    def _new_chunk_metadata(self, metadata: dict) -> dict:
+        if not self._share_metadata:
+            return copy.deepcopy(metadata)
+        return {key: value for key, value in metadata.items() if key not in self._elem_metadata_keys}
+
     def create_documents(
             self, texts: List[str], metadatas: Optional[List[dict]] = None
     ) -> List[Document]:
@@ -175,8 +189,9 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
             searcher = IntervalSearch(indexes)
             split_texts = self.split_text(text)
             for chunk in split_texts:
-                new_metadata = copy.deepcopy(metadatas[i])
+                new_metadata = self._new_chunk_metadata(metadatas[i])
                 if indexes and bboxes:
+                    # 分块按顺序产生，从上一个分块的起点往后查找即可
                     index = text.find(chunk, index + 1)
                     inter0 = [index, index + len(chunk) - 1]
                     norm_inter = searcher.find(inter0)
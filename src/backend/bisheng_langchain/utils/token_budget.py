@@ -0,0 +1,72 @@
+import json
+from typing import Any, Callable, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+# 消息对象上缓存token数的属性名，以下划线开头不会被序列化
+_TOKEN_CACHE_ATTR = '_token_count_cache'
+
+
+def get_message_token_text(message: BaseMessage) -> str:
+    """ 消息中参与token计数的文本，多模态消息只统计文本部分 """
+    content = message.content
+    if isinstance(content, list):
+        text = ''.join(one.get('text', '') if isinstance(one, dict) else str(one) for one in content)
+    else:
+        text = str(content)
+    if isinstance(message, AIMessage) and 'tool_calls' in message.additional_kwargs:
+        text += json.dumps(message.additional_kwargs['tool_calls'], ensure_ascii=False)
+    return text
+
+
+class TokenCounter:
+    """
+    基于指定分词器的token计数，单条消息的token数缓存在消息对象上，
+    消息文本没有变化时不会重复分词，多轮对话中每次只需要对新增的消息分词
+    """
+
+    def __init__(self, name: str, encode: Callable[[str], Sequence[int]]):
+        # 同一条消息可能被不同的分词器计数，缓存按name区分
+        self.name = name
+        self.encode = encode
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self.encode(text))
+
+    def count_message(self, message: Any, text: Optional[str] = None) -> int:
+        """ text: 参与计数的文本，默认为get_message_token_text的结果 """
+        if text is None:
+            text = get_message_token_text(message)
+        cache = getattr(message, _TOKEN_CACHE_ATTR, None)
+        if cache is None:
+            cache = {}
+            setattr(message, _TOKEN_CACHE_ATTR, cache)
+        cached = cache.get(self.name)
+        # 文本变化后缓存失效，字符串比较会先比较对象是否相同
+        if cached is not None and cached[0] == text:
+            return cached[1]
+        num = self.count_text(text)
+        cache[self.name] = (text, num)
+        return num
+
+    def count_messages(self, messages: List[Any], get_text: Callable[[Any], str] = None) -> int:
+        if get_text is None:
+            return sum(self.count_message(one) for one in messages)
+        return sum(self.count_message(one, get_text(one)) for one in messages)
+
+    def trim_messages(self, messages: List[Any], max_token: int) -> List[Any]:
+        """
+        从最新的消息往前累加token数，保留不超过max_token的最近的消息，至少保留最后一条消息
+        """
+        if not messages:
+            return messages
+        start = len(messages) - 1
+        total = 0
+        for index in range(len(messages) - 1, -1, -1):
+            total += self.count_message(messages[index])
+            if total > max_token:
+                break
+            start = index
+        return messages[start:]
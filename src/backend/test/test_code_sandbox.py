@@ -0,0 +1,65 @@
+"""
+代码节点沙箱进程池：进程复用、用户代码异常、超时和进程异常退出后的恢复
+"""
+import pytest
+
+from bisheng.settings import CodeSandboxConf
+from bisheng.workflow.nodes.code.sandbox import CodeSandboxError, CodeSandboxPool
+
+CODE = '''
+import os
+import time
+
+
+def main(action: str = 'pid', arg: int = 0) -> dict:
+    if action == 'sleep':
+        time.sleep(arg)
+    elif action == 'raise':
+        raise ValueError('bad input')
+    elif action == 'exit':
+        os._exit(arg)
+    return {'pid': os.getpid()}
+'''
+
+
+@pytest.fixture
+def pool():
+    sandbox_pool = CodeSandboxPool(CodeSandboxConf(pool_size=1, timeout=2, max_calls=100))
+    yield sandbox_pool
+    sandbox_pool.close()
+
+
+def test_sandbox_process_is_reused(pool):
+    first = pool.exec_method(CODE, 'main', {})
+    assert pool.exec_method(CODE, 'main', {}) == first
+
+
+def test_user_error_keeps_sandbox(pool):
+    pid = pool.exec_method(CODE, 'main', {})['pid']
+    with pytest.raises(CodeSandboxError) as exc_info:
+        pool.exec_method(CODE, 'main', {'action': 'raise'})
+    assert not exc_info.value.fatal
+    assert 'bad input' in str(exc_info.value)
+    assert pool.exec_method(CODE, 'main', {})['pid'] == pid
+
+
+def test_syntax_error_is_reported(pool):
+    with pytest.raises(CodeSandboxError) as exc_info:
+        pool.exec_method('def main(:\n    pass', 'main', {})
+    assert not exc_info.value.fatal
+
+
+def test_timeout_kills_and_recovers(pool):
+    pid = pool.exec_method(CODE, 'main', {})['pid']
+    with pytest.raises(CodeSandboxError) as exc_info:
+        pool.exec_method(CODE, 'main', {'action': 'sleep', 'arg': 30})
+    assert exc_info.value.fatal
+    assert pool.exec_method(CODE, 'main', {})['pid'] != pid
+
+
+def test_crash_recovers(pool):
+    pid = pool.exec_method(CODE, 'main', {})['pid']
+    with pytest.raises(CodeSandboxError) as exc_info:
+        pool.exec_method(CODE, 'main', {'action': 'exit', 'arg': 3})
+    assert exc_info.value.fatal
+    assert pool.exec_method(CODE, 'main', {})['pid'] != pid
@@ -1,4 +1,7 @@
 from docx import Document
+from PIL import Image
+
+from bisheng.utils.docx_temp import DocxTemplateRender, PlaceholderMatcher
 
 
 def show_sec(sec):
@@ -36,7 +39,7 @@ def show_run_info(run, doc):
     print('run font size', run.font.size)
 
 
-def test(document):
+def show_document(document):
     print('-------------DEBUG---------')
     secs = document.sections
     for sec in secs:
@@ -59,5 +62,44 @@ def test(document):
         print(idx, uu)
 
 
-document = Document('bisheng.docx')
-test(document)
+def _render(tmp_path, paragraphs, template_def, resources=None):
+    template = Document()
+    for text in paragraphs:
+        template.add_paragraph(text)
+    template_path = tmp_path / 'template.docx'
+    template.save(template_path)
+    return DocxTemplateRender(str(template_path)).render(template_def, resources)
+
+
+def test_placeholder_matcher_prefers_longest_key():
+    matcher = PlaceholderMatcher(['{{a}}', '{{ab}}', '__RESOURCE_0001__'])
+    text = '{{ab}} {{a}}__RESOURCE_0001__'
+    matches = matcher.find_all(text)
+    assert [key for _, _, key in matches] == ['{{ab}}', '{{a}}', '__RESOURCE_0001__']
+    assert matcher.replace(text, matches, {'{{a}}': '1', '{{ab}}': '2', '__RESOURCE_0001__': '3'}) == '2 13'
+
+
+def test_render_does_not_rescan_values(tmp_path):
+    doc = _render(tmp_path, ['x={{x}}, y={{y}}'], [['{{x}}', '{{y}}'], ['{{y}}', 'Y']])
+    assert doc.paragraphs[0].text == 'x={{y}}, y=Y'
+
+
+def test_render_image_inside_inserted_markdown_table(tmp_path):
+    image_path = tmp_path / 'image.png'
+    Image.new('RGB', (8, 8), 'red').save(image_path)
+    resources = {
+        'images': [{'placeholder': '__RESOURCE_0002__', 'local_path': str(image_path), 'alt_text': 'image',
+                    'type': 'local'}],
+        'markdown_tables': [{'placeholder': '__RESOURCE_0001__',
+                             'content': '| name | picture |\n| --- | --- |\n| a | __RESOURCE_0002__ |'}],
+    }
+    doc = _render(tmp_path, ['{{table}}'], [['{{table}}', '__RESOURCE_0001__']], resources)
+
+    assert len(doc.tables) == 1
+    cell_text = ''.join(cell.text for row in doc.tables[0].rows for cell in row.cells)
+    assert '__RESOURCE_0002__' not in cell_text
+    assert len(doc.inline_shapes) == 1
+
+
+if __name__ == '__main__':
+    show_document(Document('bisheng.docx'))
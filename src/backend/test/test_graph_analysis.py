@@ -0,0 +1,187 @@
+"""
+工作流拓扑分析和原先路径枚举实现的对比：节点层级、扇入节点的互斥判断和是否等待的结果必须完全一致，
+同时校验多个菱形串联的工作流上分析耗时和规模线性相关
+"""
+import random
+import time
+
+import pytest
+
+from bisheng.workflow.edges.edges import EdgeManage
+from bisheng.workflow.graph import graph_analysis
+from bisheng.workflow.graph.graph_analysis import GraphAnalyzer
+
+
+def legacy_node_level(edges: EdgeManage, start_node: str) -> dict:
+    """ 原 GraphEngine.build_node_level 的实现 """
+    node_level = {}
+
+    def mark_node_level(node_id, node_map: dict, level: int):
+        if node_id in node_map:
+            return
+        node_level[node_id] = max(node_level.get(node_id, 0), level)
+        node_map[node_id] = True
+        for one_node in edges.get_target_node(node_id) or []:
+            mark_node_level(one_node, node_map.copy(), level + 1)
+
+    mark_node_level(start_node, {}, 0)
+    return node_level
+
+
+def legacy_all_edges_nodes(edges: EdgeManage, start_node_id: str, end_node_id: str) -> list:
+    """ 原 EdgeManage.get_all_edges_nodes 的实现 """
+    branches = []
+
+    def get_node_branch(node_id, branch: list, node_map: dict):
+        if node_id in node_map or node_id == end_node_id:
+            branch.append(node_id)
+            branches.append(branch)
+            return
+        branch.append(node_id)
+        node_map[node_id] = True
+        next_nodes = edges.get_target_node(node_id)
+        if not next_nodes:
+            branches.append(branch)
+            return
+        for one_node in next_nodes:
+            get_node_branch(one_node, branch.copy(), node_map.copy())
+
+    get_node_branch(start_node_id, [], {})
+    return branches
+
+
+def legacy_is_exclusive(edges: EdgeManage, condition_nodes: list, node_id: str) -> bool:
+    """ 原 GraphEngine.parse_fan_in_node 中互斥收尾节点的判断 """
+    all_branches = []
+    for one in condition_nodes:
+        if node_id == one:
+            continue
+        for branch in legacy_all_edges_nodes(edges, one, node_id):
+            if node_id not in branch:
+                continue
+            branch.remove(node_id)
+            branch.remove(one)
+            all_branches.append(set(branch))
+    for i in range(len(all_branches)):
+        for j in range(i + 1, len(all_branches)):
+            if not (all_branches[i] & all_branches[j]):
+                return True
+    return False
+
+
+def make_edge(source: str, target: str) -> dict:
+    return {'id': f'{source}-{target}', 'source': source, 'sourceHandle': '', 'target': target,
+            'targetHandle': ''}
+
+
+def diamond_chain(num: int) -> (list, list):
+    """ start -> c0 -> (a0 | b0) -> m0 -> c1 -> ... -> end，返回边和condition节点 """
+    edges = [make_edge('start', 'condition_0')]
+    condition_nodes = []
+    for i in range(num):
+        condition = f'condition_{i}'
+        condition_nodes.append(condition)
+        merge = f'condition_{i + 1}' if i + 1 < num else 'end'
+        edges.extend([make_edge(condition, f'a_{i}'), make_edge(condition, f'b_{i}'),
+                      make_edge(f'a_{i}', merge), make_edge(f'b_{i}', merge)])
+    return edges, condition_nodes
+
+
+def random_graph(node_num: int, edge_num: int, rnd: random.Random) -> (list, list):
+    nodes = ['start'] + [f'condition_{i}' if rnd.random() < 0.3 else f'node_{i}' for i in range(node_num)]
+    edges = [make_edge('start', nodes[1])]
+    for _ in range(edge_num):
+        source, target = rnd.sample(nodes[1:], 2)
+        edges.append(make_edge(source, target))
+    return edges, [one for one in nodes if one.startswith('condition_')]
+
+
+def fan_in_wait(edge_manage: EdgeManage, node_level: dict, node_id: str, exclusive: bool) -> bool:
+    """ GraphEngine.parse_fan_in_node 中扇入节点是否需要等待所有前驱 """
+    source_ids = edge_manage.get_source_node(node_id)
+    if any(node_level[one] > node_level[node_id] for one in source_ids):
+        return False
+    return not exclusive
+
+
+def random_graphs(times: int, seed: int = 0):
+    rnd = random.Random(seed)
+    for _ in range(times):
+        yield random_graph(rnd.randint(3, 8), rnd.randint(3, 12), rnd)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_node_level_matches_legacy(seed):
+    for edges, _ in random_graphs(300, seed):
+        edge_manage = EdgeManage(edges)
+        assert GraphAnalyzer(edge_manage).get_node_level('start') == legacy_node_level(edge_manage, 'start'), edges
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_fan_in_decision_matches_legacy(seed):
+    for edges, condition_nodes in random_graphs(300, seed):
+        edge_manage = EdgeManage(edges)
+        analyzer = GraphAnalyzer(edge_manage)
+        new_level = analyzer.get_node_level('start')
+        legacy_level = legacy_node_level(edge_manage, 'start')
+        for node_id in {one['target'] for one in edges}:
+            exclusive = analyzer.is_exclusive_merge_node(node_id, condition_nodes)
+            assert exclusive == legacy_is_exclusive(edge_manage, condition_nodes, node_id), (edges, node_id)
+            source_ids = edge_manage.get_source_node(node_id)
+            if node_id not in new_level or any(one not in new_level for one in source_ids):
+                continue
+            assert (fan_in_wait(edge_manage, new_level, node_id, exclusive)
+                    == fan_in_wait(edge_manage, legacy_level, node_id, exclusive)), (edges, node_id)
+
+
+def test_loop_back_source_is_not_waited():
+    edges = [make_edge('start', 'node_0'), make_edge('node_0', 'node_3'), make_edge('node_0', 'condition_2'),
+             make_edge('condition_2', 'condition_1'), make_edge('node_3', 'condition_1'),
+             make_edge('condition_1', 'node_3')]
+    condition_nodes = ['condition_1', 'condition_2']
+    for one in (edges, edges[::-1]):
+        edge_manage = EdgeManage(one)
+        analyzer = GraphAnalyzer(edge_manage)
+        node_level = analyzer.get_node_level('start')
+        exclusive = analyzer.is_exclusive_merge_node('condition_1', condition_nodes)
+        assert not fan_in_wait(edge_manage, node_level, 'condition_1', exclusive)
+
+
+def test_large_cycle_level_is_independent_of_edge_order(monkeypatch):
+    monkeypatch.setattr(graph_analysis, '_MAX_CYCLE_PATH_STEPS', 50)
+    nodes = [f'node_{i}' for i in range(8)]
+    edges = [make_edge('start', nodes[0]), make_edge('start', nodes[3])]
+    edges.extend(make_edge(source, target) for source in nodes for target in nodes if source != target)
+    node_level = GraphAnalyzer(EdgeManage(edges)).get_node_level('start')
+    assert node_level.keys() == set(nodes) | {'start'}
+    for _ in range(5):
+        random.Random(_).shuffle(edges)
+        assert GraphAnalyzer(EdgeManage(edges)).get_node_level('start') == node_level
+
+
+@pytest.mark.parametrize('num', [4, 8, 10])
+def test_diamond_chain_matches_legacy(num):
+    edges, condition_nodes = diamond_chain(num)
+    edge_manage = EdgeManage(edges)
+    analyzer = GraphAnalyzer(edge_manage)
+    assert analyzer.get_node_level('start') == legacy_node_level(edge_manage, 'start')
+    for node_id in edge_manage.target_map:
+        assert (analyzer.is_exclusive_merge_node(node_id, condition_nodes)
+                == legacy_is_exclusive(edge_manage, condition_nodes, node_id))
+
+
+def test_diamond_chain_scales_linearly():
+    edges, condition_nodes = diamond_chain(1000)
+    edge_manage = EdgeManage(edges)
+    fan_in_nodes = [one for one in edge_manage.target_map if len(edge_manage.target_map[one]) > 1]
+
+    start = time.perf_counter()
+    analyzer = GraphAnalyzer(edge_manage)
+    node_level = analyzer.get_node_level('start')
+    exclusive = [analyzer.is_exclusive_merge_node(one, condition_nodes) for one in fan_in_nodes]
+    cost = time.perf_counter() - start
+
+    assert node_level['end'] == 2001
+    assert all(exclusive)
+    # 原先的路径枚举在14个菱形时已经需要数秒
+    assert cost < 5
@@ -0,0 +1,74 @@
+"""
+MarkdownTableWriter 逐行写入时的分片：表头、伪表头、仅表头和表头超出总行数的情况
+"""
+import os
+
+from bisheng.api.services.md_from_excel import MarkdownTableWriter
+
+SEPARATOR = '|---|---|'
+
+
+def write_rows(output_dir, rows, num_header_rows=(0, 0), rows_per_markdown=2, append_header=True) -> dict:
+    writer = MarkdownTableWriter('1', 2, list(num_header_rows), rows_per_markdown, str(output_dir),
+                                 append_header=append_header)
+    for row in rows:
+        writer.add_row(row)
+    writer.close()
+    result = {}
+    for file_name in sorted(os.listdir(output_dir)):
+        with open(os.path.join(output_dir, file_name), encoding='utf-8') as f:
+            result[file_name] = f.read().split('\n')
+    return result
+
+
+def make_rows(count: int) -> list:
+    return [[f'a{i}', f'b{i}'] for i in range(count)]
+
+
+def test_every_chunk_has_header(tmp_path):
+    files = write_rows(tmp_path, [['h1', 'h2']] + make_rows(5))
+    assert list(files) == ['01000.md', '01001.md', '01002.md']
+    for lines in files.values():
+        assert lines[:2] == ['| h1 | h2 |', SEPARATOR]
+    assert files['01000.md'][2:] == ['| a0 | b0 |', '| a1 | b1 |']
+    assert files['01001.md'][2:] == ['| a2 | b2 |', '| a3 | b3 |']
+    assert files['01002.md'][2:] == ['| a4 | b4 |']
+
+
+def test_multi_row_header(tmp_path):
+    files = write_rows(tmp_path, [['h1', 'h2'], ['s1', 's2']] + make_rows(3), num_header_rows=(0, 1))
+    assert list(files) == ['01000.md', '01001.md']
+    assert files['01000.md'] == ['| h1 | h2 |', SEPARATOR, '| s1 | s2 |', '| a0 | b0 |', '| a1 | b1 |']
+    assert files['01001.md'] == ['| h1 | h2 |', SEPARATOR, '| s1 | s2 |', '| a2 | b2 |']
+
+
+def test_without_header_uses_first_row_of_chunk(tmp_path):
+    files = write_rows(tmp_path, make_rows(5), append_header=False)
+    assert files == {
+        '01000.md': ['| a0 | b0 |', SEPARATOR, '| a1 | b1 |'],
+        '01001.md': ['| a2 | b2 |', SEPARATOR, '| a3 | b3 |'],
+        '01002.md': ['| a4 | b4 |', SEPARATOR],
+    }
+
+
+def test_header_only(tmp_path):
+    files = write_rows(tmp_path, [['h1', 'h2']])
+    assert files == {'01000.md': ['| h1 | h2 |', SEPARATOR]}
+
+
+def test_header_out_of_range_is_data(tmp_path):
+    files = write_rows(tmp_path, make_rows(3), num_header_rows=(5, 6))
+    assert files == {
+        '01000.md': ['| a0 | b0 |', SEPARATOR, '| a1 | b1 |'],
+        '01001.md': ['| a2 | b2 |', SEPARATOR],
+    }
+
+
+def test_no_slicing_writes_one_file(tmp_path):
+    files = write_rows(tmp_path, [['h1', 'h2']] + make_rows(5), rows_per_markdown=0)
+    assert list(files) == ['01000.md']
+    assert files['01000.md'] == ['| h1 | h2 |', SEPARATOR] + [f'| a{i} | b{i} |' for i in range(5)]
+
+
+def test_empty_input_writes_nothing(tmp_path):
+    assert write_rows(tmp_path, []) == {}
@@ -0,0 +1,74 @@
+"""
+TokenCounter：消息token数的缓存、文本变化后的失效，以及按token数截断历史消息
+"""
+from langchain_core.messages import AIMessage, HumanMessage
+
+from bisheng_langchain.utils.token_budget import TokenCounter, get_message_token_text
+
+
+class CountingEncoder:
+    """ 按空格分词，并记录被分词的文本 """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, text: str) -> list:
+        self.calls.append(text)
+        return text.split()
+
+
+def test_message_count_is_cached():
+    encoder = CountingEncoder()
+    counter = TokenCounter('test', encoder)
+    messages = [HumanMessage(content='a b c'), AIMessage(content='d e')]
+    assert counter.count_messages(messages) == 5
+    assert counter.count_messages(messages) == 5
+    assert encoder.calls == ['a b c', 'd e']
+
+    # 多轮对话中只对新增的消息分词
+    messages.append(HumanMessage(content='f'))
+    assert counter.count_messages(messages) == 6
+    assert encoder.calls == ['a b c', 'd e', 'f']
+
+
+def test_cache_invalidated_when_text_changes():
+    encoder = CountingEncoder()
+    counter = TokenCounter('test', encoder)
+    message = HumanMessage(content='a b')
+    assert counter.count_message(message) == 2
+    message.content = 'a b c'
+    assert counter.count_message(message) == 3
+    assert encoder.calls == ['a b', 'a b c']
+
+
+def test_cache_is_separated_by_counter_name():
+    message = HumanMessage(content='a b c')
+    assert TokenCounter('words', lambda text: text.split()).count_message(message) == 3
+    assert TokenCounter('chars', list).count_message(message) == 5
+    assert TokenCounter('words', lambda text: text.split()).count_message(message) == 3
+
+
+def test_custom_text_getter():
+    counter = TokenCounter('test', CountingEncoder())
+    messages = [HumanMessage(content='a b c'), HumanMessage(content='d')]
+    assert counter.count_messages(messages, get_text=lambda one: one.content + ' x') == 6
+
+
+def test_message_token_text():
+    multimodal = HumanMessage(content=[{'type': 'text', 'text': 'hello'},
+                                       {'type': 'image_url', 'image_url': {'url': 'http://a'}}])
+    assert get_message_token_text(multimodal) == 'hello'
+    tool_calls = [{'id': '1', 'function': {'name': 'search', 'arguments': '{}'}}]
+    tool_message = AIMessage(content='', additional_kwargs={'tool_calls': tool_calls})
+    assert 'search' in get_message_token_text(tool_message)
+
+
+def test_trim_messages_keeps_latest():
+    counter = TokenCounter('test', CountingEncoder())
+    messages = [HumanMessage(content='a b c'), AIMessage(content='d e'), HumanMessage(content='f')]
+    assert counter.trim_messages(messages, 100) == messages
+    assert counter.trim_messages(messages, 3) == messages[1:]
+    assert counter.trim_messages(messages, 2) == messages[2:]
+    # 最后一条消息超过限制时也保留
+    assert counter.trim_messages(messages, 0) == messages[2:]
+    assert counter.trim_messages([], 10) == []